@@ -0,0 +1,140 @@
+from pymongo import UpdateOne
+from bson import ObjectId
+from database import db_instance
+from cache import aggregation_cache
+import conditional
+
+# A listing counts towards its agent while it is on the market, and an
+# inquiry while it has not been closed.
+ACTIVE_LISTING_STATUSES = ('Available', 'Pending')
+OPEN_INQUIRY_STATUSES = ('Pending', 'Responded')
+
+COUNTER_FIELDS = ('activeListings', 'listedValue', 'openInquiries')
+
+# Per-agent counters kept on the agent documents with $inc deltas from every
+# property and inquiry write, the same way property_stats is maintained.
+# Each delta is one atomic single-document update and deltas commute, so
+# concurrent writers never lose counts. A crash between a listing write and
+# its delta can leave an agent off by that one write; reconcile() recomputes
+# the counters from the source collections.
+#
+# The record_* functions return the collections they wrote (('agents',) or
+# nothing) so the caller bumps their versions with its own, in one
+# conditional.touch round trip.
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def zero_counters():
+    return {field: 0 for field in COUNTER_FIELDS}
+
+def _agent(doc):
+    agent_id = doc.get('agentId')
+    return agent_id if isinstance(agent_id, ObjectId) else None
+
+def _property_changes(prop, sign):
+    agent_id = _agent(prop)
+    if agent_id is None or prop.get('status', 'Available') not in ACTIVE_LISTING_STATUSES:
+        return []
+    price = prop.get('price')
+    return [(agent_id, {'activeListings': sign, 'listedValue': sign * price if _is_number(price) else 0})]
+
+def _inquiry_changes(inquiry, sign):
+    agent_id = _agent(inquiry)
+    if agent_id is None or inquiry.get('status', 'Pending') not in OPEN_INQUIRY_STATUSES:
+        return []
+    return [(agent_id, {'openInquiries': sign})]
+
+CHANGES = {
+    'properties': _property_changes,
+    'inquiries': _inquiry_changes
+}
+
+def _apply(changes):
+    merged = {}
+    for agent_id, inc in changes:
+        totals = merged.setdefault(agent_id, {})
+        for field, delta in inc.items():
+            totals[field] = totals.get(field, 0) + delta
+
+    ops = []
+    for agent_id, inc in merged.items():
+        inc = {field: delta for field, delta in inc.items() if delta}
+        if not inc:
+            continue
+        # Bumping the revision keeps the agent's ETag honest
+        ops.append(UpdateOne({'_id': agent_id}, {
+            '$inc': {**inc, 'revision': 1},
+            '$currentDate': {'updatedAt': True}
+        }))
+    if not ops:
+        return ()
+
+    db_instance.agents.bulk_write(ops, ordered=False)
+    aggregation_cache.invalidate('agents')
+    return ('agents',)
+
+def record_insert(source, doc):
+    return _apply(CHANGES[source](doc, 1))
+
+def record_delete(source, doc):
+    return _apply(CHANGES[source](doc, -1))
+
+def record_update(source, old_doc, new_doc):
+    return _apply(CHANGES[source](old_doc, -1) + CHANGES[source](new_doc, 1))
+
+def record_many(source, pairs):
+    changes = []
+    for old_doc, new_doc in pairs:
+        if old_doc is not None:
+            changes += CHANGES[source](old_doc, -1)
+        if new_doc is not None:
+            changes += CHANGES[source](new_doc, 1)
+    return _apply(changes)
+
+def _actual_counters():
+    actual = {}
+    listings = db_instance.properties.aggregate([
+        {"$match": {"status": {"$in": list(ACTIVE_LISTING_STATUSES)}, "agentId": {"$type": "objectId"}}},
+        {"$group": {
+            "_id": "$agentId",
+            "activeListings": {"$sum": 1},
+            "listedValue": {"$sum": {"$cond": [{"$isNumber": "$price"}, "$price", 0]}}
+        }}
+    ])
+    for row in listings:
+        actual.setdefault(row['_id'], zero_counters()).update(
+            activeListings=row['activeListings'], listedValue=row['listedValue']
+        )
+    inquiries = db_instance.inquiries.aggregate([
+        {"$match": {"status": {"$in": list(OPEN_INQUIRY_STATUSES)}, "agentId": {"$type": "objectId"}}},
+        {"$group": {"_id": "$agentId", "openInquiries": {"$sum": 1}}}
+    ])
+    for row in inquiries:
+        actual.setdefault(row['_id'], zero_counters())['openInquiries'] = row['openInquiries']
+    return actual
+
+def reconcile(apply=True):
+    # Recomputes every agent's counters with one $group per source collection
+    # and corrects the agents that drifted. Writes racing with it can be
+    # overwritten, so it is meant for quiet periods (or run twice).
+    actual = _actual_counters()
+    drift = []
+    for agent in db_instance.agents.find({}, {field: 1 for field in COUNTER_FIELDS}):
+        expected = actual.get(agent['_id'], zero_counters())
+        stored = {field: agent.get(field) for field in COUNTER_FIELDS}
+        if stored != expected:
+            drift.append({"agentId": agent['_id'], "stored": stored, "actual": expected})
+
+    if apply and drift:
+        db_instance.agents.bulk_write([
+            UpdateOne({'_id': row['agentId']}, {
+                '$set': row['actual'],
+                '$inc': {'revision': 1},
+                '$currentDate': {'updatedAt': True}
+            })
+            for row in drift
+        ], ordered=False)
+        conditional.touch('agents')
+        aggregation_cache.invalidate('agents')
+    return drift
@@ -1,19 +1,33 @@
+import os
+import click
 from flask import Flask, jsonify, request
-from database import Database
+from database import db_instance as db
+import property_stats
+import trends
+import agent_counters
 from routes.properties import properties_bp
 from routes.agents import agents_bp
 from routes.users import users_bp
 from routes.inquiries import inquiries_bp
 from routes.aggregation import aggregation_bp
+from routes.admin import admin_bp
+import index_advisor
+import references
+import conditional
+import metrics
+from serialization import MongoJSONProvider
 
 app = Flask(__name__)
-db = Database()
+app.json = MongoJSONProvider(app)
 
 app.register_blueprint(properties_bp, url_prefix='/api/properties')
 app.register_blueprint(agents_bp, url_prefix='/api/agents')
 app.register_blueprint(users_bp, url_prefix='/api/users')
 app.register_blueprint(inquiries_bp, url_prefix='/api/inquiries')
 app.register_blueprint(aggregation_bp, url_prefix='/api/aggregation')
+app.register_blueprint(admin_bp, url_prefix='/api/admin')
+
+metrics.init_app(app)
 
 @app.route('/')
 def home():
@@ -33,9 +47,70 @@ def init_database():
     try:
         db.create_indexes()
         db.seed_data()
+        property_stats.rebuild()
+        trends.rebuild()
+        agent_counters.reconcile()
+        conditional.touch('properties', 'agents', 'users', 'inquiries')
         return jsonify({"message": "Database initialized successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/health')
+def health():
+    # Liveness: answers without touching MongoDB
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route('/api/ready')
+def ready():
+    status = db.readiness()
+    status["pid"] = os.getpid()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/api/db/pool-stats')
+def pool_stats():
+    return jsonify(db.pool_stats())
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats():
+    count = property_stats.rebuild()
+    print(f"Rebuilt {count} property_stats documents")
+
+@app.cli.command('rebuild-trends')
+def rebuild_trends():
+    count = trends.rebuild()
+    print(f"Rebuilt {count} trend_rollups documents")
+
+@app.cli.command('reconcile-agent-counters')
+@click.option('--dry-run', is_flag=True, help='Report drifted counters without fixing them.')
+def reconcile_agent_counters(dry_run):
+    drift = agent_counters.reconcile(apply=not dry_run)
+    for row in drift:
+        print(f"{row['agentId']}: stored {row['stored']}, actual {row['actual']}")
+    print(f"{len(drift)} agents {'would be' if dry_run else 'were'} corrected")
+
+@app.cli.command('migrate-references')
+def migrate_references():
+    for field, count in references.migrate(db).items():
+        print(f"{field}: converted {count} string ids to ObjectId")
+
+@app.cli.command('index-advisor')
+@click.option('--apply', is_flag=True, help='Create the recommended indexes.')
+def index_advisor_command(apply):
+    report = index_advisor.analyze(include_catalog=True)
+    for row in report:
+        if not row['needsIndex']:
+            continue
+        filters = ", ".join(f"{field}:{kind}" for field, kind in row['filter'].items()) or "-"
+        sort = ", ".join(f"{field}:{direction}" for field, direction in row['sort']) or "-"
+        stages = " > ".join(row['plan'].get('stages', [])) or row['plan'].get('error', '')
+        print(f"{row['collection']}  filter[{filters}]  sort[{sort}]  plan[{stages}]")
+        print(f"    recommend {row['recommendedIndex']}")
+    flagged = sum(1 for row in report if row['needsIndex'])
+    print(f"{flagged} of {len(report)} query shapes use a COLLSCAN or blocking SORT without a matching index")
+    if apply:
+        for created in index_advisor.apply_recommendations(report):
+            print(f"Created {created['collection']}.{created['index']}")
+
 if __name__ == '__main__':
+    # Development server; production runs `gunicorn -c gunicorn.conf.py`
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,115 @@
+import math
+import os
+from database import db_instance
+
+APPROX_SAMPLE_SIZE = int(os.getenv('APPROX_SAMPLE_SIZE', '10000'))
+
+# Two-sided 95% normal interval
+Z_95 = 1.96
+
+# The exact endpoints' $group pipelines, run over a uniform $sample. Counts
+# are scaled up by population / sample size; averages carry a normal
+# confidence interval from the sampled standard deviation.
+
+def _sampled_groups(dimension, sample_size):
+    pipeline = [
+        {"$sample": {"size": sample_size}},
+        {
+            "$group": {
+                "_id": f"${dimension}",
+                "count": {"$sum": 1},
+                # Non-numeric prices (a string the API stored as sent) are
+                # left out of the price figures, as the exact stats do
+                "pricedCount": {"$sum": _if_priced(1)},
+                "totalPrice": {"$sum": _if_priced("$price")},
+                # sum of squares rather than $stdDevSamp, which mongomock
+                # (the benchmark backend) does not implement
+                "sumSquares": {"$sum": _if_priced({"$multiply": ["$price", "$price"]})}
+            }
+        }
+    ]
+    groups = list(db_instance.properties.aggregate(pipeline))
+    for group in groups:
+        group['averagePrice'] = group['totalPrice'] / group['pricedCount'] if group['pricedCount'] else None
+    return groups
+
+def _if_priced(expression):
+    return {"$cond": [{"$isNumber": "$price"}, expression, 0]}
+
+def _interval(estimate, margin):
+    return [round(estimate - margin, 2), round(estimate + margin, 2)]
+
+def _count_estimate(count, sampled, population, exact):
+    if exact:
+        return count, [count, count]
+    share = count / sampled
+    margin = Z_95 * math.sqrt(share * (1 - share) / sampled) * population
+    estimate = share * population
+    low, high = _interval(estimate, margin)
+    return round(estimate), [max(count, math.floor(low)), math.ceil(high)]
+
+def _average_estimate(group, exact):
+    average = group.get('averagePrice')
+    if average is None:
+        return None, None
+    if exact:
+        return round(average, 2), [round(average, 2), round(average, 2)]
+    n = group['pricedCount']
+    if n < 2:
+        return round(average, 2), None
+    variance = max(0, (group['sumSquares'] - n * average * average) / (n - 1))
+    margin = Z_95 * math.sqrt(variance / n)
+    return round(average, 2), _interval(average, margin)
+
+def estimate_groups(dimension, sample_size=APPROX_SAMPLE_SIZE):
+    population = db_instance.properties.estimated_document_count()
+    groups = _sampled_groups(dimension, sample_size)
+    sampled = sum(group['count'] for group in groups)
+    # $sample returns every document when the collection is smaller
+    exact = sampled >= population
+    rows = []
+    for group in groups:
+        count, count_interval = _count_estimate(group['count'], sampled, population, exact)
+        average, average_interval = _average_estimate(group, exact)
+        rows.append({
+            "key": group['_id'],
+            "count": count,
+            "countCI": count_interval,
+            "averagePrice": average,
+            "averagePriceCI": average_interval,
+            "sampled": group['count']
+        })
+    meta = {"sampleSize": sampled, "population": population, "exact": exact, "confidence": 0.95}
+    return rows, meta
+
+def average_price_by_city(sample_size=APPROX_SAMPLE_SIZE):
+    rows, meta = estimate_groups('city', sample_size)
+    data = [
+        {
+            "city": row['key'],
+            "averagePrice": row['averagePrice'],
+            "averagePriceCI": row['averagePriceCI'],
+            "propertyCount": row['count'],
+            "propertyCountCI": row['countCI'],
+            "sampled": row['sampled']
+        }
+        for row in rows
+    ]
+    data.sort(key=lambda row: (row['averagePrice'] is not None, row['averagePrice'] or 0), reverse=True)
+    return {"data": data, **meta}
+
+def properties_by_type(sample_size=APPROX_SAMPLE_SIZE):
+    rows, meta = estimate_groups('propertyType', sample_size)
+    data = [
+        {
+            "propertyType": row['key'],
+            "count": row['count'],
+            "countCI": row['countCI'],
+            "averagePrice": row['averagePrice'],
+            "averagePriceCI": row['averagePriceCI'],
+            "sampled": row['sampled']
+        }
+        for row in rows
+    ]
+    data.sort(key=lambda row: row['count'], reverse=True)
+    return {"data": data, **meta}
@@ -0,0 +1,374 @@
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from bson import ObjectId
+from flask import jsonify, request
+from pymongo import ASCENDING, DESCENDING
+from app import app as flask_app
+from database import db_instance
+from async_database import async_db_instance as db
+from cache import aggregation_cache
+from expansion import RELATIONS, attach, get_loader, lookup_query, parse_expand, reference_ids, related_collections
+from index_advisor import query_shapes
+from pagination import finish_page, page_query, page_sort, parse_limit
+from serialization import raw_documents
+from routes.aggregation import (
+    INQUIRY_STATISTICS_PIPELINE, LEADERBOARD_PROJECTION, LEADERBOARD_SIZE, LEADERBOARD_SORT, SECTIONS, wants_approx
+)
+from routes.properties import PROPERTY_RELATIONS, list_arguments
+from routes import inquiries as inquiry_routes, properties as property_routes
+import change_streams
+import conditional
+import metrics
+import property_stats
+
+# ASGI entry point: `uvicorn asgi:app --workers 4` (or gunicorn with
+# -k uvicorn.workers.UvicornWorker). The hot read routes below run as
+# coroutines on Motor, so a request waiting on MongoDB holds no thread; they
+# reuse the Flask routes' argument parsing, validators, row builders and JSON
+# provider, inside a Flask request context. Change streams (SSE) are served
+# here too, so a subscriber waits on a queue rather than holding a thread.
+# Every other route (writes, imports, geo, search, admin) runs the WSGI app on
+# a thread pool of ASGI_SYNC_THREADS threads, exactly as it does under
+# gunicorn.
+
+ASGI_SYNC_THREADS = int(os.getenv('ASGI_SYNC_THREADS', '16'))
+
+sync_executor = ThreadPoolExecutor(max_workers=ASGI_SYNC_THREADS, thread_name_prefix='wsgi')
+
+async def collection_validators(collection_names):
+    versions = await db.collection_versions.find(conditional.versions_query(collection_names)).to_list(None)
+    return conditional.validators_from_versions(collection_names, versions)
+
+async def collection_version(collection_names):
+    etag, _ = await collection_validators(list(collection_names))
+    return etag
+
+async def expand(docs, relations):
+    loader = get_loader()
+    for name in relations:
+        field, collection_name, fields = RELATIONS[name]
+        missing = loader.missing(collection_name, reference_ids(docs, field))
+        if missing:
+            found = await db.db[collection_name].find(lookup_query(missing), {field: 1 for field in fields}).to_list(None)
+            loader.store(collection_name, missing, found)
+        attach(docs, name, field, loader.documents(collection_name))
+    return docs
+
+async def _groups(dimension):
+    return await db.property_stats.find(
+        property_stats.groups_query(dimension), property_stats.SUMMARY_PROJECTION
+    ).to_list(None)
+
+async def _price_bounds(field, key):
+    query = property_stats.price_bound_query(field, key)
+    lowest, highest = await asyncio.gather(*(
+        db.properties.find_one(query, property_stats.PRICE_BOUND_PROJECTION, sort=[('price', direction)])
+        for direction in (ASCENDING, DESCENDING)
+    ))
+    return (lowest['price'] if lowest else None, highest['price'] if highest else None)
+
+async def average_price_by_city():
+    # Every city's min/max seeks are issued at once
+    groups = await _groups('city')
+    bounds = await asyncio.gather(*(_price_bounds('city', group['key']) for group in groups))
+    return property_stats.city_rows(groups, bounds)
+
+async def most_active_agents():
+    return await db.agents.find({}, LEADERBOARD_PROJECTION).sort(LEADERBOARD_SORT).limit(LEADERBOARD_SIZE).to_list(None)
+
+async def properties_by_type():
+    return property_stats.type_rows(await _groups('propertyType'))
+
+async def inquiry_statistics():
+    return await db.inquiries.aggregate(INQUIRY_STATISTICS_PIPELINE).to_list(None)
+
+async def price_range_distribution():
+    return property_stats.price_range_rows(await _groups('priceBucket'))
+
+SECTION_LOADERS = {
+    'averagePriceByCity': average_price_by_city,
+    'mostActiveAgents': most_active_agents,
+    'propertiesByType': properties_by_type,
+    'inquiryStatistics': inquiry_statistics,
+    'priceRangeDistribution': price_range_distribution
+}
+
+def load_section(name):
+    key, tags = SECTIONS[name]
+    return aggregation_cache.get_or_compute_async(key, SECTION_LOADERS[name], tags=tags, versions=collection_version)
+
+async def section(name):
+    if wants_approx():
+        # Sampled estimates stay on the WSGI routes
+        return None
+    try:
+        return jsonify(await load_section(name)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+async def overview():
+    try:
+        results = await asyncio.gather(*(load_section(name) for name in SECTIONS))
+        return jsonify(dict(zip(SECTIONS, results))), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+async def get_properties():
+    if request.args.get('near') or request.args.get('stream'):
+        # Geo pages and streamed bodies stay on the WSGI route
+        return None
+    try:
+        query, sort_by, sort_order, projection, relations = list_arguments(request.args)
+
+        etag, last_modified = await collection_validators(['properties'] + related_collections(relations))
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        limit = request.args.get('limit')
+        cursor = request.args.get('cursor')
+        if limit is None and cursor is None:
+            query_shapes.record('properties', query, [(sort_by, sort_order)])
+            collection = db.properties if relations else raw_documents(db.properties)
+            properties = await collection.find(query, projection).sort(sort_by, sort_order).to_list(None)
+            body = await expand(properties, relations)
+        else:
+            query_shapes.record('properties', query, page_sort(sort_by, sort_order))
+            page_size = parse_limit(limit)
+            docs = await db.properties.find(
+                page_query(query, sort_by, sort_order, cursor), projection
+            ).sort(page_sort(sort_by, sort_order)).limit(page_size + 1).to_list(None)
+            properties, next_cursor = finish_page(docs, sort_by, sort_order, page_size)
+            await expand(properties, relations)
+            body = {"data": properties, "nextCursor": next_cursor}
+
+        return conditional.with_validators(jsonify(body), etag, last_modified), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+async def get_property(property_id):
+    try:
+        relations = parse_expand(request.args.get('expand'), PROPERTY_RELATIONS)
+        query = {"_id": ObjectId(property_id)}
+        related = related_collections(relations)
+        related_validators = await collection_validators(related) if related else None
+
+        if conditional.has_preconditions():
+            version = await db.properties.find_one(query, conditional.VERSION_PROJECTION)
+            if version is not None:
+                etag, last_modified = conditional.revision_validators(version, related_validators)
+                if conditional.is_not_modified(etag, last_modified):
+                    return conditional.not_modified(etag, last_modified)
+
+        prop = await db.properties.find_one(query)
+        if not prop:
+            return jsonify({"error": "Property not found"}), 404
+        await expand([prop], relations)
+
+        etag, last_modified = conditional.revision_validators(prop, related_validators)
+        return conditional.with_validators(jsonify(prop), etag, last_modified), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+class EventStream:
+    # A streamed text/event-stream body, returned by a view instead of a
+    # response
+    def __init__(self, events):
+        self.events = events
+
+async def changes(collection_name, fields, reference_fields):
+    if request.method == 'HEAD':
+        return None
+    try:
+        filters = change_streams.parse_filters(request.args, fields, reference_fields=reference_fields)
+        resume_token = change_streams.requested_resume_token(collection_name)
+        return EventStream(await change_streams.open_async_events(
+            db_instance.db[collection_name], collection_name, filters, resume_token
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except change_streams.ResumeTokenExpired as e:
+        return jsonify({"error": str(e)}), 410
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+
+# Flask endpoint -> coroutine; routing itself is done by the Flask URL map
+ASYNC_VIEWS = {
+    'properties.get_properties': get_properties,
+    'properties.get_property': get_property,
+    'aggregation.overview': overview,
+    'aggregation.average_price_by_city': partial(section, 'averagePriceByCity'),
+    'aggregation.most_active_agents': partial(section, 'mostActiveAgents'),
+    'aggregation.properties_by_type': partial(section, 'propertiesByType'),
+    'aggregation.inquiry_statistics': partial(section, 'inquiryStatistics'),
+    'aggregation.price_range_distribution': partial(section, 'priceRangeDistribution'),
+    'properties.property_changes': partial(
+        changes, 'properties', property_routes.CHANGE_FILTERS, property_routes.CHANGE_REFERENCE_FILTERS
+    ),
+    'inquiries.inquiry_changes': partial(
+        changes, 'inquiries', inquiry_routes.CHANGE_FILTERS, inquiry_routes.CHANGE_REFERENCE_FILTERS
+    )
+}
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def _header_list(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def send_events(stream, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": _header_list(
+        [('Content-Type', 'text/event-stream; charset=utf-8'), *change_streams.SSE_HEADERS.items()]
+    )})
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        async for chunk in stream.events:
+            # Noticed at the next message; heartbeats bound the wait
+            if disconnected.done():
+                break
+            await send({"type": "http.response.body", "body": chunk.encode('utf-8'), "more_body": True})
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b''})
+    finally:
+        disconnected.cancel()
+        await stream.events.aclose()
+
+async def serve_async(scope, receive, send):
+    started = time.perf_counter()
+    with flask_app.request_context(wsgi_environ(scope, io.BytesIO())):
+        rule = request.url_rule
+        view = ASYNC_VIEWS.get(rule.endpoint) if rule is not None else None
+        if view is None:
+            return False
+        result = await view(**request.view_args)
+        if result is None:
+            return False
+        if isinstance(result, EventStream):
+            metrics.record_request(request.method, rule.rule, '200', started)
+        else:
+            response = flask_app.make_response(result)
+            metrics.record_request(request.method, rule.rule, str(response.status_code), started)
+            body = b'' if scope['method'] == 'HEAD' else response.get_data()
+
+    if isinstance(result, EventStream):
+        await send_events(result, receive, send)
+        return True
+    await send({"type": "http.response.start", "status": response.status_code,
+                "headers": _header_list(response.headers.items())})
+    await send({"type": "http.response.body", "body": body})
+    return True
+
+async def serve_sync(scope, receive, send):
+    # The WSGI app on a worker thread. Chunks are sent as they are produced,
+    # so streamed bodies and server-sent events work; a client disconnect
+    # stops the iteration.
+    body = io.BytesIO()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+
+    loop = asyncio.get_running_loop()
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        status = {}
+
+        def start_response(status_line, headers, exc_info=None):
+            status['code'] = int(status_line.split(' ', 1)[0])
+            status['headers'] = headers
+
+        chunks = flask_app(wsgi_environ(scope, body), start_response)
+        try:
+            started = False
+            for chunk in chunks:
+                if not started:
+                    send_from_thread({"type": "http.response.start", "status": status['code'],
+                                      "headers": _header_list(status['headers'])})
+                    started = True
+                if chunk and scope['method'] != 'HEAD':
+                    send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+                if disconnected.is_set():
+                    return
+            if not started:
+                send_from_thread({"type": "http.response.start", "status": status['code'],
+                                  "headers": _header_list(status['headers'])})
+            send_from_thread({"type": "http.response.body", "body": b''})
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await loop.run_in_executor(sync_executor, run)
+    finally:
+        watcher.cancel()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({"type": "lifespan.startup.complete"})
+        elif message['type'] == 'lifespan.shutdown':
+            if metrics.METRICS_ENABLED:
+                metrics.flush()
+            db.close()
+            db_instance.close()
+            sync_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if scope['method'] in ('GET', 'HEAD') and await serve_async(scope, receive, send):
+        return
+    await serve_sync(scope, receive, send)
@@ -0,0 +1,11 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from database import Database
+
+class AsyncDatabase(Database):
+    # The same lazily created, env-configured client as db_instance, on
+    # Motor for the asyncio server (asgi.py). Motor binds the client to the
+    # event loop it is first used on, so it is created inside the worker's
+    # loop rather than at import time. Collections return Motor collections.
+    client_class = AsyncIOMotorClient
+
+async_db_instance = AsyncDatabase()
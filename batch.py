@@ -0,0 +1,114 @@
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+MAX_BATCH_SIZE = 1000
+
+ID_ONLY = {"_id": 1}
+
+# Multi-id reads and writes: one $in query to read, one bulk_write to write,
+# however many ids are sent. Ids that are not valid ObjectIds, or that match
+# nothing, are reported as missing rather than failing the batch.
+
+def _object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+def _normalize(value):
+    # The canonical (lowercase hex) form, which is how found documents are
+    # keyed; invalid ids are kept as sent and reported missing
+    object_id = _object_id(value)
+    return str(object_id) if object_id is not None else str(value)
+
+def _check_size(items, name):
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"{name} must be a non-empty array")
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"{name} accepts at most {MAX_BATCH_SIZE} entries")
+
+def parse_ids(body):
+    ids = (body or {}).get('ids')
+    _check_size(ids, 'ids')
+    # Repeated ids are returned once, at their first position
+    return list(dict.fromkeys(_normalize(value) for value in ids))
+
+def parse_updates(body):
+    updates = (body or {}).get('updates')
+    _check_size(updates, 'updates')
+    merged = {}
+    for entry in updates:
+        if not isinstance(entry, dict) or 'id' not in entry or not isinstance(entry.get('set'), dict):
+            raise ValueError('each update must look like {"id": "...", "set": {...}}')
+        fields = dict(entry['set'])
+        for field in ('_id', 'createdAt', 'revision'):
+            fields.pop(field, None)
+        merged.setdefault(_normalize(entry['id']), {}).update(fields)
+    return merged
+
+def _lookup(ids):
+    object_ids = {}
+    for value in ids:
+        object_id = _object_id(value)
+        if object_id is not None:
+            object_ids[value] = object_id
+    return object_ids
+
+def get_many(collection, ids, projection=None):
+    object_ids = _lookup(ids)
+    found = {}
+    if object_ids:
+        for doc in collection.find({"_id": {"$in": list(object_ids.values())}}, projection):
+            found[str(doc['_id'])] = doc
+    return [found[value] for value in ids if value in found], [value for value in ids if value not in found]
+
+def _bulk_write(collection, ops, ids):
+    # Unordered, so one failing document (e.g. a duplicate key) does not stop
+    # the rest; failures are reported by id.
+    try:
+        result = collection.bulk_write(ops, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+    errors = [
+        {"id": ids[error['index']], "error": error.get('errmsg', 'Write failed')}
+        for error in result.get('writeErrors', [])
+    ]
+    return result, errors
+
+def update_many(collection, updates, projection=ID_ONLY):
+    # $set per document, with updatedAt and revision maintained as in the
+    # single-document routes. Returns the pre-images of the documents that
+    # were written (pass projection=None for whole documents) and a summary;
+    # the fields written per id are left in updates.
+    previous, missing = get_many(collection, list(updates), projection)
+    now = datetime.utcnow()
+    ops = []
+    for doc in previous:
+        fields = {**updates[str(doc['_id'])], 'updatedAt': now}
+        updates[str(doc['_id'])] = fields
+        ops.append(UpdateOne({"_id": doc['_id']}, {"$set": fields, "$inc": {"revision": 1}}))
+    summary = {"matched": 0, "modified": 0, "missing": missing, "errors": []}
+    if not ops:
+        return [], summary
+
+    result, summary['errors'] = _bulk_write(collection, ops, [str(doc['_id']) for doc in previous])
+    summary['matched'] = result.get('nMatched', 0)
+    summary['modified'] = result.get('nModified', 0)
+    failed = {error['id'] for error in summary['errors']}
+    return [doc for doc in previous if str(doc['_id']) not in failed], summary
+
+def delete_many(collection, ids, projection=ID_ONLY):
+    previous, missing = get_many(collection, ids, projection)
+    summary = {"deleted": 0, "missing": missing, "errors": []}
+    if not previous:
+        return [], summary
+
+    result, summary['errors'] = _bulk_write(
+        collection, [DeleteOne({"_id": doc['_id']}) for doc in previous], [str(doc['_id']) for doc in previous]
+    )
+    summary['deleted'] = result.get('nRemoved', 0)
+    failed = {error['id'] for error in summary['errors']}
+    return [doc for doc in previous if str(doc['_id']) not in failed], summary
@@ -0,0 +1,144 @@
+"""Deterministic synthetic data for benchmarks.
+
+City popularity, agent load and inquiries per listing all follow a Zipf-like
+skew, so a few cities, agents and listings dominate the way they do in
+production, while the long tail stays populated.
+"""
+import random
+from itertools import accumulate
+from datetime import datetime, timedelta
+
+PROPERTY_TYPES = [
+    ('Apartment', 0.45, 1.0),
+    ('House', 0.35, 1.6),
+    ('Penthouse', 0.05, 4.0),
+    ('Commercial', 0.10, 2.5),
+    ('Land', 0.05, 0.6)
+]
+
+INQUIRY_STATUSES = [('Pending', 0.5), ('Responded', 0.35), ('Closed', 0.15)]
+
+BATCH_SIZE = 5000
+
+def zipf_cum_weights(n, s=1.1):
+    return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+def generate(db, properties=10000, cities=50, agents=None, users=None, inquiries=None, seed=42,
+             string_references=False):
+    rnd = random.Random(seed)
+    agents = agents or max(3, properties // 50)
+    users = users or max(2, properties // 10)
+    inquiries = inquiries if inquiries is not None else properties // 2
+    now = datetime.utcnow()
+    # string_references reproduces documents written before references were
+    # stored as ObjectId
+    reference = str if string_references else (lambda value: value)
+
+    city_names = [f"City {i:03d}" for i in range(cities)]
+    city_weights = zipf_cum_weights(cities)
+    city_price_level = {city: rnd.uniform(0.5, 2.5) for city in city_names}
+    city_centre = {city: (rnd.uniform(-120, -70), rnd.uniform(26, 48)) for city in city_names}
+    type_names = [name for name, _, _ in PROPERTY_TYPES]
+    type_weights = [weight for _, weight, _ in PROPERTY_TYPES]
+    type_price_level = {name: level for name, _, level in PROPERTY_TYPES}
+
+    agent_docs = [
+        {
+            "name": f"Agent {i}",
+            "email": f"agent{i}@bench.example",
+            "phone": f"+1-555-{i:06d}",
+            "specialization": rnd.choice(['Residential', 'Commercial', 'Luxury']),
+            "activeListings": 0,
+            "listedValue": 0,
+            "openInquiries": 0,
+            "createdAt": now - timedelta(days=rnd.randint(0, 730))
+        }
+        for i in range(agents)
+    ]
+    agent_ids = db.agents.insert_many(agent_docs).inserted_ids
+    agent_weights = zipf_cum_weights(agents, 0.8)
+
+    user_docs = [
+        {
+            "name": f"User {i}",
+            "email": f"user{i}@bench.example",
+            "phone": f"+1-555-{i:07d}",
+            "createdAt": now - timedelta(days=rnd.randint(0, 730))
+        }
+        for i in range(users)
+    ]
+    user_ids = db.users.insert_many(user_docs).inserted_ids
+
+    # Draw all skewed picks up front: one choices() call per column is
+    # O(k log n) instead of O(k * n) for per-row weighted draws.
+    picked_cities = rnd.choices(city_names, cum_weights=city_weights, k=properties)
+    picked_types = rnd.choices(type_names, weights=type_weights, k=properties)
+    picked_agents = rnd.choices(agent_ids, cum_weights=agent_weights, k=properties)
+
+    property_ids = []
+    batch = []
+    for i in range(properties):
+        city = picked_cities[i]
+        property_type = picked_types[i]
+        bedrooms = 0 if property_type in ('Commercial', 'Land') else rnd.randint(1, 6)
+        size = int(rnd.lognormvariate(7.2, 0.5))
+        price = int(rnd.lognormvariate(12.6, 0.6) * city_price_level[city] * type_price_level[property_type])
+        agent_id = picked_agents[i]
+        longitude, latitude = city_centre[city]
+        batch.append({
+            "title": f"{property_type} listing {i}",
+            "description": f"Synthetic {property_type.lower()} in {city} with {bedrooms} bedrooms. " * 4,
+            "price": price,
+            "propertyType": property_type,
+            "bedrooms": bedrooms,
+            "bathrooms": max(1, bedrooms - rnd.randint(0, 2)),
+            "size": size,
+            "city": city,
+            "address": f"{rnd.randint(1, 9999)} Bench St, {city}",
+            "location": {
+                "type": "Point",
+                "coordinates": [longitude + rnd.gauss(0, 0.05), latitude + rnd.gauss(0, 0.05)]
+            },
+            "agentId": reference(agent_id),
+            "status": rnd.choices(['Available', 'Sold', 'Pending'], [0.8, 0.15, 0.05])[0],
+            "createdAt": now - timedelta(minutes=rnd.randint(0, 2 * 365 * 24 * 60))
+        })
+        if len(batch) >= BATCH_SIZE:
+            property_ids += db.properties.insert_many(batch, ordered=False).inserted_ids
+            batch = []
+    if batch:
+        property_ids += db.properties.insert_many(batch, ordered=False).inserted_ids
+
+    picked_properties = rnd.choices(
+        range(len(property_ids)), cum_weights=zipf_cum_weights(len(property_ids), 1.2), k=inquiries
+    )
+    picked_statuses = rnd.choices(
+        [status for status, _ in INQUIRY_STATUSES],
+        weights=[weight for _, weight in INQUIRY_STATUSES],
+        k=inquiries
+    )
+    batch = []
+    for i in range(inquiries):
+        index = picked_properties[i]
+        batch.append({
+            "propertyId": reference(property_ids[index]),
+            "userId": reference(rnd.choice(user_ids)),
+            "agentId": reference(picked_agents[index]),
+            "message": "Is this listing still available?",
+            "status": picked_statuses[i],
+            "createdAt": now - timedelta(minutes=rnd.randint(0, 365 * 24 * 60))
+        })
+        if len(batch) >= BATCH_SIZE:
+            db.inquiries.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.inquiries.insert_many(batch, ordered=False)
+
+    return {
+        "properties": [str(property_id) for property_id in property_ids],
+        "cityCentres": city_centre,
+        "agents": [str(agent_id) for agent_id in agent_ids],
+        "users": [str(user_id) for user_id in user_ids],
+        "cities": city_names,
+        "propertyTypes": type_names
+    }
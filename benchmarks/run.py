@@ -0,0 +1,338 @@
+"""Load-test every API route against synthetic data.
+
+    python benchmarks/run.py --backend memory --properties 20000
+    python benchmarks/run.py --backend mongo --properties 200000 --save benchmarks/results/mongo.json
+    python benchmarks/run.py --compare benchmarks/results/baseline-memory.json
+
+The mongo backend seeds and then drops the MONGODB_DATABASE database
+(default real_estate_benchmark) on MONGODB_URI. The memory backend runs
+against mongomock in-process (pip install mongomock) so it works offline;
+its absolute numbers only say something when compared with each other.
+
+--legacy-references seeds string reference ids without the inquiry compound
+indexes, i.e. the layout before `flask --app app migrate-references`, so the
+inquiry scenarios can be compared before and after the migration.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('MONGODB_DATABASE', 'real_estate_benchmark')
+
+import datagen  # noqa: E402
+
+BULK_LINES = 200
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'results', 'baseline-memory.json')
+
+# Inquiry indexes that did not exist before references were stored as ObjectId
+LEGACY_DROPPED_INDEXES = [
+    [('propertyId', 1), ('createdAt', -1)],
+    [('agentId', 1), ('createdAt', -1)],
+    [('agentId', 1), ('status', 1), ('createdAt', -1)],
+    [('userId', 1), ('createdAt', -1)]
+]
+
+class Scenario:
+    def __init__(self, name, method, path, body=None, before=None, requests=None, headers=None,
+                 backends=('memory', 'mongo')):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.before = before
+        self.requests = requests
+        self.headers = headers or {}
+        self.backends = backends
+
+    def call(self, client, rnd):
+        if self.before:
+            self.before()
+        path = self.path(rnd) if callable(self.path) else self.path
+        body = self.body(rnd) if callable(self.body) else self.body
+        kwargs = {'headers': self.headers}
+        if isinstance(body, (bytes, str)):
+            kwargs['data'] = body
+            kwargs['content_type'] = 'application/x-ndjson'
+        elif body is not None:
+            kwargs['json'] = body
+        start = time.perf_counter()
+        response = getattr(client, self.method)(path, **kwargs)
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        return elapsed, response
+
+def build_scenarios(data, created, requests):
+    from cache import aggregation_cache
+
+    properties = data['properties']
+    cities = data['cities']
+    popular_city = cities[0]
+    tail_city = cities[-1]
+    created_lock = threading.Lock()
+
+    def new_property(rnd):
+        return {
+            "title": "Benchmark listing",
+            "price": rnd.randint(100000, 2000000),
+            "propertyType": rnd.choice(data['propertyTypes']),
+            "city": rnd.choice(cities),
+            "bedrooms": rnd.randint(1, 5),
+            "agentId": rnd.choice(data['agents'])
+        }
+
+    def take_created(rnd):
+        with created_lock:
+            return created.pop() if created else rnd.choice(properties)
+
+    def bulk_body(rnd):
+        return "\n".join(
+            json.dumps({**new_property(rnd), "externalId": f"bench-{rnd.randrange(10 ** 9)}"})
+            for _ in range(BULK_LINES)
+        )
+
+    scenarios = [
+        Scenario('properties.list.page', 'get', '/api/properties/?limit=20&sortBy=price&order=asc'),
+        Scenario('properties.list.filtered', 'get',
+                 f'/api/properties/?city={popular_city}&propertyType=House&minPrice=200000&maxPrice=900000&limit=50'),
+        Scenario('properties.list.tail-city-full', 'get', f'/api/properties/?city={tail_city}'),
+        Scenario('properties.list.stream', 'get', f'/api/properties/?city={popular_city}&stream=ndjson',
+                 requests=max(1, requests // 10)),
+        # mongomock has no $geoNear or $geoWithin, so these only run against mongo
+        Scenario('properties.list.near', 'get',
+                 lambda rnd: '/api/properties/?near={},{}&maxDistance=5000&limit=20'.format(*data['cityCentres'][popular_city]),
+                 backends=('mongo',)),
+        Scenario('properties.list.within', 'get',
+                 lambda rnd: '/api/properties/?within={},{},{},{}&limit=20'.format(
+                     data['cityCentres'][popular_city][0] - 0.05, data['cityCentres'][popular_city][1] - 0.05,
+                     data['cityCentres'][popular_city][0] + 0.05, data['cityCentres'][popular_city][1] + 0.05),
+                 backends=('mongo',)),
+        Scenario('properties.search.unfiltered', 'get', '/api/properties/search?limit=20'),
+        Scenario('properties.search.city', 'get', f'/api/properties/search?city={popular_city}&limit=20'),
+        Scenario('properties.get', 'get', lambda rnd: f'/api/properties/{rnd.choice(properties)}'),
+        # one viral listing; with --concurrency > 1 concurrent reads of it are coalesced
+        Scenario('properties.get.hot', 'get', f'/api/properties/{properties[0]}?expand=agent'),
+        Scenario('properties.batch-get', 'post', '/api/properties/batch-get',
+                 body=lambda rnd: {"ids": rnd.sample(properties, min(100, len(properties)))}),
+        Scenario('properties.create', 'post', '/api/properties/', body=new_property),
+        Scenario('properties.update', 'put', lambda rnd: f'/api/properties/{rnd.choice(properties)}',
+                 body=lambda rnd: {"price": rnd.randint(100000, 2000000)}),
+        Scenario('properties.delete', 'delete', lambda rnd: f'/api/properties/{take_created(rnd)}'),
+        Scenario('properties.bulk', 'post', '/api/properties/bulk', body=bulk_body,
+                 requests=max(1, requests // 20)),
+        Scenario('properties.export', 'get', '/api/properties/export', requests=max(1, requests // 50)),
+        Scenario('agents.list', 'get', '/api/agents/'),
+        Scenario('agents.get', 'get', lambda rnd: f"/api/agents/{rnd.choice(data['agents'])}"),
+        Scenario('agents.update', 'put', lambda rnd: f"/api/agents/{rnd.choice(data['agents'])}",
+                 body=lambda rnd: {"phone": str(rnd.randrange(10 ** 7))}),
+        Scenario('users.list', 'get', '/api/users/'),
+        Scenario('users.get', 'get', lambda rnd: f"/api/users/{rnd.choice(data['users'])}"),
+        Scenario('users.create', 'post', '/api/users/',
+                 body=lambda rnd: {"name": "Bench", "email": f"bench-{rnd.randrange(10 ** 12)}@example.com"}),
+        Scenario('inquiries.list.agent', 'get', lambda rnd: f"/api/inquiries/?agentId={rnd.choice(data['agents'])}"),
+        Scenario('inquiries.list.agent-status', 'get',
+                 lambda rnd: f"/api/inquiries/?agentId={rnd.choice(data['agents'])}&status=Pending"),
+        Scenario('inquiries.list.user', 'get', lambda rnd: f"/api/inquiries/?userId={rnd.choice(data['users'])}"),
+        Scenario('inquiries.list.property', 'get', lambda rnd: f"/api/inquiries/?propertyId={rnd.choice(properties)}"),
+        Scenario('inquiries.create', 'post', '/api/inquiries/',
+                 body=lambda rnd: {"propertyId": rnd.choice(properties), "userId": rnd.choice(data['users']),
+                                   "agentId": rnd.choice(data['agents']), "message": "Benchmark"}),
+    ]
+
+    endpoints = [(endpoint, endpoint) for endpoint in [
+        'average-price-by-city', 'most-active-agents', 'properties-by-type',
+        'inquiry-statistics', 'price-range-distribution', 'overview'
+    ]] + [
+        ('average-price-by-city.approx', 'average-price-by-city?approx=true&sampleSize=500'),
+        ('distribution', 'distribution?by=city'),
+        ('trends.properties.month-by-city', 'trends/properties?interval=month&by=city'),
+        ('trends.inquiries.week', 'trends/inquiries?interval=week')
+    ]
+    for name, endpoint in endpoints:
+        scenarios.append(Scenario(f'aggregation.{name}.cold', 'get', f'/api/aggregation/{endpoint}',
+                                  before=aggregation_cache.clear))
+        scenarios.append(Scenario(f'aggregation.{name}.warm', 'get', f'/api/aggregation/{endpoint}'))
+
+    return scenarios
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def run_scenario(app, scenario, requests, concurrency, seed, created):
+    n = scenario.requests or requests
+    latencies = []
+    errors = []
+
+    def worker(count, worker_seed):
+        client = app.test_client()
+        rnd = random.Random(worker_seed)
+        for _ in range(count):
+            elapsed, response = scenario.call(client, rnd)
+            latencies.append(elapsed)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+            elif scenario.name == 'properties.create':
+                created.append(response.get_json()['_id'])
+
+    # warm up, then measure one request's allocations on its own so that
+    # tracemalloc doesn't distort the timed requests
+    worker(1, seed)
+    latencies.clear()
+    tracemalloc.start()
+    worker(1, seed + 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.clear()
+    errors.clear()
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        worker(n, seed + 2)
+    else:
+        per_worker = [n // concurrency + (1 if i < n % concurrency else 0) for i in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, per_worker, [seed + 2 + i for i in range(concurrency)]))
+    wall = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": len(errors),
+        "p50Ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95Ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99Ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "meanMs": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "throughputRps": round(len(ordered) / wall, 1) if wall else 0.0,
+        "peakAllocKb": round(peak / 1024, 1)
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('p95Ms'):
+            continue
+        ratio = current['p95Ms'] / previous['p95Ms']
+        if ratio > 1 + tolerance:
+            regressions.append((name, previous['p95Ms'], current['p95Ms'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'mongo'], default='memory')
+    parser.add_argument('--properties', type=int, default=2000)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--only', help='regex; run only matching scenarios')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='write results as JSON to this path')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE,
+                        help='fail if p95 regressed against this results file')
+    parser.add_argument('--legacy-references', action='store_true',
+                        help='seed string references without the inquiry compound indexes (pre-migration baseline)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown for --compare')
+    args = parser.parse_args()
+
+    from database import db_instance
+    if args.backend == 'memory':
+        try:
+            import mongomock
+        except ImportError:
+            parser.error("the memory backend needs mongomock: pip install mongomock")
+        db_instance.bind(mongomock.MongoClient())
+        # mongomock has no RawBSONDocument support
+        os.environ.setdefault('RAW_BSON_RESPONSES', '0')
+
+    from app import app
+    import property_stats
+    import trends
+    import agent_counters
+
+    db_instance.client.drop_database(db_instance.db.name)
+    try:
+        db_instance.create_indexes()
+        started = time.perf_counter()
+        if args.legacy_references:
+            for keys in LEGACY_DROPPED_INDEXES:
+                db_instance.inquiries.drop_index(keys)
+            # the only inquiry index the pre-migration layout had
+            db_instance.inquiries.create_index([('propertyId', 1)])
+        data = datagen.generate(db_instance, properties=args.properties, cities=args.cities, seed=args.seed,
+                                string_references=args.legacy_references)
+        property_stats.rebuild()
+        trends.rebuild()
+        agent_counters.reconcile()
+        print(f"Seeded {args.properties} properties across {args.cities} cities "
+              f"in {time.perf_counter() - started:.1f}s ({args.backend} backend)\n")
+
+        created = []
+        scenarios = build_scenarios(data, created, args.requests)
+        skipped = [s.name for s in scenarios if args.backend not in s.backends]
+        scenarios = [s for s in scenarios if args.backend in s.backends]
+        if skipped:
+            print(f"Skipping on the {args.backend} backend: {', '.join(skipped)}\n")
+        if args.only:
+            scenarios = [s for s in scenarios if re.search(args.only, s.name)]
+
+        results = {}
+        print(f"{'scenario':<42}{'n':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'peak KB':>10}")
+        for scenario in scenarios:
+            result = run_scenario(app, scenario, args.requests, args.concurrency, args.seed, created)
+            results[scenario.name] = result
+            print(f"{scenario.name:<42}{result['requests']:>6}{result['errors']:>5}{result['p50Ms']:>10}"
+                  f"{result['p95Ms']:>10}{result['p99Ms']:>10}{result['throughputRps']:>10}{result['peakAllocKb']:>10}")
+    finally:
+        db_instance.client.drop_database(db_instance.db.name)
+
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"\nProcess max RSS: {max_rss_kb / 1024:.1f} MB")
+
+    report = {
+        "meta": {
+            "backend": args.backend,
+            "properties": args.properties,
+            "cities": args.cities,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "maxRssMb": round(max_rss_kb / 1024, 1),
+            "timestamp": datetime.utcnow().isoformat()
+        },
+        "results": results
+    }
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: p95 {before}ms -> {after}ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No p95 regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+if __name__ == '__main__':
+    main()
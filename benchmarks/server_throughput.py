@@ -0,0 +1,235 @@
+"""Compare HTTP throughput of the dev server and the gunicorn launcher.
+
+Seeds synthetic data into MONGODB_DATABASE (default real_estate_benchmark) on
+MONGODB_URI, starts each server in turn on a local port, drives a mix of read
+routes from --concurrency client threads for --duration seconds, then drops
+the database. Needs a real mongod and gunicorn (pip install gunicorn):
+
+    python benchmarks/server_throughput.py --duration 20 --concurrency 32
+
+--backend memory runs offline instead: each server process seeds its own
+mongomock database before serving (gunicorn seeds in the master, so every
+worker forks with a copy). mongomock runs queries in Python under the GIL,
+so this measures the servers around a CPU-bound data layer, not MongoDB.
+
+The client threads share this process's GIL, so on small machines the load
+generator itself can become the limit; run it with --url against a server
+started elsewhere to take it out of the picture.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('MONGODB_DATABASE', 'real_estate_benchmark')
+
+import datagen  # noqa: E402
+from run import percentile  # noqa: E402
+
+SERVERS = {
+    # What `python app.py` runs, minus the debugger and reloader
+    'dev': lambda port: [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port)],
+    'gunicorn': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}']
+}
+
+def request_paths(data, rnd):
+    properties = data['properties']
+    cities = data['cities']
+    return rnd.choice([
+        '/api/properties/?limit=20',
+        f'/api/properties/?city={cities[0]}&sortBy=price&limit=20',
+        f'/api/properties/{rnd.choice(properties)}',
+        f'/api/properties/{rnd.choice(properties)}?expand=agent',
+        '/api/agents/',
+        '/api/aggregation/average-price-by-city'
+    ]).replace(' ', '%20')
+
+def wait_ready(base_url, timeout=30, path='/api/ready'):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}{path}', timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not become ready within {timeout}s")
+
+def drive(base_url, data, duration, concurrency, seed):
+    latencies = []
+    errors = []
+    stop_at = time.perf_counter() + duration
+
+    def worker(worker_seed):
+        rnd = random.Random(worker_seed)
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + request_paths(data, rnd), timeout=30) as response:
+                    response.read()
+            except (urllib.error.URLError, ConnectionError) as e:
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, [seed + i for i in range(concurrency)]))
+    wall = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": len(errors),
+        "throughputRps": round(len(ordered) / wall, 1) if wall else 0.0,
+        "p50Ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95Ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99Ms": round(percentile(ordered, 0.99) * 1000, 3)
+    }
+
+def memory_server(name, port, args, data_file):
+    return [sys.executable, os.path.abspath(__file__), '--serve', name, '--port', str(port),
+            '--properties', str(args.properties), '--cities', str(args.cities), '--seed', str(args.seed),
+            '--data-file', data_file]
+
+def serve(args):
+    # Child process of a --backend memory run
+    import mongomock
+    from database import db_instance
+    os.environ.setdefault('RAW_BSON_RESPONSES', '0')
+    client = mongomock.MongoClient()
+    # Every (forked) process gets the seeded client back instead of connecting
+    db_instance.client_class = lambda *_, **__: client
+    db_instance.create_indexes()
+    data = seed(db_instance, args)
+    with open(args.data_file, 'w') as f:
+        json.dump({key: data[key] for key in ('properties', 'cities')}, f)
+
+    from app import app
+    if args.serve == 'dev':
+        app.run(host='127.0.0.1', port=args.port)
+    else:
+        from gunicorn.app.wsgiapp import run
+        sys.argv = ['gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), '--bind', f'127.0.0.1:{args.port}',
+                    '--access-logfile', '/dev/null']
+        run()
+
+def seed(db, args):
+    import property_stats
+    import trends
+    import agent_counters
+    data = datagen.generate(db, properties=args.properties, cities=args.cities, seed=args.seed)
+    property_stats.rebuild()
+    trends.rebuild()
+    agent_counters.reconcile()
+    return data
+
+def run_server(name, port, args, data):
+    if args.backend == 'memory':
+        data_file = os.path.join(tempfile.mkdtemp(), 'data.json')
+        command = memory_server(name, port, args, data_file)
+    else:
+        command = SERVERS[name](port)
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        if args.backend == 'memory':
+            # /api/ready reads pool options mongomock does not have
+            wait_ready(base_url, timeout=300, path='/api/health')
+            with open(data_file) as f:
+                data = json.load(f)
+        else:
+            wait_ready(base_url)
+        drive(base_url, data, min(2, args.duration), args.concurrency, args.seed)  # warm up
+        return drive(base_url, data, args.duration, args.concurrency, args.seed)
+    finally:
+        # SIGTERM is a graceful shutdown for both servers
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--properties', type=int, default=20000)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=15, help='seconds of load per server')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--servers', default='dev,gunicorn', help='comma separated: ' + ', '.join(SERVERS))
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--url', help='drive an already running server instead of starting one')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--backend', choices=['mongo', 'memory'], default='mongo')
+    parser.add_argument('--save', help='write results as JSON to this path')
+    parser.add_argument('--serve', choices=list(SERVERS), help=argparse.SUPPRESS)
+    parser.add_argument('--data-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    if args.backend == 'memory':
+        if args.url:
+            parser.error("--url needs the mongo backend")
+        report(args, None)
+        return
+
+    from database import db_instance
+    db_instance.client.drop_database(db_instance.db.name)
+    try:
+        db_instance.create_indexes()
+        data = seed(db_instance, args)
+        # the servers are separate processes with their own clients
+        db_instance.close()
+        report(args, data)
+    finally:
+        db_instance.client.drop_database(db_instance.db.name)
+
+def report(args, data):
+    targets = [('url', args.url)] if args.url else [(name, None) for name in args.servers.split(',')]
+    print(f"{'server':<12}{'requests':>10}{'err':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    results = {}
+    for name, url in targets:
+        if url:
+            wait_ready(url)
+            result = drive(url, data, args.duration, args.concurrency, args.seed)
+        else:
+            result = run_server(name, args.port, args, data)
+        results[name] = result
+        print(f"{name:<12}{result['requests']:>10}{result['errors']:>6}{result['throughputRps']:>10}"
+              f"{result['p50Ms']:>10}{result['p95Ms']:>10}{result['p99Ms']:>10}")
+    if 'dev' in results and 'gunicorn' in results and results['dev']['throughputRps']:
+        print(f"\ngunicorn / dev throughput: {results['gunicorn']['throughputRps'] / results['dev']['throughputRps']:.2f}x")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                "backend": args.backend,
+                "cores": _cores(),
+                "workers": os.getenv('WEB_CONCURRENCY') or _cores(),
+                "threads": int(os.getenv('GUNICORN_THREADS', '4')),
+                "properties": args.properties,
+                "durationSeconds": args.duration,
+                "concurrency": args.concurrency,
+                "results": results
+            }, f, indent=2)
+    return results
+
+def _cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+if __name__ == '__main__':
+    main()
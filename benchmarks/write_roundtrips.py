@@ -0,0 +1,189 @@
+"""Count MongoDB round trips and time per create/update request.
+
+    python benchmarks/write_roundtrips.py --requests 200
+    python benchmarks/write_roundtrips.py --backend mongo --requests 200 --save benchmarks/results/write-roundtrips-mongo.json
+    python benchmarks/write_roundtrips.py --compare benchmarks/results/write-roundtrips-memory.json
+
+The mongo backend counts wire commands with a pymongo CommandListener. It
+writes to the MONGODB_DATABASE database (default real_estate_benchmark) on
+MONGODB_URI and removes what it creates. The memory backend runs against
+mongomock in-process (pip install mongomock), which sends no commands, so
+it counts collection operations (insert_one, find_one_and_update, one
+bulk_write, ...) instead; each is one command on a real server.
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+from pymongo import monitoring
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('MONGODB_DATABASE', 'real_estate_benchmark')
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'results', 'write-roundtrips-memory.json')
+
+# mongomock Collection methods that are one command each on a real server
+MEMORY_OPERATIONS = [
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many',
+    'find', 'find_one', 'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete',
+    'aggregate', 'count_documents', 'estimated_document_count', 'distinct', 'bulk_write'
+]
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.counts = {}
+        self._depth = threading.local()
+
+    def started(self, event):
+        self.count(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset(self):
+        self.counts = {}
+
+    def total(self):
+        return sum(count for name, count in self.counts.items() if name not in ('hello', 'ismaster', 'endSessions'))
+
+    def operation(self, name, method):
+        # mongomock implements some operations with others (find_one calls
+        # find), so only the outermost call is counted
+        @functools.wraps(method)
+        def counted(*args, **kwargs):
+            depth = getattr(self._depth, 'value', 0)
+            if depth == 0:
+                self.count(name)
+            self._depth.value = depth + 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth.value = depth
+        return counted
+
+counter = CommandCounter()
+
+def run(client, label, method, url_for, payload, headers, n):
+    counter.reset()
+    start = time.perf_counter()
+    ids = []
+    for i in range(n):
+        response = getattr(client, method)(url_for(i), json=payload(i), headers=headers)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{label}: HTTP {response.status_code} {response.get_data(as_text=True)}")
+        if response.is_json:
+            ids.append(response.get_json().get('_id'))
+        else:
+            ids.append(response.headers.get('Location', '').rsplit('/', 1)[-1])
+    elapsed = time.perf_counter() - start
+    result = {
+        "requests": n,
+        "commandsPerRequest": round(counter.total() / n, 2),
+        "msPerRequest": round(elapsed / n * 1000, 3)
+    }
+    print(f"{label:<42} {result['commandsPerRequest']:>6.2f} commands/request  {result['msPerRequest']:>8.3f} ms/request")
+    return ids, result
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        if current['commandsPerRequest'] > previous['commandsPerRequest']:
+            regressions.append(f"{name}: {previous['commandsPerRequest']} -> {current['commandsPerRequest']} commands/request")
+        ratio = current['msPerRequest'] / previous['msPerRequest'] if previous['msPerRequest'] else 0
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {previous['msPerRequest']}ms -> {current['msPerRequest']}ms ({ratio:.2f}x)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['memory', 'mongo'], default='memory')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--save', help='write results as JSON to this path')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE,
+                        help='fail if commands per request grew, or time per request regressed, against this results file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown for --compare')
+    args = parser.parse_args()
+    n = args.requests
+
+    from database import db_instance
+    if args.backend == 'memory':
+        try:
+            import mongomock
+        except ImportError:
+            parser.error("the memory backend needs mongomock: pip install mongomock")
+        for name in MEMORY_OPERATIONS:
+            setattr(mongomock.Collection, name, counter.operation(name, getattr(mongomock.Collection, name)))
+        db_instance.bind(mongomock.MongoClient())
+        # mongomock has no RawBSONDocument support
+        os.environ.setdefault('RAW_BSON_RESPONSES', '0')
+    else:
+        # Before the client exists, so it picks the listener up
+        monitoring.register(counter)
+
+    from app import app
+
+    client = app.test_client()
+    minimal = {'Prefer': 'return=minimal'}
+    created = []
+    results = {}
+    try:
+        for resource, payload in [
+            ('users', lambda i: {"name": f"bench-user-{i}", "email": f"bench-{time.time_ns()}-{i}@example.com"}),
+            ('properties', lambda i: {"title": f"bench-{i}", "price": 100000 + i, "city": "Bench", "propertyType": "House"}),
+        ]:
+            for label, headers in [('', {}), (' (return=minimal)', minimal)]:
+                name = f"POST /api/{resource}{label}"
+                ids, results[name] = run(client, name, 'post', lambda i: f'/api/{resource}/', payload, headers, n)
+                created += [(resource, i) for i in ids]
+                name = f"PUT /api/{resource}/<id>{label}"
+                _, results[name] = run(client, name, 'put', lambda i: f'/api/{resource}/{ids[i]}',
+                                       lambda i: {"phone": str(i)}, headers, n)
+    finally:
+        for resource, doc_id in created:
+            client.delete(f'/api/{resource}/{doc_id}')
+        db_instance.client.close()
+
+    report = {
+        "meta": {
+            "backend": args.backend,
+            "requests": n,
+            "python": platform.python_version(),
+            "timestamp": datetime.utcnow().isoformat()
+        },
+        "results": results
+    }
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from conditional import collection_validators
+
+class TTLCache:
+    # In-process LRU cache with per-entry TTL. Entries are tagged with the
+    # collections they were computed from so writes can drop just those.
+    # Invalidation only reaches this process; with `versions` set, each entry
+    # also records the tags' version as it was before computing, and a
+    # lookup that finds a different version (a write in another worker)
+    # recomputes.
+
+    def __init__(self, maxsize=128, ttl=60, versions=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.versions = versions
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, tags, expires_at, entry_version = entry
+            if expires_at <= time.monotonic() or entry_version != version:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=(), generations=None, version=None):
+        with self._lock:
+            # Skip the store if one of the tags was invalidated while the
+            # value was being computed; it may already be stale.
+            if generations is not None and generations != self._current_generations(tags):
+                return
+            self._entries[key] = (value, tuple(tags), time.monotonic() + self.ttl, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute, tags=()):
+        version = self.versions(tags) if self.versions is not None and tags else None
+        value = self.get(key, version)
+        if value is not None:
+            return value
+        with self._lock:
+            generations = self._current_generations(tags)
+        value = compute()
+        self.set(key, value, tags, generations, version)
+        return value
+
+    async def get_or_compute_async(self, key, compute, tags=(), versions=None):
+        # The same entries, filled by a coroutine (asgi.py); `versions` is
+        # the coroutine counterpart of self.versions
+        version = await versions(tags) if self.versions is not None and tags else None
+        value = self.get(key, version)
+        if value is not None:
+            return value
+        with self._lock:
+            generations = self._current_generations(tags)
+        value = await compute()
+        self.set(key, value, tags, generations, version)
+        return value
+
+    def invalidate(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            stale = [key for key, entry in self._entries.items() if tag in entry[1]]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            for tag in self._generations:
+                self._generations[tag] += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxSize": self.maxsize,
+                "ttlSeconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+    def _current_generations(self, tags):
+        return tuple(self._generations.get(tag, 0) for tag in tags)
+
+def collection_version(collection_names):
+    # One small read of collection_versions, which every API write bumps
+    etag, _ = collection_validators(list(collection_names))
+    return etag
+
+aggregation_cache = TTLCache(
+    maxsize=int(os.getenv('AGGREGATION_CACHE_SIZE', '128')),
+    ttl=float(os.getenv('AGGREGATION_CACHE_TTL', '60')),
+    versions=collection_version if os.getenv('AGGREGATION_CACHE_VALIDATE', '1') != '0' else None
+)
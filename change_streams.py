@@ -0,0 +1,363 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from flask import Response, request, stream_with_context
+from pymongo.errors import OperationFailure
+from pagination import encode_token, decode_token
+from references import reference_filter
+from serialization import dumps
+
+HEARTBEAT_SECONDS = float(os.getenv('CHANGE_STREAM_HEARTBEAT', '15'))
+MAX_AWAIT_MS = 1000
+# Under gunicorn every subscriber holds a request thread for as long as it is
+# connected, so the cap defaults to half of GUNICORN_THREADS, leaving the rest
+# for ordinary requests. Subscribers served as coroutines by asgi.py hold no
+# thread and have their own, much larger cap.
+MAX_SUBSCRIBERS = int(os.getenv(
+    'CHANGE_STREAM_MAX_SUBSCRIBERS', str(max(1, int(os.getenv('GUNICORN_THREADS', '4')) // 2))
+))
+MAX_ASYNC_SUBSCRIBERS = int(os.getenv('CHANGE_STREAM_MAX_ASYNC_SUBSCRIBERS', '1000'))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv('CHANGE_STREAM_QUEUE_SIZE', '1000'))
+
+# A resume point older than the oplog window can no longer be resumed from
+CHANGE_STREAM_HISTORY_LOST = 286
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+class ResumeTokenExpired(Exception):
+    pass
+
+class TooManySubscribers(Exception):
+    pass
+
+def build_pipeline(filters):
+    # Deletes carry only the documentKey, so they cannot be matched against
+    # the client's filters; every subscriber gets them and drops unknown ids.
+    operations = {'operationType': {'$in': ['insert', 'update', 'replace']}}
+    for field, value in filters.items():
+        operations[f"fullDocument.{field}"] = value
+    return [
+        {"$match": {"$or": [operations, {'operationType': 'delete'}]}},
+        {"$project": {"operationType": 1, "documentKey": 1, "fullDocument": 1, "updateDescription": 1}}
+    ]
+
+def parse_filters(args, fields, reference_fields=()):
+    filters = {}
+    for field in fields:
+        value = args.get(field)
+        if value:
+            filters[field] = reference_filter(value) if field in reference_fields else value
+    return filters
+
+def matches(change, filters):
+    # The in-process equivalent of build_pipeline's $match, for events read
+    # from the shared stream
+    if change['operationType'] == 'delete' or not filters:
+        return True
+    document = change.get('fullDocument')
+    if document is None:
+        return False
+    for field, value in filters.items():
+        if isinstance(value, dict) and '$in' in value:
+            if document.get(field) not in value['$in']:
+                return False
+        elif document.get(field) != value:
+            return False
+    return True
+
+def encode_resume_token(collection_name, token):
+    return encode_token([collection_name, token])
+
+def decode_resume_token(collection_name, token):
+    try:
+        token_collection, resume_token = decode_token(token, 2)
+    except ValueError:
+        raise ValueError("Invalid resume token")
+    if token_collection != collection_name:
+        raise ValueError("Resume token belongs to a different collection")
+    return resume_token
+
+def change_event(change):
+    operation = change['operationType']
+    event = {"op": operation, "_id": change['documentKey']['_id']}
+    if operation == 'update':
+        # Only the delta goes out; the looked-up document is used for filtering
+        description = change.get('updateDescription', {})
+        event['updatedFields'] = description.get('updatedFields', {})
+        event['removedFields'] = description.get('removedFields', [])
+    elif operation in ('insert', 'replace'):
+        event['document'] = change['fullDocument']
+    return event
+
+def event_message(collection_name, change):
+    # Queued as (token, message); the token lets a resumed subscriber skip
+    # the changes its catch-up already sent
+    token = encode_resume_token(collection_name, change['_id'])
+    return change['_id']['_data'], f"id: {token}\ndata: {dumps(change_event(change)).decode('utf-8')}\n\n"
+
+def open_stream(collection, filters, resume_token=None):
+    # Documents are looked up on update for filtering, whether that happens
+    # in the pipeline or in process by a ChangeHub
+    try:
+        return collection.watch(
+            build_pipeline(filters),
+            full_document='updateLookup',
+            resume_after=resume_token,
+            max_await_time_ms=MAX_AWAIT_MS
+        )
+    except OperationFailure as e:
+        if e.code == CHANGE_STREAM_HISTORY_LOST:
+            raise ResumeTokenExpired("Resume token is too old; reload the full list")
+        raise
+
+class Subscriber:
+    # Fed by the hub's thread, read by a request thread
+    def __init__(self, filters):
+        self.filters = filters
+        self.messages = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def deliver(self, item):
+        self.messages.put_nowait(item)
+
+    def close(self):
+        self.closed = True
+
+class AsyncSubscriber(Subscriber):
+    # Fed by the hub's thread, read by a coroutine on `loop` (asgi.py)
+    def __init__(self, filters, loop):
+        self.filters = filters
+        self.loop = loop
+        self.messages = asyncio.Queue()
+        self.closed = False
+
+    def deliver(self, item):
+        if self.messages.qsize() >= SUBSCRIBER_QUEUE_SIZE:
+            raise queue.Full
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, item)
+
+    def close(self):
+        self.closed = True
+        try:
+            # Wakes the reader, which sees `closed` once the queue is drained
+            self.loop.call_soon_threadsafe(self.messages.put_nowait, None)
+        except RuntimeError:
+            # The event loop has already shut down
+            pass
+
+class ChangeHub:
+    # One change stream per collection per process, read by a background
+    # thread and fanned out to the connected subscribers' queues. The stream
+    # is opened by the first subscriber and closed after the last one leaves.
+
+    def __init__(self, collection, collection_name):
+        self.collection = collection
+        self.collection_name = collection_name
+        self.position = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._stream = None
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            if self._stream is None:
+                # Opened on the request thread, so a missing replica set is
+                # reported to the client as an error status
+                self._stream = open_stream(self.collection, {})
+                self.position = self._stream.resume_token
+                threading.Thread(target=self._run, args=(self._stream,), daemon=True,
+                                 name=f'changes-{self.collection_name}').start()
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _run(self, stream):
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        # Decided under the lock, so a subscriber arriving
+                        # now opens a fresh stream rather than joining this one
+                        self._stream = None
+                        break
+                    subscribers = list(self._subscribers)
+                if not stream.alive:
+                    break
+                change = stream.try_next()
+                if change is None:
+                    self.position = stream.resume_token
+                    continue
+                message = None
+                for subscriber in subscribers:
+                    if not matches(change, subscriber.filters):
+                        continue
+                    # Serialized once, however many subscribers it goes to
+                    message = message or event_message(self.collection_name, change)
+                    try:
+                        subscriber.deliver(message)
+                    except queue.Full:
+                        # A client this far behind reconnects and catches up
+                        # from its Last-Event-ID instead
+                        self._drop(subscriber)
+                # Published after the queues are filled, so a heartbeat never
+                # carries a position past an event still waiting in a queue
+                self.position = change['_id']
+        finally:
+            with self._lock:
+                if self._stream is stream:
+                    # The stream failed: end every subscriber's response so
+                    # the clients reconnect and resume from their last id
+                    for subscriber in self._subscribers:
+                        subscriber.close()
+                    self._subscribers.clear()
+                    self._stream = None
+            stream.close()
+
+    def _drop(self, subscriber):
+        subscriber.close()
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+_subscriber_slots = threading.BoundedSemaphore(MAX_SUBSCRIBERS)
+_async_subscriber_slots = threading.BoundedSemaphore(MAX_ASYNC_SUBSCRIBERS)
+
+def get_hub(collection, collection_name):
+    with _hubs_lock:
+        if collection_name not in _hubs:
+            _hubs[collection_name] = ChangeHub(collection, collection_name)
+        return _hubs[collection_name]
+
+def catch_up(stream):
+    # The changes after a client's resume token, read from a short-lived
+    # stream of its own until that stream has nothing more to return
+    while stream.alive:
+        change = stream.try_next()
+        if change is None:
+            return
+        yield change
+
+def heartbeat(collection_name, position):
+    # An id-only message advances the client's Last-Event-ID past changes
+    # that were filtered out, so a reconnect does not rescan them.
+    return f"id: {encode_resume_token(collection_name, position)}\n\n"
+
+def requested_resume_token(collection_name):
+    token = request.headers.get('Last-Event-ID') or request.args.get('resumeAfter')
+    return decode_resume_token(collection_name, token) if token else None
+
+def sse_response(collection, collection_name, filters):
+    resume_token = requested_resume_token(collection_name)
+    if not _subscriber_slots.acquire(blocking=False):
+        raise TooManySubscribers("Too many change stream subscribers; try again later")
+    # Subscribed and opened here rather than in the generator so a missing
+    # replica set or an expired token is reported as an error status instead
+    # of a broken stream. The subscription starts before the catch-up stream
+    # opens, so no change between the two is missed.
+    hub = get_hub(collection, collection_name)
+    subscriber = replay = None
+    try:
+        subscriber = hub.subscribe(Subscriber(filters))
+        if resume_token is not None:
+            replay = open_stream(collection, filters, resume_token)
+    except Exception:
+        if subscriber is not None:
+            hub.unsubscribe(subscriber)
+        _subscriber_slots.release()
+        raise
+
+    def generate():
+        try:
+            yield f"retry: {MAX_AWAIT_MS * 3}\n\n"
+            replayed = set()
+            if replay is not None:
+                for change in catch_up(replay):
+                    change_token, message = event_message(collection_name, change)
+                    replayed.add(change_token)
+                    yield message
+                replay.close()
+            last_sent = time.monotonic()
+            while not subscriber.closed or not subscriber.messages.empty():
+                # Read before waiting: if the wait times out, every change up
+                # to this position has already been sent
+                position = hub.position
+                try:
+                    change_token, message = subscriber.messages.get(timeout=MAX_AWAIT_MS / 1000)
+                except queue.Empty:
+                    if position is not None and time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+                        yield heartbeat(collection_name, position)
+                        last_sent = time.monotonic()
+                    continue
+                if change_token not in replayed:
+                    yield message
+                    last_sent = time.monotonic()
+        finally:
+            if replay is not None:
+                replay.close()
+            hub.unsubscribe(subscriber)
+            _subscriber_slots.release()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+async def open_async_events(collection, collection_name, filters, resume_token=None):
+    # The coroutine counterpart of sse_response for asgi.py: subscribers wait
+    # on an asyncio queue instead of a thread. Returns the body as an async
+    # generator, after anything that should fail with an error status has run.
+    if not _async_subscriber_slots.acquire(blocking=False):
+        raise TooManySubscribers("Too many change stream subscribers; try again later")
+    loop = asyncio.get_running_loop()
+    hub = get_hub(collection, collection_name)
+    subscriber = AsyncSubscriber(filters, loop)
+    subscribed = False
+    replay = None
+    try:
+        # Opening a stream is blocking I/O, so it runs off the event loop
+        await loop.run_in_executor(None, hub.subscribe, subscriber)
+        subscribed = True
+        if resume_token is not None:
+            replay = await loop.run_in_executor(None, open_stream, collection, filters, resume_token)
+    except Exception:
+        if subscribed:
+            hub.unsubscribe(subscriber)
+        _async_subscriber_slots.release()
+        raise
+    return _async_events(loop, hub, subscriber, replay, collection_name)
+
+async def _async_events(loop, hub, subscriber, replay, collection_name):
+    try:
+        yield f"retry: {MAX_AWAIT_MS * 3}\n\n"
+        replayed = set()
+        while replay is not None and replay.alive:
+            change = await loop.run_in_executor(None, replay.try_next)
+            if change is None:
+                break
+            change_token, message = event_message(collection_name, change)
+            replayed.add(change_token)
+            yield message
+        last_sent = time.monotonic()
+        while not subscriber.closed or not subscriber.messages.empty():
+            position = hub.position
+            try:
+                item = await asyncio.wait_for(subscriber.messages.get(), MAX_AWAIT_MS / 1000)
+            except asyncio.TimeoutError:
+                if position is not None and time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+                    yield heartbeat(collection_name, position)
+                    last_sent = time.monotonic()
+                continue
+            if item is None:
+                continue
+            change_token, message = item
+            if change_token not in replayed:
+                yield message
+                last_sent = time.monotonic()
+    finally:
+        if replay is not None:
+            await loop.run_in_executor(None, replay.close)
+        hub.unsubscribe(subscriber)
+        _async_subscriber_slots.release()
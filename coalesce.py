@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, jsonify
+from cache import collection_version
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'generations', 'version')
+
+    def __init__(self, generations, version):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.generations = generations
+        self.version = version
+
+class SingleFlight:
+    # Concurrent identical reads share one execution: the first caller runs
+    # it and the rest wait for its result. Like TTLCache, keys are tagged
+    # with the collections they read, and invalidating a tag bumps its
+    # generation so a read that arrives after a write never joins (or gets a
+    # cached result from) a read that started before it. Generations only
+    # see this process's writes; with a window and `versions` set, reads also
+    # carry the tags' version, so a write in another worker ends the window.
+
+    def __init__(self, enabled=True, window=0.0, maxsize=1024, versions=None):
+        self.enabled = enabled
+        self.window = window
+        self.maxsize = maxsize
+        self.versions = versions
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._recent = OrderedDict()
+        self._generations = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.cached = 0
+
+    def run(self, key, compute, tags=()):
+        if not self.enabled:
+            return compute()
+        version = self.versions(tags) if self.window > 0 and self.versions is not None and tags else None
+        with self._lock:
+            generations = self._current_generations(tags)
+            recent = self._recent.get(key)
+            if recent is not None:
+                result, recent_generations, recent_version, _, expires_at = recent
+                if (recent_generations, recent_version) == (generations, version) and expires_at > time.monotonic():
+                    self.cached += 1
+                    return result
+                del self._recent[key]
+            flight = self._flights.get(key)
+            leader = flight is None or (flight.generations, flight.version) != (generations, version)
+            if leader:
+                # A flight from an older generation keeps serving the callers
+                # that already joined it, but takes no new ones.
+                flight = self._flights[key] = _Flight(generations, version)
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.error is None and self.window > 0 and self._current_generations(tags) == generations:
+                    self._recent[key] = (flight.result, generations, version, tuple(tags), time.monotonic() + self.window)
+                    self._recent.move_to_end(key)
+                    while len(self._recent) > self.maxsize:
+                        self._recent.popitem(last=False)
+            flight.done.set()
+        return flight.result
+
+    def invalidate(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            stale = [key for key, entry in self._recent.items() if tag in entry[3]]
+            for key in stale:
+                del self._recent[key]
+
+    def stats(self):
+        with self._lock:
+            reads = self.executed + self.coalesced + self.cached
+            return {
+                "enabled": self.enabled,
+                "windowSeconds": self.window,
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "cached": self.cached,
+                "sharedRate": round((self.coalesced + self.cached) / reads, 4) if reads else 0.0,
+                "inFlight": len(self._flights),
+                "cachedEntries": len(self._recent)
+            }
+
+    def _current_generations(self, tags):
+        return tuple(self._generations.get(tag, 0) for tag in tags)
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def query_key(collection_name, query, sort=None, projection=None, *extra):
+    # Filter and projection keys are order-insensitive, sort keys are not
+    return (
+        collection_name, _freeze(query),
+        tuple((field, direction) for field, direction in (sort or [])),
+        _freeze(projection), _freeze(extra)
+    )
+
+def encoded(data):
+    # Serialized once by the caller that ran the read; everyone it was shared
+    # with gets the same bytes.
+    return jsonify(data).get_data()
+
+def json_response(body):
+    return current_app.response_class(body, mimetype=current_app.json.mimetype)
+
+# A window above 0 also keeps each result for that long; reads never see
+# data older than the last write made through the API, on any worker, at the
+# cost of one collection_versions read per coalesced read.
+read_coalescer = SingleFlight(
+    enabled=os.getenv('READ_COALESCING', '1') != '0',
+    window=float(os.getenv('READ_COALESCING_WINDOW_MS', '0')) / 1000,
+    maxsize=int(os.getenv('READ_COALESCING_CACHE_SIZE', '1024')),
+    versions=collection_version
+)
@@ -0,0 +1,98 @@
+import os
+from datetime import timezone
+from flask import Response, request
+from pymongo import UpdateOne
+from database import db_instance
+
+CACHE_CONTROL = os.getenv('HTTP_CACHE_CONTROL', 'no-cache')
+
+# Every document carries a revision bumped by each update, and every
+# collection a version in collection_versions bumped by each write that goes
+# through the API. Validators are built from those numbers alone, so a
+# conditional request can be answered before the documents are read.
+# Writes made outside the API (shell, migrations) should call touch() too.
+
+def new_version_fields(now):
+    return {'revision': 1, 'updatedAt': now}
+
+def touch(*collection_names):
+    db_instance.collection_versions.bulk_write([
+        UpdateOne({'_id': name}, {'$inc': {'version': 1}, '$currentDate': {'updatedAt': True}}, upsert=True)
+        for name in collection_names
+    ], ordered=False)
+
+def _utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+def _latest(values):
+    values = [_utc(value) for value in values if value is not None]
+    return max(values) if values else None
+
+def versions_query(collection_names):
+    return {'_id': {'$in': list(collection_names)}}
+
+def validators_from_versions(collection_names, version_docs):
+    found = {doc['_id']: doc for doc in version_docs}
+    versions = [found.get(name, {}) for name in collection_names]
+    etag = '-'.join(f"{name}.{version.get('version', 0)}" for name, version in zip(collection_names, versions))
+    return etag, _latest(version.get('updatedAt') for version in versions)
+
+def collection_validators(collection_names):
+    return validators_from_versions(
+        collection_names, db_instance.collection_versions.find(versions_query(collection_names))
+    )
+
+def revision_validators(doc, related_validators=None):
+    # An embedded (expanded) document may change without the parent's
+    # revision moving, so the related collections' versions are mixed in.
+    etag = f"{doc['_id']}.{doc.get('revision', 0)}"
+    last_modified = _utc(doc.get('updatedAt') or doc.get('createdAt'))
+    if related_validators is not None:
+        related_etag, related_modified = related_validators
+        etag = f"{etag}-{related_etag}"
+        last_modified = _latest([last_modified, related_modified])
+    return etag, last_modified
+
+def document_validators(doc, related=()):
+    return revision_validators(doc, collection_validators(related) if related else None)
+
+def has_preconditions():
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+def is_not_modified(etag, last_modified):
+    # RFC 9110 13.1.3: If-Modified-Since is ignored when If-None-Match is sent
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+def not_modified(etag, last_modified):
+    return with_validators(Response(status=304), etag, last_modified)
+
+VERSION_PROJECTION = {'revision': 1, 'updatedAt': 1, 'createdAt': 1}
+
+def check_document(collection, query, related=()):
+    # Answers a conditional GET from the version fields alone; returns None
+    # when the full document has to be read (changed, missing or no
+    # preconditions sent).
+    if not has_preconditions():
+        return None
+    version = collection.find_one(query, VERSION_PROJECTION)
+    if version is None:
+        return None
+    etag, last_modified = document_validators(version, related)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified)
+    return None
@@ -1,33 +1,288 @@
-from pymongo import MongoClient, ASCENDING, DESCENDING
+import pymongo
+from pymongo import MongoClient, ASCENDING, DESCENDING, GEOSPHERE, TEXT, monitoring
+from pymongo.errors import PyMongoError
 from datetime import datetime
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class Database:
+DATABASE_NAME = os.getenv('MONGODB_DATABASE', 'real_estate_platform')
+
+WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000]
+
+READINESS_TIMEOUT_MS = int(os.getenv('READINESS_TIMEOUT_MS', '2000'))
+
+REDUNDANT_INDEXES = [
+    ('properties', 'city_1'),
+    ('properties', 'price_1'),
+    ('properties', 'propertyType_1'),
+    ('properties', 'city_1_price_1'),
+    ('inquiries', 'propertyId_1')
+]
+
+def client_options():
+    options = {}
+    for env, option, cast in [
+        ('MONGODB_MAX_POOL_SIZE', 'maxPoolSize', int),
+        ('MONGODB_MIN_POOL_SIZE', 'minPoolSize', int),
+        ('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS', int),
+        ('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS', int),
+        ('MONGODB_COMPRESSORS', 'compressors', str),
+        ('MONGODB_READ_PREFERENCE', 'readPreference', str)
+    ]:
+        value = os.getenv(env)
+        if value:
+            options[option] = cast(value)
+    return options
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    # Checkouts happen synchronously on the requesting thread, so the wait is
+    # measured from a thread-local start time.
+
     def __init__(self):
-        mongodb_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
-        self.client = MongoClient(mongodb_uri)
-        self.db = self.client['real_estate_platform']
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open_connections = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._waited_ms()
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_total_ms += waited
+            self.wait_max_ms = max(self.wait_max_ms, waited)
+            for index, bound in enumerate(WAIT_BUCKETS_MS):
+                if waited <= bound:
+                    self.wait_buckets[index] += 1
+                    break
+            else:
+                self.wait_buckets[-1] += 1
+
+    def connection_check_out_failed(self, event):
+        self._waited_ms()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
 
-        self.properties = self.db['properties']
-        self.agents = self.db['agents']
-        self.users = self.db['users']
-        self.inquiries = self.db['inquiries']
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def _waited_ms(self):
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def stats(self):
+        with self._lock:
+            buckets = {f"le_{bound}ms": count for bound, count in zip(WAIT_BUCKETS_MS, self.wait_buckets)}
+            buckets["gt_" + str(WAIT_BUCKETS_MS[-1]) + "ms"] = self.wait_buckets[-1]
+            return {
+                "openConnections": self.open_connections,
+                "inUse": self.in_use,
+                "checkouts": self.checkouts,
+                "checkoutFailures": self.checkout_failures,
+                "waitAvgMs": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "waitMaxMs": round(self.wait_max_ms, 3),
+                "waitHistogram": buckets
+            }
+
+class Database:
+    # The MongoClient is created on first use, and again in a forked child,
+    # so importing this module never opens sockets or starts monitor threads.
+
+    client_class = MongoClient
+
+    def __init__(self, uri=None):
+        self.uri = uri or os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+        self.pool_monitor = PoolMonitor()
+        # Read when the client is created; append before first use
+        self.event_listeners = [self.pool_monitor]
+        self._lock = threading.Lock()
+        self._client = None
+        self._db = None
+        self._pid = None
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = self.client_class(
+                        self.uri,
+                        event_listeners=list(self.event_listeners),
+                        **client_options()
+                    )
+                    self._db = self._client[DATABASE_NAME]
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        self.client
+        return self._db
+
+    @property
+    def properties(self):
+        return self.db['properties']
+
+    @property
+    def agents(self):
+        return self.db['agents']
+
+    @property
+    def users(self):
+        return self.db['users']
+
+    @property
+    def inquiries(self):
+        return self.db['inquiries']
+
+    @property
+    def property_stats(self):
+        return self.db['property_stats']
+
+    @property
+    def trend_rollups(self):
+        return self.db['trend_rollups']
+
+    @property
+    def collection_versions(self):
+        return self.db['collection_versions']
+
+    def bind(self, client):
+        # Use an already constructed client, e.g. an in-process stand-in
+        with self._lock:
+            self._client = client
+            self._db = client[DATABASE_NAME]
+            self._pid = os.getpid()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._db = None
+            self._pid = None
+
+    def pool_stats(self):
+        stats = self.pool_monitor.stats()
+        stats["connected"] = self._client is not None and self._pid == os.getpid()
+        if stats["connected"]:
+            pool_options = self._client.options.pool_options
+            stats["maxPoolSize"] = pool_options.max_pool_size
+            stats["minPoolSize"] = pool_options.min_pool_size
+            stats["waitQueueTimeoutMS"] = (
+                pool_options.wait_queue_timeout * 1000 if pool_options.wait_queue_timeout else None
+            )
+        return stats
+
+    def readiness(self):
+        # Ready when the deployment answers a ping within READINESS_TIMEOUT_MS
+        # and the pool is not saturated (every connection checked out, so new
+        # requests would queue for one).
+        stats = self.pool_stats()
+        started = time.perf_counter()
+        try:
+            with pymongo.timeout(READINESS_TIMEOUT_MS / 1000):
+                self.db.command('ping')
+            error = None
+        except PyMongoError as e:
+            error = str(e)
+        saturated = bool(stats.get('maxPoolSize')) and stats['inUse'] >= stats['maxPoolSize']
+        return {
+            "ready": error is None and not saturated,
+            "pingMs": round((time.perf_counter() - started) * 1000, 3),
+            "error": error,
+            "poolSaturated": saturated,
+            "pool": stats
+        }
 
     def create_indexes(self):
-        self.properties.create_index([('city', ASCENDING)])
-        self.properties.create_index([('price', ASCENDING)])
-        self.properties.create_index([('propertyType', ASCENDING)])
-        self.properties.create_index([('city', ASCENDING), ('price', ASCENDING)])
+        # Keyset pagination sorts on (sortBy, _id); these also serve any query
+        # on their prefixes, so no separate single-field indexes are kept.
+        self.properties.create_index([('price', ASCENDING), ('_id', ASCENDING)])
+        self.properties.create_index([('size', ASCENDING), ('_id', ASCENDING)])
+        self.properties.create_index([('city', ASCENDING), ('_id', ASCENDING)])
+        self.properties.create_index([('createdAt', ASCENDING), ('_id', ASCENDING)])
+        self.properties.create_index([('city', ASCENDING), ('price', ASCENDING), ('_id', ASCENDING)])
+        self.properties.create_index([('propertyType', ASCENDING), ('price', ASCENDING)])
+        self.properties.create_index([('location', GEOSPHERE), ('propertyType', ASCENDING), ('price', ASCENDING)])
+        self.properties.create_index(
+            [('title', TEXT), ('description', TEXT), ('address', TEXT)],
+            weights={'title': 10, 'address': 5, 'description': 1},
+            name='property_text'
+        )
+        self.properties.create_index(
+            [('externalId', ASCENDING)],
+            unique=True,
+            partialFilterExpression={'externalId': {'$exists': True}}
+        )
+
+        self.create_property_stats_index(self.property_stats)
+        self.create_trend_rollup_index(self.trend_rollups)
 
         self.agents.create_index([('email', ASCENDING)], unique=True)
+        self.agents.create_index([('activeListings', DESCENDING), ('_id', ASCENDING)])
         self.users.create_index([('email', ASCENDING)], unique=True)
-        self.inquiries.create_index([('propertyId', ASCENDING)])
+        self.inquiries.create_index([('propertyId', ASCENDING), ('createdAt', DESCENDING)])
+        self.inquiries.create_index([('agentId', ASCENDING), ('createdAt', DESCENDING)])
+        self.inquiries.create_index([('agentId', ASCENDING), ('status', ASCENDING), ('createdAt', DESCENDING)])
+        self.inquiries.create_index([('userId', ASCENDING), ('createdAt', DESCENDING)])
 
+        self.drop_redundant_indexes()
         print("Indexes created successfully")
 
+    def drop_redundant_indexes(self):
+        # Prefixes of the compound indexes above, created by earlier versions.
+        # Each one is pure write and memory overhead on existing databases.
+        for collection, name in REDUNDANT_INDEXES:
+            if name in self.db[collection].index_information():
+                self.db[collection].drop_index(name)
+
+    def create_property_stats_index(self, collection):
+        collection.create_index([('dimension', ASCENDING), ('key', ASCENDING)], unique=True)
+
+    def create_trend_rollup_index(self, collection):
+        collection.create_index([
+            ('source', ASCENDING), ('interval', ASCENDING), ('dimension', ASCENDING),
+            ('key', ASCENDING), ('bucket', ASCENDING)
+        ], unique=True)
+
     def seed_data(self):
         if self.properties.count_documents({}) > 0:
             print("Database already seeded")
@@ -39,7 +294,6 @@ class Database:
                 "email": "john.smith@realty.com",
                 "phone": "+1-555-0101",
                 "specialization": "Residential",
-                "activeListings": 15,
                 "createdAt": datetime.utcnow()
             },
             {
@@ -47,7 +301,6 @@ class Database:
                 "email": "sarah.johnson@realty.com",
                 "phone": "+1-555-0102",
                 "specialization": "Commercial",
-                "activeListings": 8,
                 "createdAt": datetime.utcnow()
             },
             {
@@ -55,7 +308,6 @@ class Database:
                 "email": "michael.brown@realty.com",
                 "phone": "+1-555-0103",
                 "specialization": "Luxury",
-                "activeListings": 12,
                 "createdAt": datetime.utcnow()
             }
         ]
@@ -74,7 +326,8 @@ class Database:
                 "size": 1200,
                 "city": "New York",
                 "address": "123 Main St, New York, NY 10001",
-                "agentId": str(agent_ids[0]),
+                "location": {"type": "Point", "coordinates": [-73.9857, 40.7484]},
+                "agentId": agent_ids[0],
                 "status": "Available",
                 "createdAt": datetime.utcnow()
             },
@@ -88,7 +341,8 @@ class Database:
                 "size": 2500,
                 "city": "Los Angeles",
                 "address": "456 Oak Ave, Los Angeles, CA 90001",
-                "agentId": str(agent_ids[1]),
+                "location": {"type": "Point", "coordinates": [-118.2479, 33.9731]},
+                "agentId": agent_ids[1],
                 "status": "Available",
                 "createdAt": datetime.utcnow()
             },
@@ -102,7 +356,8 @@ class Database:
                 "size": 3000,
                 "city": "New York",
                 "address": "789 Park Ave, New York, NY 10021",
-                "agentId": str(agent_ids[2]),
+                "location": {"type": "Point", "coordinates": [-73.9626, 40.7713]},
+                "agentId": agent_ids[2],
                 "status": "Available",
                 "createdAt": datetime.utcnow()
             },
@@ -116,7 +371,8 @@ class Database:
                 "size": 650,
                 "city": "Chicago",
                 "address": "321 Lake St, Chicago, IL 60601",
-                "agentId": str(agent_ids[0]),
+                "location": {"type": "Point", "coordinates": [-87.6298, 41.8858]},
+                "agentId": agent_ids[0],
                 "status": "Available",
                 "createdAt": datetime.utcnow()
             },
@@ -130,7 +386,8 @@ class Database:
                 "size": 4000,
                 "city": "Los Angeles",
                 "address": "555 Business Blvd, Los Angeles, CA 90017",
-                "agentId": str(agent_ids[1]),
+                "location": {"type": "Point", "coordinates": [-118.2620, 34.0530]},
+                "agentId": agent_ids[1],
                 "status": "Available",
                 "createdAt": datetime.utcnow()
             }
@@ -159,17 +416,17 @@ class Database:
 
         sample_inquiries = [
             {
-                "propertyId": str(property_ids[0]),
-                "userId": str(user_ids[0]),
-                "agentId": str(agent_ids[0]),
+                "propertyId": property_ids[0],
+                "userId": user_ids[0],
+                "agentId": agent_ids[0],
                 "message": "I'm interested in scheduling a viewing",
                 "status": "Pending",
                 "createdAt": datetime.utcnow()
             },
             {
-                "propertyId": str(property_ids[1]),
-                "userId": str(user_ids[1]),
-                "agentId": str(agent_ids[1]),
+                "propertyId": property_ids[1],
+                "userId": user_ids[1],
+                "agentId": agent_ids[1],
                 "message": "Can you provide more details about the property?",
                 "status": "Responded",
                 "createdAt": datetime.utcnow()
@@ -0,0 +1,88 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import g
+from database import db_instance
+
+# relation name -> (reference field, collection, projected fields)
+RELATIONS = {
+    'property': ('propertyId', 'properties', ['title', 'price', 'city', 'propertyType', 'status']),
+    'user': ('userId', 'users', ['name', 'email', 'phone']),
+    'agent': ('agentId', 'agents', ['name', 'email', 'phone', 'specialization'])
+}
+
+def parse_expand(value, allowed):
+    if not value:
+        return []
+    relations = [name.strip() for name in value.split(',') if name.strip()]
+    for name in relations:
+        if name not in allowed:
+            raise ValueError("expand must be a comma-separated subset of: " + ", ".join(allowed))
+    return relations
+
+def reference_fields(relations):
+    return [RELATIONS[name][0] for name in relations]
+
+class ReferenceLoader:
+    # Request-scoped identity map: each referenced id is fetched at most once
+    # per request, with one $in query per collection per expand() call.
+
+    def __init__(self):
+        self._documents = {}
+
+    def missing(self, collection_name, ids):
+        # The ids not loaded yet, as ObjectIds keyed by their string form
+        cache = self.documents(collection_name)
+        missing = {}
+        for value in ids:
+            key = str(value)
+            if key in cache or key in missing:
+                continue
+            try:
+                missing[key] = value if isinstance(value, ObjectId) else ObjectId(value)
+            except (InvalidId, TypeError):
+                cache[key] = None
+        return missing
+
+    def store(self, collection_name, missing, found):
+        cache = self.documents(collection_name)
+        for doc in found:
+            cache[str(doc['_id'])] = doc
+        for key in missing:
+            cache.setdefault(key, None)
+
+    def documents(self, collection_name):
+        return self._documents.setdefault(collection_name, {})
+
+    def load(self, collection_name, ids, fields):
+        missing = self.missing(collection_name, ids)
+        if missing:
+            self.store(collection_name, missing, db_instance.db[collection_name].find(
+                lookup_query(missing), {field: 1 for field in fields}
+            ))
+        return self.documents(collection_name)
+
+def lookup_query(missing):
+    return {"_id": {"$in": list(missing.values())}}
+
+def related_collections(relations):
+    return [RELATIONS[name][1] for name in relations]
+
+def get_loader():
+    if 'reference_loader' not in g:
+        g.reference_loader = ReferenceLoader()
+    return g.reference_loader
+
+def reference_ids(docs, field):
+    return [doc[field] for doc in docs if doc.get(field) is not None]
+
+def attach(docs, name, field, documents):
+    for doc in docs:
+        value = doc.get(field)
+        doc[name] = documents.get(str(value)) if value is not None else None
+
+def expand(docs, relations):
+    loader = get_loader()
+    for name in relations:
+        field, collection_name, fields = RELATIONS[name]
+        attach(docs, name, field, loader.load(collection_name, reference_ids(docs, field), fields))
+    return docs
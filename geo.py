@@ -0,0 +1,162 @@
+import math
+from pagination import decode_token, encode_token
+
+# Longitude width of each polygon a `within` box is split into. MongoDB takes
+# the smaller of the two regions a polygon ring encloses, so a ring 180
+# degrees or more wide would select the wrong side of the globe.
+MAX_POLYGON_WIDTH = 90
+
+# Polygon edges are great circles, so a long edge along a parallel bulges
+# toward the pole (a 60 degree edge at latitude 25 peaks near 28.3). The
+# south and north edges get a vertex every EDGE_VERTEX_SPACING degrees of
+# longitude, which keeps them within about 120 meters of the parallel.
+EDGE_VERTEX_SPACING = 1
+
+def _coordinate(value, name, low, high):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if not low <= number <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return number
+
+def point(longitude, latitude):
+    return {
+        "type": "Point",
+        "coordinates": [
+            _coordinate(longitude, 'longitude', -180, 180),
+            _coordinate(latitude, 'latitude', -90, 90)
+        ]
+    }
+
+def parse_point(value):
+    parts = value.split(',')
+    if len(parts) != 2:
+        raise ValueError("near must be 'longitude,latitude'")
+    return point(*parts)
+
+def parse_box(value):
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError("within must be 'minLongitude,minLatitude,maxLongitude,maxLatitude'")
+    south_west = point(parts[0], parts[1])['coordinates']
+    north_east = point(parts[2], parts[3])['coordinates']
+    if south_west[1] >= north_east[1]:
+        raise ValueError("within: minLatitude must be less than maxLatitude")
+    if south_west[0] == north_east[0]:
+        raise ValueError("within: minLongitude and maxLongitude must differ")
+    # minLongitude > maxLongitude is a box across the antimeridian
+    return south_west, north_east
+
+def _longitude_spans(west, east):
+    ranges = [(west, east)] if west < east else [(west, 180.0), (-180.0, east)]
+    spans = []
+    for low, high in ranges:
+        if high <= low:
+            continue
+        pieces = math.ceil((high - low) / MAX_POLYGON_WIDTH)
+        step = (high - low) / pieces
+        spans += [(low + step * i, high if i == pieces - 1 else low + step * (i + 1)) for i in range(pieces)]
+    return spans
+
+def _parallel(low, high, latitude):
+    steps = max(1, math.ceil((high - low) / EDGE_VERTEX_SPACING))
+    return [[high if i == steps else low + (high - low) * i / steps, latitude] for i in range(steps + 1)]
+
+def within_box(box):
+    (west, south), (east, north) = box
+    polygons = []
+    for low, high in _longitude_spans(west, east):
+        south_edge = _parallel(low, high, south)
+        north_edge = _parallel(low, high, north)
+        polygons.append([south_edge + north_edge[::-1] + [south_edge[0]]])
+    if len(polygons) == 1:
+        geometry = {"type": "Polygon", "coordinates": polygons[0]}
+    else:
+        geometry = {"type": "MultiPolygon", "coordinates": polygons}
+    return {"$geoWithin": {"$geometry": geometry}}
+
+def normalize_location(data):
+    # Accepts either a GeoJSON Point in `location` or `longitude`/`latitude`
+    # fields and stores a validated GeoJSON Point in `location`.
+    if 'longitude' in data or 'latitude' in data:
+        data['location'] = point(data.pop('longitude', None), data.pop('latitude', None))
+    elif data.get('location') is not None:
+        location = data['location']
+        if not isinstance(location, dict) or location.get('type') != 'Point':
+            raise ValueError("location must be a GeoJSON Point")
+        coordinates = location.get('coordinates')
+        if not isinstance(coordinates, list) or len(coordinates) != 2:
+            raise ValueError("location.coordinates must be [longitude, latitude]")
+        data['location'] = point(*coordinates)
+    return data
+
+def _and(query, condition):
+    return {'$and': [query, condition]} if query else condition
+
+def _geo_near(collection, near, query, limit, projection, min_distance=None, max_distance=None, stages=()):
+    geo_near = {
+        "near": near,
+        "distanceField": "distance",
+        "spherical": True,
+        "key": "location",
+        "query": query
+    }
+    if min_distance is not None:
+        geo_near['minDistance'] = min_distance
+    if max_distance is not None:
+        geo_near['maxDistance'] = max_distance
+
+    pipeline = [{"$geoNear": geo_near}, *stages, {"$limit": limit}]
+    if projection:
+        pipeline.append({"$project": {**projection, "distance": 1}})
+    return list(collection.aggregate(pipeline))
+
+def _tied(collection, near, query, distance, after_id, limit, projection):
+    # Listings at exactly `distance`, in _id order
+    if after_id is not None:
+        query = _and(query, {'_id': {'$gt': after_id}})
+    return _geo_near(collection, near, query, limit, projection, distance, distance, [{"$sort": {"_id": 1}}])
+
+def _farther(collection, near, query, distance, max_distance, limit, projection):
+    stages = [] if distance is None else [{"$match": {"distance": {"$gt": distance}}}]
+    return _geo_near(collection, near, query, limit, projection, distance, max_distance, stages)
+
+def paginate_near(collection, query, near, limit, cursor=None, max_distance=None, projection=None):
+    # $geoNear orders by distance only, so listings at the same distance (one
+    # building) come back in no particular order. A page boundary inside such
+    # a group re-reads the group by itself in _id order, so the cursor only
+    # needs (distance, last _id): the rest of the group after that _id, then
+    # everything farther.
+    distance = after_id = None
+    docs = []
+    if cursor:
+        cursor_near, distance, after_id = decode_token(cursor, 3)
+        if cursor_near != near['coordinates']:
+            raise ValueError("Cursor does not match the requested point")
+        if isinstance(after_id, (list, dict)):
+            raise ValueError("Invalid cursor")
+        docs = _tied(collection, near, query, distance, after_id, limit + 1, projection)
+    tied_count = len(docs)
+    if len(docs) <= limit:
+        docs += _farther(collection, near, query, distance, max_distance, limit + 1 - len(docs), projection)
+    if len(docs) <= limit:
+        return docs, None
+
+    last = docs[limit - 1]
+    if limit - 1 < tied_count:
+        page = docs[:limit]
+    elif docs[limit]['distance'] != last['distance']:
+        # The page holds the whole group at its last distance
+        page = docs[:limit]
+        last = max((doc for doc in page if doc['distance'] == last['distance']), key=lambda doc: doc['_id'])
+    else:
+        # The group straddles the boundary: leave it for the next page, or
+        # read it in _id order if it fills this one
+        page = [doc for doc in docs[:limit] if doc['distance'] != last['distance']]
+        if page:
+            return page, encode_token([near['coordinates'], last['distance'], None])
+        page = _tied(collection, near, query, last['distance'], None, limit, projection)
+        last = page[-1]
+    return page, encode_token([near['coordinates'], last['distance'], last['_id']])
@@ -0,0 +1,54 @@
+import os
+from database import db_instance
+import metrics
+
+# Production entry point:
+#
+#     gunicorn -c gunicorn.conf.py
+#
+# One worker process per core, each serving GUNICORN_THREADS requests at a
+# time. PyMongo releases the GIL while waiting on the server, so threads keep
+# a core busy while other requests are waiting on MongoDB.
+
+def _cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+wsgi_app = 'app:app'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(_cores())))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# Preloading imports the app once in the master, which is safe because no
+# MongoClient exists until first use. It does mean HUP restarts workers on the
+# already loaded code, so it is off unless asked for.
+preload_app = os.getenv('GUNICORN_PRELOAD', '0') == '1'
+
+# Long enough for exports and streamed pages; change stream (SSE) requests
+# send heartbeats well inside it
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers now and then, staggered so they do not restart together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+
+def on_starting(server):
+    # Snapshots left by a previous run would be added to this one's counters
+    metrics.clear_snapshots()
+
+def post_fork(server, worker):
+    # Drop any client inherited from the master (its sockets and monitor
+    # threads belong to the parent) so the worker connects on first use.
+    db_instance.close()
+
+def worker_exit(server, worker):
+    # The final counts of a recycled worker stay in the totals
+    if metrics.METRICS_ENABLED:
+        metrics.flush()
+    db_instance.close()
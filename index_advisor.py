@@ -0,0 +1,216 @@
+import os
+import threading
+from itertools import combinations
+from pymongo import ASCENDING, DESCENDING
+from database import db_instance
+
+MAX_SHAPES = 500
+
+RANGE_OPERATORS = {'$gt', '$gte', '$lt', '$lte', '$ne', '$nin', '$exists', '$regex'}
+
+def _field_kind(value):
+    if isinstance(value, dict) and value and all(key.startswith('$') for key in value):
+        operators = set(value)
+        if operators & {'$geoWithin', '$geoIntersects', '$near', '$nearSphere'}:
+            return 'geo'
+        # a short $in still lets an (eq, sort) index merge-sort its branches
+        if operators <= {'$eq', '$in'}:
+            return 'eq'
+        if operators <= RANGE_OPERATORS:
+            return 'range'
+        return 'other'
+    return 'eq'
+
+def query_shape(query, sort=None):
+    # Values are dropped so that queries differing only in literals share a
+    # shape; the kind of predicate per field is what index choice depends on.
+    fields = []
+    for field, value in (query or {}).items():
+        if field.startswith('$'):
+            fields.append((field, 'other'))
+        else:
+            fields.append((field, _field_kind(value)))
+    return (tuple(sorted(fields)), tuple((field, direction) for field, direction in (sort or [])))
+
+class QueryShapeRecorder:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._shapes = {}
+
+    def record(self, collection, query, sort=None):
+        if not self.enabled:
+            return
+        key = (collection, query_shape(query, sort))
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is None:
+                if len(self._shapes) >= MAX_SHAPES:
+                    return
+                entry = self._shapes[key] = {"count": 0}
+            entry['count'] += 1
+            entry['query'] = query
+            entry['sort'] = list(sort or [])
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                (collection, shape, dict(entry))
+                for (collection, shape), entry in self._shapes.items()
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+query_shapes = QueryShapeRecorder(enabled=os.getenv('QUERY_SHAPE_RECORDING', '1') != '0')
+
+def recommend_index(shape):
+    # ESR rule: equality fields first, then the sort keys in sort order and
+    # direction, then range fields.
+    fields, sort = shape
+    if any(kind in ('geo', 'other') for _, kind in fields):
+        return None
+    equality = [field for field, kind in fields if kind == 'eq']
+    ranges = [field for field, kind in fields if kind == 'range']
+    keys = [(field, ASCENDING) for field in equality]
+    for field, direction in sort:
+        if field not in equality:
+            keys.append((field, direction))
+    for field in ranges:
+        if field not in [key for key, _ in keys]:
+            keys.append((field, ASCENDING))
+    if keys == [('_id', ASCENDING)] or not keys:
+        return None
+    return keys
+
+def _is_served_by(keys, index_keys):
+    prefix = index_keys[:len(keys)]
+    if len(prefix) < len(keys):
+        return False
+    if [field for field, _ in prefix] != [field for field, _ in keys]:
+        return False
+    same = all(a == b for (_, a), (_, b) in zip(prefix, keys))
+    reversed_ = all(a == -b for (_, a), (_, b) in zip(prefix, keys) if isinstance(a, int) and isinstance(b, int))
+    return same or reversed_
+
+def _plan_stages(plan, stages):
+    if not isinstance(plan, dict):
+        return stages
+    stage = plan.get('stage')
+    if stage:
+        stages.append((stage, plan.get('indexName')))
+    for child_key in ('inputStage', 'queryPlan'):
+        _plan_stages(plan.get(child_key), stages)
+    for child in plan.get('inputStages', []):
+        _plan_stages(child, stages)
+    return stages
+
+def summarize_explain(explain):
+    planner = explain.get('queryPlanner', {})
+    stages = _plan_stages(planner.get('winningPlan', {}), [])
+    stats = explain.get('executionStats', {})
+    stage_names = [stage for stage, _ in stages]
+    return {
+        "stages": stage_names,
+        "indexes": [index for _, index in stages if index],
+        "collectionScan": 'COLLSCAN' in stage_names,
+        "blockingSort": 'SORT' in stage_names,
+        "docsExamined": stats.get('totalDocsExamined'),
+        "keysExamined": stats.get('totalKeysExamined'),
+        "nReturned": stats.get('nReturned'),
+        "executionTimeMs": stats.get('executionTimeMillis')
+    }
+
+# Filter/sort combinations the list routes accept, so shapes can be checked
+# before any traffic has been recorded (e.g. from the CLI).
+ROUTE_FILTERS = {
+    'properties': {'city': 'eq', 'propertyType': 'eq', 'price': 'range'},
+    'inquiries': {'propertyId': 'eq', 'userId': 'eq', 'agentId': 'eq', 'status': 'eq'},
+    'agents': {'specialization': 'eq'}
+}
+
+ROUTE_SORTS = {
+    'properties': [[(field, DESCENDING), ('_id', DESCENDING)] for field in ('price', 'size', 'city', 'createdAt')],
+    'inquiries': [[('createdAt', DESCENDING)]]
+}
+
+def catalog_entries():
+    entries = []
+    for collection_name, filters in ROUTE_FILTERS.items():
+        sample = db_instance.db[collection_name].find_one({}, {field: 1 for field in filters}) or {}
+        sorts = ROUTE_SORTS.get(collection_name, [[]])
+        for size in range(len(filters) + 1):
+            for subset in combinations(filters, size):
+                query = {}
+                for field in subset:
+                    if filters[field] == 'range':
+                        query[field] = {'$gte': 0}
+                    else:
+                        query[field] = sample.get(field, '')
+                for sort in sorts:
+                    entries.append((collection_name, query_shape(query, sort), {"count": 0, "query": query, "sort": sort}))
+    return entries
+
+def analyze(limit=None, include_catalog=False):
+    report = []
+    index_cache = {}
+    entries = query_shapes.snapshot()
+    if include_catalog:
+        recorded = {(collection_name, shape) for collection_name, shape, _ in entries}
+        entries += [entry for entry in catalog_entries() if (entry[0], entry[1]) not in recorded]
+    for collection_name, shape, entry in entries:
+        collection = db_instance.db[collection_name]
+        if collection_name not in index_cache:
+            index_cache[collection_name] = [
+                list(info['key']) for info in collection.index_information().values()
+            ]
+
+        cursor = collection.find(entry['query'])
+        if entry['sort']:
+            cursor = cursor.sort(entry['sort'])
+        if limit:
+            cursor = cursor.limit(limit)
+        try:
+            plan = summarize_explain(cursor.explain())
+        except Exception as e:
+            plan = {"error": str(e)}
+
+        recommended = recommend_index(shape)
+        served = recommended is not None and any(
+            _is_served_by(recommended, index_keys) for index_keys in index_cache[collection_name]
+        )
+        fields, sort = shape
+        report.append({
+            "collection": collection_name,
+            "filter": {field: kind for field, kind in fields},
+            "sort": [[field, direction] for field, direction in sort],
+            "count": entry['count'],
+            "plan": plan,
+            "recommendedIndex": [[field, direction] for field, direction in recommended] if recommended else None,
+            "indexExists": served,
+            "needsIndex": bool(recommended) and not served and (
+                plan.get('collectionScan') or plan.get('blockingSort') or False
+            )
+        })
+    report.sort(key=lambda row: (not row['needsIndex'], -row['count']))
+    return report
+
+def apply_recommendations(report):
+    needed = {}
+    for row in report:
+        if row['needsIndex']:
+            keys = [(field, direction) for field, direction in row['recommendedIndex']]
+            needed.setdefault(row['collection'], [])
+            if keys not in needed[row['collection']]:
+                needed[row['collection']].append(keys)
+
+    created = []
+    for collection_name, key_lists in needed.items():
+        for keys in key_lists:
+            # an index on a longer key list also serves its prefixes
+            if any(other != keys and _is_served_by(keys, other) for other in key_lists):
+                continue
+            name = db_instance.db[collection_name].create_index(keys)
+            created.append({"collection": collection_name, "index": name})
+    return created
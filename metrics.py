@@ -0,0 +1,488 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from bson.raw_bson import RawBSONDocument
+from flask import Response, jsonify, request
+from pymongo import monitoring
+from database import db_instance
+from coalesce import read_coalescer
+from index_advisor import query_shape, summarize_explain
+
+# Off by default: when disabled no request hooks are installed and no command
+# listener is registered with the client, so pymongo skips event publishing
+# entirely and requests pay nothing.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '200'))
+
+# Counters live in each worker process. With a shared directory set, every
+# process writes a snapshot there every METRICS_FLUSH_SECONDS, and /metrics
+# (answered by whichever worker gets the scrape) adds up all of them.
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+# Prometheus' default latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+slow_query_log = logging.getLogger('slow_queries')
+log = logging.getLogger(__name__)
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(counts), total, count] for labels, (counts, total, count) in self._series.items()]
+
+    def expose(self, snapshots=()):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        merged = {}
+        for snapshot in [self.snapshot(), *snapshots]:
+            for labels, counts, total, count in snapshot:
+                series = merged.setdefault(tuple(labels), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                series[0] = [merged_count + bucket_count for merged_count, bucket_count in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+        for labels, (counts, total, count) in sorted(merged.items()):
+            base = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{{{base},le=\"{bound}\"}} {cumulative}")
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def expose(self, snapshots=()):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        merged = {}
+        for snapshot in [self.snapshot(), *snapshots]:
+            for labels, value in snapshot:
+                merged[tuple(labels)] = merged.get(tuple(labels), 0) + value
+        for labels, value in sorted(merged.items()):
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+def _gauge(name, help_text, value, kind='gauge'):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Request latency, including streamed bodies.',
+    ('method', 'route', 'status'), LATENCY_BUCKETS
+)
+request_mongo_duration = Histogram(
+    'http_request_mongo_duration_seconds', 'Time spent in MongoDB commands per request.',
+    ('route',), LATENCY_BUCKETS
+)
+request_mongo_commands = Counter(
+    'http_request_mongo_commands_total', 'MongoDB commands issued while serving a route.', ('route',)
+)
+request_mongo_documents = Counter(
+    'http_request_mongo_documents_total', 'Documents returned by MongoDB to a route.', ('route',)
+)
+request_mongo_bytes = Counter(
+    'http_request_mongo_reply_bytes_total', 'BSON bytes of raw documents MongoDB returned to a route.', ('route',)
+)
+command_duration = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command round-trip time.',
+    ('command', 'collection'), MONGO_BUCKETS
+)
+command_failures = Counter(
+    'mongodb_command_failures_total', 'MongoDB commands that returned an error.', ('command', 'collection')
+)
+slow_queries_total = Counter(
+    'mongodb_slow_queries_total', 'MongoDB commands slower than SLOW_QUERY_MS.', ('command', 'collection')
+)
+
+class RequestStats:
+    __slots__ = ('route', 'started', 'mongo_seconds', 'commands', 'documents', 'reply_bytes', '_lock')
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.mongo_seconds = 0.0
+        self.commands = 0
+        self.documents = 0
+        self.reply_bytes = 0
+        # Fan-out threads (see in_current_request) add to the same request
+        self._lock = threading.Lock()
+
+    def add(self, seconds, documents=0, reply_bytes=0):
+        with self._lock:
+            self.mongo_seconds += seconds
+            self.commands += 1
+            self.documents += documents
+            self.reply_bytes += reply_bytes
+
+# pymongo publishes command events synchronously on the thread that runs the
+# command, which is the thread serving the request (streamed bodies included).
+_local = threading.local()
+
+def in_current_request(fn):
+    # Wraps fn to run on another thread (e.g. an executor) with its commands
+    # attributed to the request that is current here.
+    stats = getattr(_local, 'current', None)
+
+    def run(*args, **kwargs):
+        previous = getattr(_local, 'current', None)
+        _local.current = stats
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.current = previous
+    return run
+
+def _collection_name(command_name, command):
+    if command_name == 'getMore':
+        return command.get('collection')
+    value = command.get(command_name)
+    return value if isinstance(value, str) else None
+
+def _reply_documents(reply):
+    cursor = reply.get('cursor')
+    if cursor is not None:
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+    if 'value' in reply:
+        return 1 if reply['value'] is not None else 0
+    return reply.get('n', 0)
+
+def _reply_bytes(reply):
+    # Counted only where the bytes are already at hand: the raw documents of
+    # a cursor batch. Decoded replies would have to be re-encoded, which
+    # costs more than the metric is worth on every command.
+    if isinstance(reply, RawBSONDocument):
+        return len(reply.raw)
+    cursor = reply.get('cursor')
+    if not isinstance(cursor, dict):
+        return 0
+    batch = cursor.get('firstBatch', cursor.get('nextBatch', ()))
+    return sum(len(doc.raw) for doc in batch if isinstance(doc, RawBSONDocument))
+
+def _command_shape(command_name, command):
+    if command_name == 'aggregate':
+        pipeline = command.get('pipeline', [])
+        first = pipeline[0] if pipeline else {}
+        fields, _ = query_shape(first.get('$match'))
+        return {
+            "pipeline": [next(iter(stage), None) for stage in pipeline],
+            "filter": {field: kind for field, kind in fields}
+        }
+    query = command.get('filter', command.get('query'))
+    if command_name in ('update', 'delete'):
+        statements = command.get('updates') or command.get('deletes') or [{}]
+        query = statements[0].get('q')
+    sort = list((command.get('sort') or {}).items())
+    fields, sort = query_shape(query, sort)
+    return {"filter": {field: kind for field, kind in fields}, "sort": [[field, direction] for field, direction in sort]}
+
+class SlowQueryLog:
+    def __init__(self, maxlen):
+        self._entries = deque(maxlen=maxlen)
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def record(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+
+    def _plan(self, entry):
+        # Explained when the log is read rather than from inside the listener,
+        # once per collection and shape.
+        if entry['command'] != 'find' or not entry['collection']:
+            return None
+        key = (entry['collection'], repr(entry['shape']))
+        if key not in self._plans:
+            cursor = db_instance.db[entry['collection']].find(entry['filter'] or {})
+            if entry['sort']:
+                cursor = cursor.sort(entry['sort'])
+            try:
+                self._plans[key] = summarize_explain(cursor.explain())
+            except Exception as e:
+                self._plans[key] = {"error": str(e)}
+        return self._plans[key]
+
+    def snapshot(self, explain=True):
+        with self._lock:
+            entries = list(self._entries)
+        result = []
+        for entry in reversed(entries):
+            row = {field: value for field, value in entry.items() if field not in ('filter', 'sort')}
+            if explain:
+                row['plan'] = self._plan(entry)
+            result.append(row)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._plans.clear()
+
+slow_queries = SlowQueryLog(SLOW_QUERY_LOG_SIZE)
+
+# Commands issued by the slow query log itself, or that are not queries
+IGNORED_COMMANDS = {'explain', 'hello', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue'}
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        # The command document is kept only for the slow query log
+        self._pending[(event.connection_id, event.request_id)] = (
+            getattr(_local, 'current', None), event.command_name,
+            _collection_name(event.command_name, event.command), event.command
+        )
+
+    def succeeded(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        stats, command_name, collection, command = pending
+        seconds = event.duration_micros / 1e6
+        command_duration.observe((command_name, collection or ''), seconds)
+        documents = _reply_documents(event.reply)
+        reply_bytes = _reply_bytes(event.reply)
+        if stats is not None:
+            stats.add(seconds, documents, reply_bytes)
+        if seconds * 1000 >= SLOW_QUERY_MS and command_name not in IGNORED_COMMANDS:
+            self._slow(stats, command_name, collection, command, seconds, documents)
+
+    def failed(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        stats, command_name, collection, _ = pending
+        seconds = event.duration_micros / 1e6
+        command_duration.observe((command_name, collection or ''), seconds)
+        command_failures.inc((command_name, collection or ''))
+        if stats is not None:
+            stats.add(seconds)
+
+    def _slow(self, stats, command_name, collection, command, seconds, documents):
+        shape = _command_shape(command_name, command)
+        duration_ms = round(seconds * 1000, 3)
+        slow_queries_total.inc((command_name, collection or ''))
+        slow_queries.record({
+            "at": datetime.utcnow(),
+            "route": stats.route if stats is not None else None,
+            "command": command_name,
+            "collection": collection,
+            "shape": shape,
+            "durationMs": duration_ms,
+            "documentsReturned": documents,
+            "filter": command.get('filter') if command_name == 'find' else None,
+            "sort": list((command.get('sort') or {}).items()) if command_name == 'find' else None
+        })
+        slow_query_log.warning(
+            "slow %s on %s: %.1f ms, %d documents, shape %s",
+            command_name, collection, duration_ms, documents, shape
+        )
+
+command_metrics = CommandMetrics()
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _start_request():
+    _start_flusher()
+    _local.current = RequestStats(_route())
+
+def _finish_request(stats, method, status):
+    request_duration.observe((method, stats.route, status), time.perf_counter() - stats.started)
+    request_mongo_duration.observe((stats.route,), stats.mongo_seconds)
+    if stats.commands:
+        request_mongo_commands.inc((stats.route,), stats.commands)
+        request_mongo_documents.inc((stats.route,), stats.documents)
+        request_mongo_bytes.inc((stats.route,), stats.reply_bytes)
+    if getattr(_local, 'current', None) is stats:
+        _local.current = None
+
+def record_request(method, route, status, started):
+    # Requests the async server answers without the Flask hooks (asgi.py).
+    # Motor runs their commands on its own threads, so no Mongo time is
+    # attributed to them.
+    if METRICS_ENABLED:
+        _start_flusher()
+        request_duration.observe((method, route, status), time.perf_counter() - started)
+
+def _after_request(response):
+    stats = getattr(_local, 'current', None)
+    if stats is None:
+        return response
+    # Streamed bodies run their queries after this hook, so the request is
+    # recorded when the response is closed.
+    method, status = request.method, str(response.status_code)
+    response.call_on_close(lambda: _finish_request(stats, method, status))
+    response.headers['Server-Timing'] = (
+        f"mongo;dur={stats.mongo_seconds * 1000:.1f};desc=\"{stats.commands} commands\", "
+        f"app;dur={(time.perf_counter() - stats.started) * 1000:.1f}"
+    )
+    return response
+
+METRICS = (request_duration, request_mongo_duration, request_mongo_commands, request_mongo_documents,
+           request_mongo_bytes, command_duration, command_failures, slow_queries_total)
+
+# Per-process values; the gauges are reported per live process, the counters
+# summed over every process that has run
+PROCESS_GAUGES = (
+    ('mongodb_pool_open_connections', 'Open pooled connections.', 'openConnections'),
+    ('mongodb_pool_in_use_connections', 'Checked out connections.', 'inUse')
+)
+PROCESS_COUNTERS = (
+    ('mongodb_pool_checkouts_total', 'Connection checkouts.', 'checkouts'),
+    ('mongodb_pool_checkout_failures_total', 'Checkouts that timed out or failed.', 'checkoutFailures'),
+    ('read_coalescing_executed_total', 'Coalescable reads that ran a query.', 'executed'),
+    ('read_coalescing_coalesced_total', 'Reads that shared a concurrent identical read.', 'coalesced'),
+    ('read_coalescing_cached_total', 'Reads served from the coalescing window.', 'cached')
+)
+
+def _process_values():
+    return {**db_instance.pool_stats(), **read_coalescer.stats()}
+
+def snapshot():
+    values = _process_values()
+    return {
+        "pid": os.getpid(),
+        "metrics": {metric.name: metric.snapshot() for metric in METRICS},
+        "process": {key: values[key] for _, _, key in PROCESS_GAUGES + PROCESS_COUNTERS}
+    }
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_MULTIPROC_DIR, f'{pid}.json')
+
+def flush():
+    if not METRICS_MULTIPROC_DIR:
+        return
+    path = _snapshot_path(os.getpid())
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    # Renamed into place so a scrape never reads a half-written file
+    os.replace(f'{path}.tmp', path)
+
+def clear_snapshots():
+    # Called once before the workers start (gunicorn.conf.py on_starting)
+    if not METRICS_MULTIPROC_DIR:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_MULTIPROC_DIR):
+        if name.endswith('.json') or name.endswith('.json.tmp'):
+            os.remove(os.path.join(METRICS_MULTIPROC_DIR, name))
+
+def _other_snapshots():
+    snapshots = []
+    for name in os.listdir(METRICS_MULTIPROC_DIR):
+        if not name.endswith('.json') or name == f'{os.getpid()}.json':
+            continue
+        try:
+            with open(os.path.join(METRICS_MULTIPROC_DIR, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except OSError as e:
+            log.warning("could not write metrics snapshot: %s", e)
+
+def _start_flusher():
+    # Started from the first request in each process, after any fork
+    global _flusher_pid
+    if not METRICS_MULTIPROC_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_periodically, daemon=True, name='metrics-flush').start()
+
+def exposition():
+    others = _other_snapshots() if METRICS_MULTIPROC_DIR else []
+    lines = []
+    for metric in METRICS:
+        lines += metric.expose([other['metrics'].get(metric.name, []) for other in others])
+    own = _process_values()
+    if not METRICS_MULTIPROC_DIR:
+        for name, help_text, key in PROCESS_GAUGES:
+            lines += _gauge(name, help_text, own[key])
+    else:
+        processes = [(os.getpid(), own)] + [(other['pid'], other['process']) for other in others if _alive(other['pid'])]
+        for name, help_text, key in PROCESS_GAUGES:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{{pid=\"{pid}\"}} {values[key]}" for pid, values in processes]
+    for name, help_text, key in PROCESS_COUNTERS:
+        lines += _gauge(name, help_text, own[key] + sum(other['process'][key] for other in others), 'counter')
+    return '\n'.join(lines) + '\n'
+
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled; set METRICS_ENABLED=1"}), 404
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    if not METRICS_ENABLED:
+        return
+    # Registered before the client is first created, which is what makes
+    # pymongo publish command events
+    db_instance.event_listeners.append(command_metrics)
+    app.before_request(_start_request)
+    app.after_request(_after_request)
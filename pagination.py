@@ -0,0 +1,85 @@
+import base64
+from bson import json_util
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE, name='limit'):
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if limit < 1:
+        raise ValueError(f"{name} must be positive")
+    return min(limit, maximum)
+
+def encode_token(values):
+    payload = json_util.dumps(values)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_token(token, size):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        values = json_util.loads(payload)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+def encode_cursor(sort_by, sort_order, doc):
+    return encode_token([sort_by, sort_order, doc.get(sort_by), doc['_id']])
+
+def decode_cursor(token, sort_by, sort_order):
+    cursor_sort_by, cursor_sort_order, value, last_id = decode_token(token, 4)
+    if cursor_sort_by != sort_by or cursor_sort_order != sort_order:
+        raise ValueError("Cursor does not match the requested sort")
+    return value, last_id
+
+def keyset_filter(sort_by, sort_order, value, last_id):
+    # Documents strictly after (value, last_id) in (sort_by, _id) order.
+    # Missing/null sort keys sort lowest, so they come last in descending order.
+    op = '$lt' if sort_order == -1 else '$gt'
+    if value is None:
+        branches = [{sort_by: None, '_id': {op: last_id}}]
+        if sort_order == 1:
+            branches.append({sort_by: {'$ne': None}})
+    else:
+        branches = [
+            {sort_by: {op: value}},
+            {sort_by: value, '_id': {op: last_id}}
+        ]
+        if sort_order == -1:
+            branches.append({sort_by: None})
+    return {'$or': branches}
+
+def page_query(query, sort_by, sort_order, cursor=None):
+    if not cursor:
+        return query
+    value, last_id = decode_cursor(cursor, sort_by, sort_order)
+    after = keyset_filter(sort_by, sort_order, value, last_id)
+    return {'$and': [query, after]} if query else after
+
+def page_sort(sort_by, sort_order):
+    return [(sort_by, sort_order), ('_id', sort_order)]
+
+def paginate(collection, query, sort_by, sort_order, limit, cursor=None, projection=None):
+    docs = list(
+        collection.find(page_query(query, sort_by, sort_order, cursor), projection)
+        .sort(page_sort(sort_by, sort_order))
+        .limit(limit + 1)
+    )
+    return finish_page(docs, sort_by, sort_order, limit)
+
+def finish_page(docs, sort_by, sort_order, limit):
+    # Pages are read with limit + 1 so the extra document says whether there
+    # is a next page
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(sort_by, sort_order, docs[-1])
+
+    return docs, next_cursor
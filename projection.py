@@ -0,0 +1,27 @@
+import re
+
+FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+MAX_FIELDS = 50
+
+def parse_fields(value):
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if len(fields) > MAX_FIELDS:
+        raise ValueError(f"fields accepts at most {MAX_FIELDS} names")
+    for field in fields:
+        if not FIELD_NAME.match(field):
+            raise ValueError(f"Invalid field name: {field}")
+    return fields
+
+def build_projection(fields, required=()):
+    # Inclusion projection; _id is always returned. Keeping the projection to
+    # fields of a compound index that also holds _id lets MongoDB answer the
+    # query from the index alone (a covered query).
+    if fields is None:
+        return None
+    projection = {field: 1 for field in fields}
+    for field in required:
+        projection[field] = 1
+    projection.pop('_id', None)
+    return projection
@@ -0,0 +1,262 @@
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from database import db_instance
+import sketches
+
+PRICE_BOUNDARIES = [0, 300000, 500000, 700000, 1000000, 10000000]
+
+PRICE_RANGE_LABELS = {
+    0: "$0 - $300,000",
+    300000: "$300,000 - $500,000",
+    500000: "$500,000 - $700,000",
+    700000: "$700,000 - $1,000,000",
+    1000000: "$1,000,000+"
+}
+
+# Group counts and price sums are kept in `property_stats` with $inc deltas,
+# which commute, so concurrent writers never lose updates. Min/max cannot be
+# maintained that way under deletes, so they are read from the
+# (city, price) / (propertyType, price) indexes with one seek per bound.
+# City and type groups also carry price/size quantile sketches ($inc) and an
+# agentId distinct-count sketch ($max); see sketches.py.
+
+SKETCH_FIELDS = ('priceSketch', 'sizeSketch', 'agentSketch')
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def price_bucket(price):
+    if _is_number(price):
+        for lower, upper in zip(PRICE_BOUNDARIES, PRICE_BOUNDARIES[1:]):
+            if lower <= price < upper:
+                return lower
+    return 'Other'
+
+def _changes(prop, sign):
+    price = prop.get('price')
+    priced = _is_number(price)
+    size = prop.get('size')
+    group_inc = {
+        'count': sign,
+        'pricedCount': sign if priced else 0,
+        'totalPrice': sign * price if priced else 0
+    }
+    if priced:
+        group_inc[f"priceSketch.{sketches.quantile_bucket(price)}"] = sign
+    if _is_number(size):
+        group_inc[f"sizeSketch.{sketches.quantile_bucket(size)}"] = sign
+    # A register only ever grows, so removals leave the distinct count as an
+    # upper bound until the next rebuild.
+    group_max = {}
+    if sign > 0 and prop.get('agentId') is not None:
+        register, rank = sketches.distinct_register(prop['agentId'])
+        group_max[f"agentSketch.{register}"] = rank
+    return [
+        ('city', prop.get('city'), group_inc, group_max),
+        ('propertyType', prop.get('propertyType'), group_inc, group_max),
+        ('priceBucket', price_bucket(price), {'count': sign}, {}),
+        ('bedrooms', prop.get('bedrooms'), {'count': sign}, {})
+    ]
+
+def _merge(changes, merged=None):
+    merged = {} if merged is None else merged
+    for dimension, key, inc, maxes in changes:
+        totals, highest = merged.setdefault((dimension, key), ({}, {}))
+        for field, delta in inc.items():
+            totals[field] = totals.get(field, 0) + delta
+        for field, value in maxes.items():
+            highest[field] = max(highest.get(field, 0), value)
+    return merged
+
+def _apply(changes):
+    ops = []
+    emptied = []
+    for (dimension, key), (inc, maxes) in _merge(changes).items():
+        inc = {field: delta for field, delta in inc.items() if delta}
+        if not inc and not maxes:
+            continue
+        update = {}
+        if inc:
+            update['$inc'] = inc
+        if maxes:
+            update['$max'] = maxes
+        ops.append(UpdateOne({'dimension': dimension, 'key': key}, update, upsert=True))
+        if inc.get('count', 0) < 0:
+            emptied.append((dimension, key))
+
+    if ops:
+        db_instance.property_stats.bulk_write(ops, ordered=False)
+    for dimension, key in emptied:
+        db_instance.property_stats.delete_one({'dimension': dimension, 'key': key, 'count': {'$lte': 0}})
+
+def record_insert(prop):
+    _apply(_changes(prop, 1))
+
+def record_delete(prop):
+    _apply(_changes(prop, -1))
+
+def record_update(old_prop, new_prop):
+    _apply(_changes(old_prop, -1) + _changes(new_prop, 1))
+
+def record_many(pairs):
+    # pairs of (old, new) documents; None on either side for inserts/deletes
+    changes = []
+    for old_prop, new_prop in pairs:
+        if old_prop is not None:
+            changes += _changes(old_prop, -1)
+        if new_prop is not None:
+            changes += _changes(new_prop, 1)
+    _apply(changes)
+
+def _nested(flat):
+    doc = {}
+    for path, value in flat.items():
+        field, _, sub = path.partition('.')
+        if sub:
+            doc.setdefault(field, {})[sub] = value
+        else:
+            doc[field] = value
+    return doc
+
+def rebuild():
+    # Replays every listing through _changes so rebuilt documents match what
+    # the incremental path produces, sketches included. Deltas applied to the
+    # live collection while this runs are lost when it is replaced, so run it
+    # while writes are quiet.
+    fields = {'_id': 0, 'city': 1, 'propertyType': 1, 'price': 1, 'size': 1, 'agentId': 1, 'bedrooms': 1}
+    merged = {}
+    for prop in db_instance.properties.find({}, fields).batch_size(5000):
+        _merge(_changes(prop, 1), merged)
+
+    docs = [
+        {'dimension': dimension, 'key': key, **_nested(inc), **_nested(maxes)}
+        for (dimension, key), (inc, maxes) in merged.items()
+    ]
+    # Built aside and renamed over the live collection, so analytics never
+    # read it empty or half-filled
+    staging = db_instance.db['property_stats_rebuild']
+    staging.drop()
+    if docs:
+        staging.insert_many(docs)
+    db_instance.create_property_stats_index(staging)
+    staging.rename(db_instance.property_stats.name, dropTarget=True)
+    return len(docs)
+
+SUMMARY_PROJECTION = {field: 0 for field in SKETCH_FIELDS}
+
+PRICE_BOUND_PROJECTION = {'_id': 0, 'price': 1}
+
+# The row builders below take documents that were already read, so the async
+# server (asgi.py) shares them and only does its own I/O.
+
+def groups_query(dimension):
+    return {'dimension': dimension, 'count': {'$gt': 0}}
+
+def price_bound_query(field, key):
+    return {field: key, 'price': {'$type': 'number'}}
+
+def _groups(dimension, with_sketches=False):
+    return db_instance.property_stats.find(groups_query(dimension), None if with_sketches else SUMMARY_PROJECTION)
+
+def _average(group):
+    if not group.get('pricedCount'):
+        return None
+    return round(group['totalPrice'] / group['pricedCount'], 2)
+
+def _price_bound(field, key, direction):
+    doc = db_instance.properties.find_one(
+        price_bound_query(field, key), PRICE_BOUND_PROJECTION, sort=[('price', direction)]
+    )
+    return doc['price'] if doc else None
+
+def _by_average_desc(row):
+    return (row['averagePrice'] is not None, row['averagePrice'] or 0)
+
+def city_rows(groups, bounds):
+    # bounds holds a (min, max) price pair per group
+    result = []
+    for group, (min_price, max_price) in zip(groups, bounds):
+        result.append({
+            "city": group['key'],
+            "averagePrice": _average(group),
+            "propertyCount": group['count'],
+            "minPrice": min_price,
+            "maxPrice": max_price
+        })
+    result.sort(key=_by_average_desc, reverse=True)
+    return result
+
+def average_price_by_city():
+    groups = list(_groups('city'))
+    bounds = [
+        (_price_bound('city', group['key'], ASCENDING), _price_bound('city', group['key'], DESCENDING))
+        for group in groups
+    ]
+    return city_rows(groups, bounds)
+
+def type_rows(groups):
+    result = []
+    for group in groups:
+        result.append({
+            "propertyType": group['key'],
+            "count": group['count'],
+            "averagePrice": _average(group),
+            "totalValue": group.get('totalPrice', 0)
+        })
+    result.sort(key=lambda row: row['count'], reverse=True)
+    return result
+
+def properties_by_type():
+    return type_rows(_groups('propertyType'))
+
+def price_range_rows(groups):
+    groups = sorted(groups, key=lambda g: (g['key'] == 'Other', g['key'] if g['key'] != 'Other' else 0))
+    return [
+        {"priceRange": PRICE_RANGE_LABELS.get(group['key'], "Other"), "count": group['count']}
+        for group in groups
+    ]
+
+def price_range_distribution():
+    return price_range_rows(_groups('priceBucket'))
+
+def _facet_order(row):
+    # Count descending, then values in MongoDB's null < number < string order
+    value = row['value']
+    rank = 0 if value is None else 1 if _is_number(value) else 2
+    return (-row['count'], rank, value if value is not None else 0)
+
+def facet_summary():
+    # Search facets over every listing, without touching `properties`
+    facets = {}
+    for dimension in ('city', 'propertyType', 'bedrooms'):
+        rows = [{"value": group['key'], "count": group['count']} for group in _groups(dimension)]
+        facets[dimension] = sorted(rows, key=_facet_order)
+    facets['priceRange'] = [
+        {"value": row['priceRange'], "count": row['count']} for row in price_range_distribution()
+    ]
+    return facets
+
+def _sketch_summary(groups, fractions):
+    return {
+        "price": _labelled(sketches.quantiles(sketches.merge_counts(g.get('priceSketch') for g in groups), fractions)),
+        "size": _labelled(sketches.quantiles(sketches.merge_counts(g.get('sizeSketch') for g in groups), fractions)),
+        "distinctAgents": sketches.distinct_count(sketches.merge_registers(g.get('agentSketch') for g in groups))
+    }
+
+def _labelled(values):
+    return {f"p{round(fraction * 100, 1):g}": value for fraction, value in values.items()}
+
+def distribution_summary(dimension, fractions=(0.5, 0.9)):
+    # Per-group sketches are merged for the overall row, the same way they
+    # would be merged across shards or time ranges.
+    groups = list(_groups(dimension, with_sketches=True))
+    rows = [
+        {dimension: group['key'], "count": group['count'], **_sketch_summary([group], fractions)}
+        for group in groups
+    ]
+    rows.sort(key=lambda row: row['count'], reverse=True)
+    return {
+        "data": rows,
+        "overall": {"count": sum(group['count'] for group in groups), **_sketch_summary(groups, fractions)},
+        "quantileRelativeError": sketches.RELATIVE_ACCURACY,
+        "distinctStandardError": round(sketches.HLL_STANDARD_ERROR, 4)
+    }
@@ -0,0 +1,37 @@
+from bson import ObjectId
+
+# Reference fields are stored as ObjectId. Documents written before the
+# migration may still hold the hex string, so filters match both forms
+# until `flask --app app migrate-references` has run.
+REFERENCE_FIELDS = {
+    'properties': ['agentId'],
+    'inquiries': ['propertyId', 'userId', 'agentId']
+}
+
+def to_object_id(value):
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def normalize_references(data, collection_name):
+    for field in REFERENCE_FIELDS[collection_name]:
+        if field in data:
+            data[field] = to_object_id(data[field])
+    return data
+
+def reference_filter(value):
+    object_id = to_object_id(value)
+    if isinstance(object_id, ObjectId):
+        return {'$in': [object_id, str(object_id)]}
+    return value
+
+def migrate(db):
+    converted = {}
+    for collection_name, fields in REFERENCE_FIELDS.items():
+        for field in fields:
+            result = db.db[collection_name].update_many(
+                {field: {'$type': 'string', '$regex': '^[0-9a-fA-F]{24}$'}},
+                [{'$set': {field: {'$toObjectId': f'${field}'}}}]
+            )
+            converted[f"{collection_name}.{field}"] = result.modified_count
+    return converted
@@ -0,0 +1,13 @@
+from flask import Response, request
+
+def prefers_minimal():
+    prefer = request.headers.get('Prefer', '')
+    return any(token.strip().lower() == 'return=minimal' for token in prefer.split(','))
+
+def minimal_response(status, location=None):
+    # RFC 7240: the client asked us to skip echoing the written document
+    response = Response(status=204 if status == 200 else status)
+    response.headers['Preference-Applied'] = 'return=minimal'
+    if location:
+        response.headers['Location'] = location
+    return response
@@ -0,0 +1,49 @@
+from flask import Blueprint, request, jsonify
+import index_advisor
+import metrics
+from coalesce import read_coalescer
+
+admin_bp = Blueprint('admin', __name__)
+
+@admin_bp.route('/index-advisor', methods=['GET'])
+def index_advisor_report():
+    try:
+        include_catalog = request.args.get('catalog', 'false').lower() == 'true'
+        return jsonify(index_advisor.analyze(include_catalog=include_catalog)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/index-advisor/apply', methods=['POST'])
+def index_advisor_apply():
+    try:
+        include_catalog = request.args.get('catalog', 'false').lower() == 'true'
+        report = index_advisor.analyze(include_catalog=include_catalog)
+        return jsonify({"created": index_advisor.apply_recommendations(report)}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/index-advisor', methods=['DELETE'])
+def index_advisor_reset():
+    index_advisor.query_shapes.clear()
+    return jsonify({"message": "Recorded query shapes cleared"}), 200
+
+@admin_bp.route('/slow-queries', methods=['GET'])
+def slow_queries_report():
+    try:
+        explain = request.args.get('explain', 'true').lower() == 'true'
+        return jsonify({
+            "enabled": metrics.METRICS_ENABLED,
+            "thresholdMs": metrics.SLOW_QUERY_MS,
+            "queries": metrics.slow_queries.snapshot(explain=explain)
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/slow-queries', methods=['DELETE'])
+def slow_queries_reset():
+    metrics.slow_queries.clear()
+    return jsonify({"message": "Slow query log cleared"}), 200
+
+@admin_bp.route('/read-coalescing', methods=['GET'])
+def read_coalescing_stats():
+    return jsonify(read_coalescer.stats()), 200
@@ -1,17 +1,21 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
 from database import db_instance
+from responses import minimal_response, prefers_minimal
+from cache import aggregation_cache
+from coalesce import read_coalescer
+from streaming import stream_response
+import conditional
+import agent_counters
+from batch import delete_many, get_many, parse_ids, parse_updates, update_many
+from projection import build_projection, parse_fields
+from serialization import raw_documents
+from index_advisor import query_shapes
 
 agents_bp = Blueprint('agents', __name__)
 
-def serialize_agent(agent):
-    if agent:
-        agent['_id'] = str(agent['_id'])
-        if 'createdAt' in agent:
-            agent['createdAt'] = agent['createdAt'].isoformat()
-    return agent
-
 @agents_bp.route('/', methods=['GET'])
 def get_agents():
     try:
@@ -21,23 +25,91 @@ def get_agents():
         if specialization:
             query['specialization'] = specialization
 
-        agents = list(db_instance.agents.find(query))
+        query_shapes.record('agents', query)
+
+        etag, last_modified = conditional.collection_validators(['agents'])
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        stream = request.args.get('stream')
+        if stream:
+            response = stream_response(raw_documents(db_instance.agents).find(query), stream)
+            return conditional.with_validators(response, etag, last_modified)
+
+        agents = list(raw_documents(db_instance.agents).find(query))
+
+        return conditional.with_validators(jsonify(agents), etag, last_modified), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@agents_bp.route('/batch-get', methods=['POST'])
+def batch_get_agents():
+    try:
+        ids = parse_ids(request.get_json(silent=True))
+        projection = build_projection(parse_fields(request.args.get('fields')))
+
+        agents, missing = get_many(raw_documents(db_instance.agents), ids, projection)
+
+        return jsonify({"data": agents, "missing": missing}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@agents_bp.route('/batch-update', methods=['POST'])
+def batch_update_agents():
+    try:
+        updates = parse_updates(request.get_json(silent=True))
+        for fields in updates.values():
+            for field in agent_counters.COUNTER_FIELDS:
+                fields.pop(field, None)
+
+        updated, summary = update_many(db_instance.agents, updates)
+
+        if updated:
+            conditional.touch('agents')
+            aggregation_cache.invalidate('agents')
+            read_coalescer.invalidate('agents')
+
+        return jsonify(summary), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@agents_bp.route('/batch-delete', methods=['POST'])
+def batch_delete_agents():
+    try:
+        ids = parse_ids(request.get_json(silent=True))
+
+        deleted, summary = delete_many(db_instance.agents, ids)
 
-        for agent in agents:
-            serialize_agent(agent)
+        if deleted:
+            conditional.touch('agents')
+            aggregation_cache.invalidate('agents')
+            read_coalescer.invalidate('agents')
 
-        return jsonify(agents), 200
+        return jsonify(summary), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @agents_bp.route('/<agent_id>', methods=['GET'])
 def get_agent(agent_id):
     try:
+        not_modified = conditional.check_document(db_instance.agents, {"_id": ObjectId(agent_id)})
+        if not_modified:
+            return not_modified
+
         agent = db_instance.agents.find_one({"_id": ObjectId(agent_id)})
         if not agent:
             return jsonify({"error": "Agent not found"}), 404
 
-        return jsonify(serialize_agent(agent)), 200
+        etag, last_modified = conditional.document_validators(agent)
+        return conditional.with_validators(jsonify(agent), etag, last_modified), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -46,13 +118,19 @@ def create_agent():
     try:
         data = request.json
         data['createdAt'] = datetime.utcnow()
-        data['activeListings'] = data.get('activeListings', 0)
+        data.update(conditional.new_version_fields(data['createdAt']))
+        # Maintained from listing and inquiry writes only
+        data.update(agent_counters.zero_counters())
 
         result = db_instance.agents.insert_one(data)
+        conditional.touch('agents')
+        aggregation_cache.invalidate('agents')
+        read_coalescer.invalidate('agents')
 
-        new_agent = db_instance.agents.find_one({"_id": result.inserted_id})
+        if prefers_minimal():
+            return minimal_response(201, f"{request.base_url.rstrip('/')}/{result.inserted_id}")
 
-        return jsonify(serialize_agent(new_agent)), 201
+        return jsonify(data), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -62,18 +140,29 @@ def update_agent(agent_id):
         data = request.json
         data.pop('_id', None)
         data.pop('createdAt', None)
+        data.pop('revision', None)
+        for field in agent_counters.COUNTER_FIELDS:
+            data.pop(field, None)
+        data['updatedAt'] = datetime.utcnow()
 
-        result = db_instance.agents.update_one(
+        updated_agent = db_instance.agents.find_one_and_update(
             {"_id": ObjectId(agent_id)},
-            {"$set": data}
+            {"$set": data, "$inc": {"revision": 1}},
+            return_document=ReturnDocument.AFTER
         )
 
-        if result.matched_count == 0:
+        if updated_agent is None:
             return jsonify({"error": "Agent not found"}), 404
 
-        updated_agent = db_instance.agents.find_one({"_id": ObjectId(agent_id)})
+        conditional.touch('agents')
 
-        return jsonify(serialize_agent(updated_agent)), 200
+        aggregation_cache.invalidate('agents')
+        read_coalescer.invalidate('agents')
+
+        if prefers_minimal():
+            return minimal_response(200)
+
+        return jsonify(updated_agent), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -85,6 +174,11 @@ def delete_agent(agent_id):
         if result.deleted_count == 0:
             return jsonify({"error": "Agent not found"}), 404
 
+        conditional.touch('agents')
+
+        aggregation_cache.invalidate('agents')
+        read_coalescer.invalidate('agents')
+
         return jsonify({"message": "Agent deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
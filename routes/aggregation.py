@@ -1,164 +1,217 @@
-from flask import Blueprint, jsonify
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, jsonify, request
 from database import db_instance
+from cache import aggregation_cache
+import property_stats
+import approx_stats
+import trends
+from pagination import parse_limit
+import metrics
 
 aggregation_bp = Blueprint('aggregation', __name__)
 
+# pymongo releases the GIL while waiting on the server, so independent
+# pipelines run concurrently on separate pooled connections.
+fanout_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('AGGREGATION_FANOUT_WORKERS', '4')),
+    thread_name_prefix='aggregation'
+)
+
+# Overview section -> (cache key, tags). The single-section routes share the
+# same cache entries, and so does the async server (asgi.py).
+SECTIONS = {
+    'averagePriceByCity': ('average-price-by-city', ('properties',)),
+    'mostActiveAgents': ('most-active-agents', ('agents',)),
+    'propertiesByType': ('properties-by-type', ('properties',)),
+    'inquiryStatistics': ('inquiry-statistics', ('inquiries',)),
+    'priceRangeDistribution': ('price-range-distribution', ('properties',))
+}
+
+# activeListings is maintained on the agents themselves, so the leaderboard is
+# a top-k walk of the (activeListings, _id) index.
+LEADERBOARD_PROJECTION = {
+    "name": 1,
+    "email": 1,
+    "specialization": 1,
+    "activeListings": 1,
+    "listedValue": 1,
+    "openInquiries": 1,
+    "phone": 1
+}
+LEADERBOARD_SORT = [("activeListings", -1), ("_id", 1)]
+LEADERBOARD_SIZE = 10
+
+INQUIRY_STATISTICS_PIPELINE = [
+    {
+        "$group": {
+            "_id": "$status",
+            "count": {"$sum": 1}
+        }
+    },
+    {
+        "$project": {
+            "_id": 0,
+            "status": "$_id",
+            "count": 1
+        }
+    }
+]
+
+def load_section(name, compute):
+    key, tags = SECTIONS[name]
+    return aggregation_cache.get_or_compute(key, compute, tags=tags)
+
+def load_average_price_by_city():
+    return load_section('averagePriceByCity', property_stats.average_price_by_city)
+
+def load_most_active_agents():
+    return load_section(
+        'mostActiveAgents',
+        lambda: list(
+            db_instance.agents.find({}, LEADERBOARD_PROJECTION).sort(LEADERBOARD_SORT).limit(LEADERBOARD_SIZE)
+        )
+    )
+
+def load_properties_by_type():
+    return load_section('propertiesByType', property_stats.properties_by_type)
+
+def load_inquiry_statistics():
+    return load_section('inquiryStatistics', lambda: list(db_instance.inquiries.aggregate(INQUIRY_STATISTICS_PIPELINE)))
+
+def load_price_range_distribution():
+    return load_section('priceRangeDistribution', property_stats.price_range_distribution)
+
+DISTRIBUTION_DIMENSIONS = ['city', 'propertyType']
+
+MAX_APPROX_SAMPLE_SIZE = 100000
+
+def wants_approx():
+    return request.args.get('approx', 'false').lower() == 'true'
+
+def approx_sample_size():
+    return parse_limit(
+        request.args.get('sampleSize'),
+        default=approx_stats.APPROX_SAMPLE_SIZE, maximum=MAX_APPROX_SAMPLE_SIZE, name='sampleSize'
+    )
+
+def load_approx(name, estimate, sample_size):
+    return aggregation_cache.get_or_compute(
+        f'{name}:approx:{sample_size}',
+        lambda: estimate(sample_size),
+        tags=('properties',)
+    )
+
+OVERVIEW_SECTIONS = {
+    'averagePriceByCity': load_average_price_by_city,
+    'mostActiveAgents': load_most_active_agents,
+    'propertiesByType': load_properties_by_type,
+    'inquiryStatistics': load_inquiry_statistics,
+    'priceRangeDistribution': load_price_range_distribution
+}
+
 @aggregation_bp.route('/average-price-by-city', methods=['GET'])
 def average_price_by_city():
     try:
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$city",
-                    "averagePrice": {"$avg": "$price"},
-                    "propertyCount": {"$sum": 1},
-                    "minPrice": {"$min": "$price"},
-                    "maxPrice": {"$max": "$price"}
-                }
-            },
-            {
-                "$sort": {"averagePrice": -1}
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "city": "$_id",
-                    "averagePrice": {"$round": ["$averagePrice", 2]},
-                    "propertyCount": 1,
-                    "minPrice": 1,
-                    "maxPrice": 1
-                }
-            }
-        ]
-
-        result = list(db_instance.properties.aggregate(pipeline))
-
-        return jsonify(result), 200
+        if wants_approx():
+            return jsonify(load_approx(
+                'average-price-by-city', approx_stats.average_price_by_city, approx_sample_size()
+            )), 200
+        return jsonify(load_average_price_by_city()), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @aggregation_bp.route('/most-active-agents', methods=['GET'])
 def most_active_agents():
     try:
-        pipeline = [
-            {
-                "$sort": {"activeListings": -1}
-            },
-            {
-                "$limit": 10
-            },
-            {
-                "$project": {
-                    "_id": {"$toString": "$_id"},
-                    "name": 1,
-                    "email": 1,
-                    "specialization": 1,
-                    "activeListings": 1,
-                    "phone": 1
-                }
-            }
-        ]
-
-        result = list(db_instance.agents.aggregate(pipeline))
-
-        return jsonify(result), 200
+        return jsonify(load_most_active_agents()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @aggregation_bp.route('/properties-by-type', methods=['GET'])
 def properties_by_type():
     try:
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$propertyType",
-                    "count": {"$sum": 1},
-                    "averagePrice": {"$avg": "$price"},
-                    "totalValue": {"$sum": "$price"}
-                }
-            },
-            {
-                "$sort": {"count": -1}
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "propertyType": "$_id",
-                    "count": 1,
-                    "averagePrice": {"$round": ["$averagePrice", 2]},
-                    "totalValue": 1
-                }
-            }
-        ]
-
-        result = list(db_instance.properties.aggregate(pipeline))
-
-        return jsonify(result), 200
+        if wants_approx():
+            return jsonify(load_approx(
+                'properties-by-type', approx_stats.properties_by_type, approx_sample_size()
+            )), 200
+        return jsonify(load_properties_by_type()), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @aggregation_bp.route('/inquiry-statistics', methods=['GET'])
 def inquiry_statistics():
     try:
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$status",
-                    "count": {"$sum": 1}
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "status": "$_id",
-                    "count": 1
-                }
-            }
-        ]
-
-        result = list(db_instance.inquiries.aggregate(pipeline))
-
-        return jsonify(result), 200
+        return jsonify(load_inquiry_statistics()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @aggregation_bp.route('/price-range-distribution', methods=['GET'])
 def price_range_distribution():
     try:
-        pipeline = [
-            {
-                "$bucket": {
-                    "groupBy": "$price",
-                    "boundaries": [0, 300000, 500000, 700000, 1000000, 10000000],
-                    "default": "Other",
-                    "output": {
-                        "count": {"$sum": 1},
-                        "properties": {"$push": "$title"}
-                    }
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "priceRange": {
-                        "$switch": {
-                            "branches": [
-                                {"case": {"$eq": ["$_id", 0]}, "then": "$0 - $300,000"},
-                                {"case": {"$eq": ["$_id", 300000]}, "then": "$300,000 - $500,000"},
-                                {"case": {"$eq": ["$_id", 500000]}, "then": "$500,000 - $700,000"},
-                                {"case": {"$eq": ["$_id", 700000]}, "then": "$700,000 - $1,000,000"},
-                                {"case": {"$eq": ["$_id", 1000000]}, "then": "$1,000,000+"}
-                            ],
-                            "default": "Other"
-                        }
-                    },
-                    "count": 1
-                }
-            }
-        ]
-
-        result = list(db_instance.properties.aggregate(pipeline))
-
-        return jsonify(result), 200
+        return jsonify(load_price_range_distribution()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@aggregation_bp.route('/distribution', methods=['GET'])
+def distribution():
+    try:
+        dimension = request.args.get('by', 'city')
+        if dimension not in DISTRIBUTION_DIMENSIONS:
+            raise ValueError("by must be one of: " + ", ".join(DISTRIBUTION_DIMENSIONS))
+        return jsonify(aggregation_cache.get_or_compute(
+            f'distribution:{dimension}',
+            lambda: property_stats.distribution_summary(dimension),
+            tags=('properties',)
+        )), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@aggregation_bp.route('/trends/<source>', methods=['GET'])
+def trend(source):
+    try:
+        if source not in trends.TREND_DIMENSIONS:
+            raise ValueError("source must be one of: " + ", ".join(trends.TREND_DIMENSIONS))
+        interval = request.args.get('interval', 'month')
+        if interval not in trends.INTERVALS:
+            raise ValueError("interval must be one of: " + ", ".join(trends.INTERVALS))
+        dimension = request.args.get('by', 'all')
+        if dimension not in trends.TREND_DIMENSIONS[source]:
+            raise ValueError("by must be one of: " + ", ".join(trends.TREND_DIMENSIONS[source]))
+        key = request.args.get('key')
+        start = trends.parse_date(request.args.get('from'), 'from')
+        end = trends.parse_date(request.args.get('to'), 'to')
+        limit = parse_limit(request.args.get('limit'), default=10, name='limit')
+
+        data = aggregation_cache.get_or_compute(
+            f'trend:{source}:{interval}:{dimension}:{key}:{start}:{end}:{limit}',
+            lambda: trends.series(source, interval, dimension, key, start, end, limit),
+            tags=(source,)
+        )
+        return jsonify({"source": source, "interval": interval, "by": dimension, "data": data}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@aggregation_bp.route('/overview', methods=['GET'])
+def overview():
+    try:
+        # The sections' Mongo time still counts towards this request
+        futures = {
+            name: fanout_executor.submit(metrics.in_current_request(load))
+            for name, load in OVERVIEW_SECTIONS.items()
+        }
+        return jsonify({name: future.result() for name, future in futures.items()}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@aggregation_bp.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(aggregation_cache.stats()), 200
@@ -1,16 +1,23 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
 from database import db_instance
+from responses import minimal_response, prefers_minimal
+from cache import aggregation_cache
+from streaming import stream_response
+import conditional
+from index_advisor import query_shapes
+import trends
+import agent_counters
+from expansion import expand, parse_expand, related_collections
+import change_streams
+from references import normalize_references, reference_filter
+from serialization import raw_documents
 
 inquiries_bp = Blueprint('inquiries', __name__)
 
-def serialize_inquiry(inquiry):
-    if inquiry:
-        inquiry['_id'] = str(inquiry['_id'])
-        if 'createdAt' in inquiry:
-            inquiry['createdAt'] = inquiry['createdAt'].isoformat()
-    return inquiry
+INQUIRY_RELATIONS = ['property', 'user', 'agent']
 
 @inquiries_bp.route('/', methods=['GET'])
 def get_inquiries():
@@ -22,46 +29,91 @@ def get_inquiries():
 
         query = {}
         if property_id:
-            query['propertyId'] = property_id
+            query['propertyId'] = reference_filter(property_id)
         if user_id:
-            query['userId'] = user_id
+            query['userId'] = reference_filter(user_id)
         if agent_id:
-            query['agentId'] = agent_id
+            query['agentId'] = reference_filter(agent_id)
         if status:
             query['status'] = status
 
-        inquiries = list(db_instance.inquiries.find(query))
+        sort = [('createdAt', -1)]
+        query_shapes.record('inquiries', query, sort)
 
-        for inquiry in inquiries:
-            serialize_inquiry(inquiry)
+        relations = parse_expand(request.args.get('expand'), INQUIRY_RELATIONS)
 
-        return jsonify(inquiries), 200
+        etag, last_modified = conditional.collection_validators(['inquiries'] + related_collections(relations))
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        stream = request.args.get('stream')
+        if stream:
+            if relations:
+                raise ValueError("expand cannot be combined with stream")
+            response = stream_response(raw_documents(db_instance.inquiries).find(query).sort(sort), stream)
+            return conditional.with_validators(response, etag, last_modified)
+
+        collection = db_instance.inquiries if relations else raw_documents(db_instance.inquiries)
+        inquiries = list(collection.find(query).sort(sort))
+
+        expand(inquiries, relations)
+
+        return conditional.with_validators(jsonify(inquiries), etag, last_modified), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Shared with the async server (asgi.py)
+CHANGE_FILTERS = ['agentId', 'userId', 'propertyId']
+CHANGE_REFERENCE_FILTERS = ('agentId', 'userId', 'propertyId')
+
+@inquiries_bp.route('/changes', methods=['GET'])
+def inquiry_changes():
+    try:
+        filters = change_streams.parse_filters(request.args, CHANGE_FILTERS, reference_fields=CHANGE_REFERENCE_FILTERS)
+        return change_streams.sse_response(db_instance.inquiries, 'inquiries', filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except change_streams.ResumeTokenExpired as e:
+        return jsonify({"error": str(e)}), 410
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+
 @inquiries_bp.route('/<inquiry_id>', methods=['GET'])
 def get_inquiry(inquiry_id):
     try:
+        not_modified = conditional.check_document(db_instance.inquiries, {"_id": ObjectId(inquiry_id)})
+        if not_modified:
+            return not_modified
+
         inquiry = db_instance.inquiries.find_one({"_id": ObjectId(inquiry_id)})
         if not inquiry:
             return jsonify({"error": "Inquiry not found"}), 404
 
-        return jsonify(serialize_inquiry(inquiry)), 200
+        etag, last_modified = conditional.document_validators(inquiry)
+        return conditional.with_validators(jsonify(inquiry), etag, last_modified), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @inquiries_bp.route('/', methods=['POST'])
 def create_inquiry():
     try:
-        data = request.json
+        data = normalize_references(request.json, 'inquiries')
         data['createdAt'] = datetime.utcnow()
+        data.update(conditional.new_version_fields(data['createdAt']))
         data['status'] = data.get('status', 'Pending')
 
         result = db_instance.inquiries.insert_one(data)
+        trends.record_insert('inquiries', data)
+        touched = agent_counters.record_insert('inquiries', data)
+        conditional.touch('inquiries', *touched)
+        aggregation_cache.invalidate('inquiries')
 
-        new_inquiry = db_instance.inquiries.find_one({"_id": result.inserted_id})
+        if prefers_minimal():
+            return minimal_response(201, f"{request.base_url.rstrip('/')}/{result.inserted_id}")
 
-        return jsonify(serialize_inquiry(new_inquiry)), 201
+        return jsonify(data), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -71,29 +123,46 @@ def update_inquiry(inquiry_id):
         data = request.json
         data.pop('_id', None)
         data.pop('createdAt', None)
+        data.pop('revision', None)
+        data['updatedAt'] = datetime.utcnow()
+        normalize_references(data, 'inquiries')
 
-        result = db_instance.inquiries.update_one(
+        previous = db_instance.inquiries.find_one_and_update(
             {"_id": ObjectId(inquiry_id)},
-            {"$set": data}
+            {"$set": data, "$inc": {"revision": 1}},
+            return_document=ReturnDocument.BEFORE
         )
 
-        if result.matched_count == 0:
+        if previous is None:
             return jsonify({"error": "Inquiry not found"}), 404
 
-        updated_inquiry = db_instance.inquiries.find_one({"_id": ObjectId(inquiry_id)})
+        # Rebuilt locally from the pre-image, which the trend deltas need
+        updated_inquiry = {**previous, **data, 'revision': previous.get('revision', 0) + 1}
+        trends.record_update('inquiries', previous, updated_inquiry)
+        touched = agent_counters.record_update('inquiries', previous, updated_inquiry)
+        conditional.touch('inquiries', *touched)
+        aggregation_cache.invalidate('inquiries')
+
+        if prefers_minimal():
+            return minimal_response(200)
 
-        return jsonify(serialize_inquiry(updated_inquiry)), 200
+        return jsonify(updated_inquiry), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @inquiries_bp.route('/<inquiry_id>', methods=['DELETE'])
 def delete_inquiry(inquiry_id):
     try:
-        result = db_instance.inquiries.delete_one({"_id": ObjectId(inquiry_id)})
+        deleted = db_instance.inquiries.find_one_and_delete({"_id": ObjectId(inquiry_id)})
 
-        if result.deleted_count == 0:
+        if deleted is None:
             return jsonify({"error": "Inquiry not found"}), 404
 
+        trends.record_delete('inquiries', deleted)
+        touched = agent_counters.record_delete('inquiries', deleted)
+        conditional.touch('inquiries', *touched)
+        aggregation_cache.invalidate('inquiries')
+
         return jsonify({"message": "Inquiry deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
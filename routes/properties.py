@@ -1,73 +1,526 @@
+import os
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 from database import db_instance
+from cache import aggregation_cache
+from pagination import paginate, parse_limit
+from projection import build_projection, parse_fields
+from streaming import iter_ndjson_batches, stream_response
+from responses import minimal_response, prefers_minimal
+import property_stats
+import trends
+import agent_counters
+import geo
+import change_streams
+import conditional
+from batch import delete_many, get_many, parse_ids, parse_updates, update_many
+from index_advisor import query_shapes
+from expansion import expand, parse_expand, reference_fields, related_collections
+from references import normalize_references
+from serialization import raw_documents
+from coalesce import encoded, json_response, query_key, read_coalescer
 
 properties_bp = Blueprint('properties', __name__)
 
-def serialize_property(prop):
-    if prop:
-        prop['_id'] = str(prop['_id'])
-        if 'createdAt' in prop:
-            prop['createdAt'] = prop['createdAt'].isoformat()
-    return prop
+SUMMARY_FIELDS = ['title', 'price', 'propertyType', 'bedrooms', 'bathrooms', 'size', 'city', 'status', 'location']
+
+PROPERTY_VIEWS = {
+    'summary': SUMMARY_FIELDS,
+    'full': None
+}
+
+BULK_BATCH_SIZE = 1000
+MAX_BULK_BATCH_SIZE = 10000
+
+MAX_SEARCH_SKIP = 1000
+
+SEARCH_FACET_LIMIT = int(os.getenv('SEARCH_FACET_LIMIT', '10000'))
+
+PROPERTY_RELATIONS = ['agent']
+
+def build_property_query(args):
+    city = args.get('city')
+    property_type = args.get('propertyType')
+    min_price = args.get('minPrice', type=int)
+    max_price = args.get('maxPrice', type=int)
+
+    query = {}
+    if city:
+        query['city'] = city
+    if property_type:
+        query['propertyType'] = property_type
+    if min_price is not None or max_price is not None:
+        query['price'] = {}
+        if min_price is not None:
+            query['price']['$gte'] = min_price
+        if max_price is not None:
+            query['price']['$lte'] = max_price
+    within = args.get('within')
+    if within:
+        query['location'] = geo.within_box(geo.parse_box(within))
+    return query
+
+def list_arguments(args):
+    # Shared with the async server (asgi.py)
+    sort_by = args.get('sortBy', 'createdAt')
+    sort_order = -1 if args.get('order', 'desc') == 'desc' else 1
+    query = build_property_query(args)
+
+    fields = parse_fields(args.get('fields'))
+    if fields is None:
+        view = args.get('view', 'summary')
+        if view not in PROPERTY_VIEWS:
+            raise ValueError("view must be one of: " + ", ".join(PROPERTY_VIEWS))
+        fields = PROPERTY_VIEWS[view]
+    relations = parse_expand(args.get('expand'), PROPERTY_RELATIONS)
+    projection = build_projection(fields, required=[sort_by] + reference_fields(relations))
+    return query, sort_by, sort_order, projection, relations
 
 @properties_bp.route('/', methods=['GET'])
 def get_properties():
     try:
-        sort_by = request.args.get('sortBy', 'createdAt')
-        order = request.args.get('order', 'desc')
-        city = request.args.get('city')
-        property_type = request.args.get('propertyType')
-        min_price = request.args.get('minPrice', type=int)
-        max_price = request.args.get('maxPrice', type=int)
-
-        query = {}
-        if city:
-            query['city'] = city
-        if property_type:
-            query['propertyType'] = property_type
-        if min_price is not None or max_price is not None:
-            query['price'] = {}
-            if min_price is not None:
-                query['price']['$gte'] = min_price
-            if max_price is not None:
-                query['price']['$lte'] = max_price
-
-        sort_order = -1 if order == 'desc' else 1
-
-        properties = list(db_instance.properties.find(query).sort(sort_by, sort_order))
-
-        for prop in properties:
-            serialize_property(prop)
-
-        return jsonify(properties), 200
+        query, sort_by, sort_order, projection, relations = list_arguments(request.args)
+
+        validated = ['properties'] + related_collections(relations)
+        etag, last_modified = read_coalescer.run(
+            ('collection_versions', tuple(validated)),
+            lambda: conditional.collection_validators(validated),
+            tags=validated
+        )
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        limit = request.args.get('limit')
+        cursor = request.args.get('cursor')
+        stream = request.args.get('stream')
+
+        near = request.args.get('near')
+        if stream and (limit is not None or cursor is not None or near):
+            raise ValueError("stream cannot be combined with limit, cursor or near")
+        if near:
+            properties, next_cursor = geo.paginate_near(
+                db_instance.properties, query, geo.parse_point(near),
+                parse_limit(limit), cursor,
+                max_distance=request.args.get('maxDistance', type=float),
+                projection=projection
+            )
+
+            expand(properties, relations)
+
+            response = jsonify({"data": properties, "nextCursor": next_cursor})
+            return conditional.with_validators(response, etag, last_modified), 200
+
+        if limit is None and cursor is None:
+            query_shapes.record('properties', query, [(sort_by, sort_order)])
+
+            if stream:
+                if relations:
+                    raise ValueError("expand cannot be combined with stream")
+                response = stream_response(
+                    raw_documents(db_instance.properties).find(query, projection).sort(sort_by, sort_order),
+                    stream
+                )
+                return conditional.with_validators(response, etag, last_modified)
+
+            def load_all():
+                collection = db_instance.properties if relations else raw_documents(db_instance.properties)
+                properties = list(collection.find(query, projection).sort(sort_by, sort_order))
+                expand(properties, relations)
+                return encoded(properties)
+
+            body = read_coalescer.run(
+                query_key('properties', query, [(sort_by, sort_order)], projection, relations),
+                load_all, tags=validated
+            )
+            return conditional.with_validators(json_response(body), etag, last_modified), 200
+
+        query_shapes.record('properties', query, [(sort_by, sort_order), ('_id', sort_order)])
+        page_size = parse_limit(limit)
+
+        def load_page():
+            properties, next_cursor = paginate(
+                db_instance.properties, query, sort_by, sort_order,
+                page_size, cursor, projection
+            )
+            expand(properties, relations)
+            return encoded({"data": properties, "nextCursor": next_cursor})
+
+        body = read_coalescer.run(
+            query_key('properties', query, [(sort_by, sort_order), ('_id', sort_order)], projection,
+                      relations, page_size, cursor),
+            load_page, tags=validated
+        )
+        return conditional.with_validators(json_response(body), etag, last_modified), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def write_property_batch(records):
+    now = datetime.utcnow()
+
+    # Repeated externalIds within a batch are folded into one upsert so the
+    # unordered writes can't race each other on the unique index.
+    upserts = {}
+    inserts = []
+    errors = []
+    for line_number, doc in records:
+        doc.pop('_id', None)
+        doc.pop('createdAt', None)
+        doc.pop('revision', None)
+        doc['updatedAt'] = now
+        normalize_references(doc, 'properties')
+        try:
+            geo.normalize_location(doc)
+        except ValueError as e:
+            errors.append({"line": line_number, "error": str(e)})
+            continue
+        external_id = doc.get('externalId')
+        if external_id is None:
+            inserts.append(([line_number], doc))
+        elif external_id in upserts:
+            lines, merged = upserts[external_id]
+            lines.append(line_number)
+            merged.update(doc)
+        else:
+            upserts[external_id] = ([line_number], doc)
+
+    existing = {}
+    if upserts:
+        for prop in db_instance.properties.find({"externalId": {"$in": list(upserts)}}):
+            existing[prop['externalId']] = prop
+
+    ops = []
+    lines_by_op = []
+    changes = []
+    for lines, doc in inserts:
+        doc['createdAt'] = now
+        doc['status'] = doc.get('status', 'Available')
+        doc['revision'] = 1
+        ops.append(InsertOne(doc))
+        lines_by_op.append(lines)
+        changes.append((None, doc))
+    for external_id, (lines, doc) in upserts.items():
+        on_insert = {'createdAt': now}
+        if 'status' not in doc:
+            on_insert['status'] = 'Available'
+        ops.append(UpdateOne(
+            {"externalId": external_id},
+            {"$set": doc, "$setOnInsert": on_insert, "$inc": {"revision": 1}},
+            upsert=True
+        ))
+        lines_by_op.append(lines)
+        previous = existing.get(external_id)
+        changes.append((previous, {**previous, **doc} if previous else {**on_insert, **doc}))
+
+    report = {"inserted": 0, "upserted": 0, "matched": 0, "modified": 0, "errors": errors}
+    if not ops:
+        return report, ()
+
+    try:
+        result = db_instance.properties.bulk_write(ops, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+
+    failed = set()
+    for error in result.get('writeErrors', []):
+        failed.add(error['index'])
+        for line_number in lines_by_op[error['index']]:
+            report['errors'].append({"line": line_number, "error": error.get('errmsg', 'Write failed')})
+
+    applied = [change for index, change in enumerate(changes) if index not in failed]
+    property_stats.record_many(applied)
+    trends.record_many('properties', applied)
+    touched = agent_counters.record_many('properties', applied)
+
+    report['inserted'] = result.get('nInserted', 0)
+    report['upserted'] = result.get('nUpserted', 0)
+    report['matched'] = result.get('nMatched', 0)
+    report['modified'] = result.get('nModified', 0)
+    return report, touched
+
+@properties_bp.route('/bulk', methods=['POST'])
+def bulk_import_properties():
+    try:
+        batch_size = parse_limit(
+            request.args.get('batchSize'),
+            default=BULK_BATCH_SIZE, maximum=MAX_BULK_BATCH_SIZE, name='batchSize'
+        )
+
+        summary = {"received": 0, "inserted": 0, "upserted": 0, "matched": 0, "modified": 0, "failed": 0}
+        batches = []
+        touched = set()
+        for number, (records, parse_errors) in enumerate(iter_ndjson_batches(request.stream, batch_size), 1):
+            batch, agents_touched = write_property_batch(records)
+            touched.update(agents_touched)
+            batch['errors'] = [{"line": line, "error": error} for line, error in parse_errors] + batch['errors']
+            batch['batch'] = number
+            batch['size'] = len(records) + len(parse_errors)
+            batches.append(batch)
+
+            summary['received'] += batch['size']
+            summary['failed'] += len(batch['errors'])
+            for key in ('inserted', 'upserted', 'matched', 'modified'):
+                summary[key] += batch[key]
+
+        if summary['received']:
+            aggregation_cache.invalidate('properties')
+            read_coalescer.invalidate('properties')
+            conditional.touch('properties', *touched)
+
+        return jsonify({**summary, "batches": batches}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@properties_bp.route('/export', methods=['GET'])
+def export_properties():
+    try:
+        etag, last_modified = conditional.collection_validators(['properties'])
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        response = stream_response(raw_documents(db_instance.properties).find().sort('_id', 1), 'ndjson')
+        return conditional.with_validators(response, etag, last_modified)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def facet_counts(field):
+    return [
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$project": {"_id": 0, "value": "$_id", "count": 1}}
+    ]
+
+def search_facets(query):
+    # Counted over at most SEARCH_FACET_LIMIT matches, so a broad filter costs
+    # a bounded scan; past that, total and facets are lower bounds (capped).
+    capped = [{"$limit": SEARCH_FACET_LIMIT}]
+    pipeline = [
+        {"$match": query},
+        {"$limit": SEARCH_FACET_LIMIT + 1},
+        {"$project": {"_id": 0, "city": 1, "propertyType": 1, "bedrooms": 1, "price": 1}},
+        {
+            "$facet": {
+                "total": [{"$count": "count"}],
+                "city": capped + facet_counts('city'),
+                "propertyType": capped + facet_counts('propertyType'),
+                "bedrooms": capped + facet_counts('bedrooms'),
+                "priceRange": capped + [
+                    {
+                        "$bucket": {
+                            "groupBy": "$price",
+                            "boundaries": property_stats.PRICE_BOUNDARIES,
+                            "default": "Other",
+                            "output": {"count": {"$sum": 1}}
+                        }
+                    }
+                ]
+            }
+        }
+    ]
+    result = next(db_instance.properties.aggregate(pipeline))
+    total = result['total'][0]['count'] if result['total'] else 0
+    facets = {
+        "city": result['city'],
+        "propertyType": result['propertyType'],
+        "bedrooms": result['bedrooms'],
+        "priceRange": [
+            {"value": property_stats.PRICE_RANGE_LABELS.get(bucket['_id'], "Other"), "count": bucket['count']}
+            for bucket in result['priceRange']
+        ]
+    }
+    return min(total, SEARCH_FACET_LIMIT), total > SEARCH_FACET_LIMIT, facets
+
+@properties_bp.route('/search', methods=['GET'])
+def search_properties():
+    try:
+        text = request.args.get('q', '').strip()
+        limit = parse_limit(request.args.get('limit'))
+        skip = request.args.get('skip', 0, type=int)
+        if skip < 0 or skip > MAX_SEARCH_SKIP:
+            raise ValueError(f"skip must be between 0 and {MAX_SEARCH_SKIP}")
+
+        query = build_property_query(request.args)
+        if text:
+            query['$text'] = {'$search': text}
+
+        etag, last_modified = conditional.collection_validators(['properties'])
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        projection = {field: 1 for field in SUMMARY_FIELDS}
+        if text:
+            projection['score'] = {'$meta': 'textScore'}
+            sort = [('score', {'$meta': 'textScore'}), ('_id', 1)]
+        else:
+            projection['createdAt'] = 1
+            sort = [('createdAt', -1), ('_id', -1)]
+
+        # The page is its own query: without q it walks the (createdAt, _id)
+        # index and stops after skip + limit documents. Relevance order has
+        # no index, so with q the text matches are ranked in memory.
+        data = list(
+            raw_documents(db_instance.properties).find(query, projection).sort(sort).skip(skip).limit(limit)
+        )
+
+        if query:
+            total, capped, facets = search_facets(query)
+        else:
+            # Every listing matches, so the maintained counts answer it
+            facets = property_stats.facet_summary()
+            total = sum(row['count'] for row in facets['city'])
+            capped = False
+
+        response = jsonify({"data": data, "total": total, "capped": capped, "facets": facets})
+        return conditional.with_validators(response, etag, last_modified), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@properties_bp.route('/batch-get', methods=['POST'])
+def batch_get_properties():
+    try:
+        ids = parse_ids(request.get_json(silent=True))
+        relations = parse_expand(request.args.get('expand'), PROPERTY_RELATIONS)
+        projection = build_projection(parse_fields(request.args.get('fields')), required=reference_fields(relations))
+
+        collection = db_instance.properties if relations else raw_documents(db_instance.properties)
+        properties, missing = get_many(collection, ids, projection)
+
+        expand(properties, relations)
+
+        return jsonify({"data": properties, "missing": missing}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@properties_bp.route('/batch-update', methods=['POST'])
+def batch_update_properties():
+    try:
+        updates = parse_updates(request.get_json(silent=True))
+        for fields in updates.values():
+            normalize_references(fields, 'properties')
+            geo.normalize_location(fields)
+
+        # Whole pre-images, for the stats and trend deltas
+        previous, summary = update_many(db_instance.properties, updates, projection=None)
+
+        if previous:
+            changes = [
+                (doc, {**doc, **updates[str(doc['_id'])], 'revision': doc.get('revision', 0) + 1})
+                for doc in previous
+            ]
+            property_stats.record_many(changes)
+            trends.record_many('properties', changes)
+            touched = agent_counters.record_many('properties', changes)
+            aggregation_cache.invalidate('properties')
+            read_coalescer.invalidate('properties')
+            conditional.touch('properties', *touched)
+
+        return jsonify(summary), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@properties_bp.route('/batch-delete', methods=['POST'])
+def batch_delete_properties():
+    try:
+        ids = parse_ids(request.get_json(silent=True))
+
+        previous, summary = delete_many(db_instance.properties, ids, projection=None)
+
+        if previous:
+            changes = [(doc, None) for doc in previous]
+            property_stats.record_many(changes)
+            trends.record_many('properties', changes)
+            touched = agent_counters.record_many('properties', changes)
+            aggregation_cache.invalidate('properties')
+            read_coalescer.invalidate('properties')
+            conditional.touch('properties', *touched)
+
+        return jsonify(summary), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Shared with the async server (asgi.py)
+CHANGE_FILTERS = ['city', 'agentId']
+CHANGE_REFERENCE_FILTERS = ('agentId',)
+
+@properties_bp.route('/changes', methods=['GET'])
+def property_changes():
+    try:
+        filters = change_streams.parse_filters(request.args, CHANGE_FILTERS, reference_fields=CHANGE_REFERENCE_FILTERS)
+        return change_streams.sse_response(db_instance.properties, 'properties', filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except change_streams.ResumeTokenExpired as e:
+        return jsonify({"error": str(e)}), 410
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+
 @properties_bp.route('/<property_id>', methods=['GET'])
 def get_property(property_id):
     try:
-        prop = db_instance.properties.find_one({"_id": ObjectId(property_id)})
-        if not prop:
+        relations = parse_expand(request.args.get('expand'), PROPERTY_RELATIONS)
+
+        related = related_collections(relations)
+        query = {"_id": ObjectId(property_id)}
+        # A conditional request is answered from the version fields first, as
+        # everywhere else; only reads that need the document are coalesced.
+        not_modified = conditional.check_document(db_instance.properties, query, related)
+        if not_modified:
+            return not_modified
+
+        def load():
+            prop = db_instance.properties.find_one(query)
+            if not prop:
+                return None
+            expand([prop], relations)
+            etag, last_modified = conditional.document_validators(prop, related)
+            return encoded(prop), etag, last_modified
+
+        loaded = read_coalescer.run(query_key('properties', query, None, None, relations), load,
+                                    tags=['properties'] + related)
+        if loaded is None:
             return jsonify({"error": "Property not found"}), 404
 
-        return jsonify(serialize_property(prop)), 200
+        body, etag, last_modified = loaded
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+        return conditional.with_validators(json_response(body), etag, last_modified), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @properties_bp.route('/', methods=['POST'])
 def create_property():
     try:
-        data = request.json
+        data = geo.normalize_location(normalize_references(request.json, 'properties'))
         data['createdAt'] = datetime.utcnow()
         data['status'] = data.get('status', 'Available')
+        data.update(conditional.new_version_fields(data['createdAt']))
 
         result = db_instance.properties.insert_one(data)
+        property_stats.record_insert(data)
+        trends.record_insert('properties', data)
+        touched = agent_counters.record_insert('properties', data)
+        aggregation_cache.invalidate('properties')
+        read_coalescer.invalidate('properties')
+        conditional.touch('properties', *touched)
 
-        new_property = db_instance.properties.find_one({"_id": result.inserted_id})
+        if prefers_minimal():
+            return minimal_response(201, f"{request.base_url.rstrip('/')}/{result.inserted_id}")
 
-        return jsonify(serialize_property(new_property)), 201
+        return jsonify(data), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -77,29 +530,52 @@ def update_property(property_id):
         data = request.json
         data.pop('_id', None)
         data.pop('createdAt', None)
+        data.pop('revision', None)
+        data['updatedAt'] = datetime.utcnow()
+        normalize_references(data, 'properties')
+        geo.normalize_location(data)
 
-        result = db_instance.properties.update_one(
+        previous = db_instance.properties.find_one_and_update(
             {"_id": ObjectId(property_id)},
-            {"$set": data}
+            {"$set": data, "$inc": {"revision": 1}},
+            return_document=ReturnDocument.BEFORE
         )
 
-        if result.matched_count == 0:
+        if previous is None:
             return jsonify({"error": "Property not found"}), 404
 
-        updated_property = db_instance.properties.find_one({"_id": ObjectId(property_id)})
+        # The pre-image is needed for the stats deltas anyway, so the updated
+        # document is rebuilt locally instead of being returned by the server.
+        updated_property = {**previous, **data, 'revision': previous.get('revision', 0) + 1}
+        property_stats.record_update(previous, updated_property)
+        trends.record_update('properties', previous, updated_property)
+        touched = agent_counters.record_update('properties', previous, updated_property)
+        aggregation_cache.invalidate('properties')
+        read_coalescer.invalidate('properties')
+        conditional.touch('properties', *touched)
+
+        if prefers_minimal():
+            return minimal_response(200)
 
-        return jsonify(serialize_property(updated_property)), 200
+        return jsonify(updated_property), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @properties_bp.route('/<property_id>', methods=['DELETE'])
 def delete_property(property_id):
     try:
-        result = db_instance.properties.delete_one({"_id": ObjectId(property_id)})
+        deleted = db_instance.properties.find_one_and_delete({"_id": ObjectId(property_id)})
 
-        if result.deleted_count == 0:
+        if deleted is None:
             return jsonify({"error": "Property not found"}), 404
 
+        property_stats.record_delete(deleted)
+        trends.record_delete('properties', deleted)
+        touched = agent_counters.record_delete('properties', deleted)
+        aggregation_cache.invalidate('properties')
+        read_coalescer.invalidate('properties')
+        conditional.touch('properties', *touched)
+
         return jsonify({"message": "Property deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -1,37 +1,96 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime
 from database import db_instance
+from responses import minimal_response, prefers_minimal
+from streaming import stream_response
+import conditional
+from batch import delete_many, get_many, parse_ids, parse_updates, update_many
+from projection import build_projection, parse_fields
+from serialization import raw_documents
 
 users_bp = Blueprint('users', __name__)
 
-def serialize_user(user):
-    if user:
-        user['_id'] = str(user['_id'])
-        if 'createdAt' in user:
-            user['createdAt'] = user['createdAt'].isoformat()
-    return user
-
 @users_bp.route('/', methods=['GET'])
 def get_users():
     try:
-        users = list(db_instance.users.find())
+        etag, last_modified = conditional.collection_validators(['users'])
+        if conditional.is_not_modified(etag, last_modified):
+            return conditional.not_modified(etag, last_modified)
+
+        stream = request.args.get('stream')
+        if stream:
+            response = stream_response(raw_documents(db_instance.users).find(), stream)
+            return conditional.with_validators(response, etag, last_modified)
 
-        for user in users:
-            serialize_user(user)
+        users = list(raw_documents(db_instance.users).find())
 
-        return jsonify(users), 200
+        return conditional.with_validators(jsonify(users), etag, last_modified), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@users_bp.route('/batch-get', methods=['POST'])
+def batch_get_users():
+    try:
+        ids = parse_ids(request.get_json(silent=True))
+        projection = build_projection(parse_fields(request.args.get('fields')))
+
+        users, missing = get_many(raw_documents(db_instance.users), ids, projection)
+
+        return jsonify({"data": users, "missing": missing}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@users_bp.route('/batch-update', methods=['POST'])
+def batch_update_users():
+    try:
+        updates = parse_updates(request.get_json(silent=True))
+
+        updated, summary = update_many(db_instance.users, updates)
+
+        if updated:
+            conditional.touch('users')
+
+        return jsonify(summary), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@users_bp.route('/batch-delete', methods=['POST'])
+def batch_delete_users():
+    try:
+        ids = parse_ids(request.get_json(silent=True))
+
+        deleted, summary = delete_many(db_instance.users, ids)
+
+        if deleted:
+            conditional.touch('users')
+
+        return jsonify(summary), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @users_bp.route('/<user_id>', methods=['GET'])
 def get_user(user_id):
     try:
+        not_modified = conditional.check_document(db_instance.users, {"_id": ObjectId(user_id)})
+        if not_modified:
+            return not_modified
+
         user = db_instance.users.find_one({"_id": ObjectId(user_id)})
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        return jsonify(serialize_user(user)), 200
+        etag, last_modified = conditional.document_validators(user)
+        return conditional.with_validators(jsonify(user), etag, last_modified), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -40,12 +99,15 @@ def create_user():
     try:
         data = request.json
         data['createdAt'] = datetime.utcnow()
+        data.update(conditional.new_version_fields(data['createdAt']))
 
         result = db_instance.users.insert_one(data)
+        conditional.touch('users')
 
-        new_user = db_instance.users.find_one({"_id": result.inserted_id})
+        if prefers_minimal():
+            return minimal_response(201, f"{request.base_url.rstrip('/')}/{result.inserted_id}")
 
-        return jsonify(serialize_user(new_user)), 201
+        return jsonify(data), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -55,18 +117,24 @@ def update_user(user_id):
         data = request.json
         data.pop('_id', None)
         data.pop('createdAt', None)
+        data.pop('revision', None)
+        data['updatedAt'] = datetime.utcnow()
 
-        result = db_instance.users.update_one(
+        updated_user = db_instance.users.find_one_and_update(
             {"_id": ObjectId(user_id)},
-            {"$set": data}
+            {"$set": data, "$inc": {"revision": 1}},
+            return_document=ReturnDocument.AFTER
         )
 
-        if result.matched_count == 0:
+        if updated_user is None:
             return jsonify({"error": "User not found"}), 404
 
-        updated_user = db_instance.users.find_one({"_id": ObjectId(user_id)})
+        conditional.touch('users')
+
+        if prefers_minimal():
+            return minimal_response(200)
 
-        return jsonify(serialize_user(updated_user)), 200
+        return jsonify(updated_user), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -78,6 +146,8 @@ def delete_user(user_id):
         if result.deleted_count == 0:
             return jsonify({"error": "User not found"}), 404
 
+        conditional.touch('users')
+
         return jsonify({"message": "User deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
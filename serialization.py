@@ -0,0 +1,77 @@
+import json
+import os
+from datetime import date, datetime
+import bson
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# auto uses orjson when it is installed and the stdlib encoder otherwise
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
+if JSON_BACKEND not in ('auto', 'orjson', 'json'):
+    raise ValueError("JSON_BACKEND must be one of: auto, orjson, json")
+if JSON_BACKEND == 'orjson' and orjson is None:
+    raise ImportError("JSON_BACKEND=orjson needs orjson: pip install orjson")
+
+USE_ORJSON = orjson is not None and JSON_BACKEND != 'json'
+
+RAW_BSON_RESPONSES = os.getenv('RAW_BSON_RESPONSES', '1') != '0'
+
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+def default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, RawBSONDocument):
+        # Decoded only at encode time, one document at a time
+        return bson.decode(value.raw)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(obj, sort_keys=False, indent=False):
+    if USE_ORJSON:
+        option = 0
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(
+        obj, default=default, sort_keys=sort_keys, ensure_ascii=False,
+        indent=2 if indent else None, separators=None if indent else (',', ':')
+    ).encode('utf-8')
+
+def loads(data):
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def raw_documents(collection):
+    # Documents stay as undecoded BSON until they are written out, for
+    # responses that pass documents through without looking at them.
+    if not RAW_BSON_RESPONSES:
+        return collection
+    return collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+class MongoJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, sort_keys=self.sort_keys, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            dumps(obj, sort_keys=self.sort_keys, indent=indent) + b'\n',
+            mimetype=self.mimetype
+        )
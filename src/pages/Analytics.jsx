@@ -15,17 +15,12 @@ export default function Analytics() {
   const loadAnalytics = async () => {
     try {
       setLoading(true);
-      const [cityData, agentData, typeData, inquiryData] = await Promise.all([
-        api.aggregation.averagePriceByCity(),
-        api.aggregation.mostActiveAgents(),
-        api.aggregation.propertiesByType(),
-        api.aggregation.inquiryStatistics(),
-      ]);
+      const data = await api.aggregation.overview();
 
-      setAvgPriceByCity(cityData);
-      setActiveAgents(agentData);
-      setPropertiesByType(typeData);
-      setInquiryStats(inquiryData);
+      setAvgPriceByCity(data.averagePriceByCity);
+      setActiveAgents(data.mostActiveAgents);
+      setPropertiesByType(data.propertiesByType);
+      setInquiryStats(data.inquiryStatistics);
     } catch (error) {
       console.error('Error loading analytics:', error);
     } finally {
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { api } from '../services/api';
+import { api, applyChange } from '../services/api';
 
 export default function Inquiries() {
   const [inquiries, setInquiries] = useState([]);
@@ -7,12 +7,23 @@ export default function Inquiries() {
 
   useEffect(() => {
     loadInquiries();
+    // Polled while the stream is unavailable
+    const refresh = async () => {
+      try {
+        setInquiries(await api.inquiries.getAll({ expand: 'property,user' }));
+      } catch (error) {
+        console.error('Error refreshing inquiries:', error);
+      }
+    };
+    return api.inquiries.subscribe({}, (change) => {
+      setInquiries((current) => applyChange(current, change, { prependInserts: true }));
+    }, { refresh });
   }, []);
 
   const loadInquiries = async () => {
     try {
       setLoading(true);
-      const data = await api.inquiries.getAll();
+      const data = await api.inquiries.getAll({ expand: 'property,user' });
       setInquiries(data);
     } catch (error) {
       console.error('Error loading inquiries:', error);
@@ -24,7 +35,9 @@ export default function Inquiries() {
   const updateInquiryStatus = async (id, newStatus) => {
     try {
       await api.inquiries.update(id, { status: newStatus });
-      loadInquiries();
+      setInquiries((current) =>
+        current.map((inquiry) => (inquiry._id === id ? { ...inquiry, status: newStatus } : inquiry))
+      );
     } catch (error) {
       console.error('Error updating inquiry:', error);
     }
@@ -73,8 +86,8 @@ export default function Inquiries() {
             <thead>
               <tr>
                 <th>Date</th>
-                <th>Property ID</th>
-                <th>User ID</th>
+                <th>Property</th>
+                <th>User</th>
                 <th>Message</th>
                 <th>Status</th>
                 <th>Actions</th>
@@ -84,8 +97,8 @@ export default function Inquiries() {
               {inquiries.map((inquiry) => (
                 <tr key={inquiry._id}>
                   <td>{formatDate(inquiry.createdAt)}</td>
-                  <td style={{ fontSize: '12px', color: '#7f8c8d' }}>{inquiry.propertyId.slice(0, 8)}...</td>
-                  <td style={{ fontSize: '12px', color: '#7f8c8d' }}>{inquiry.userId.slice(0, 8)}...</td>
+                  <td>{inquiry.property ? inquiry.property.title : `${inquiry.propertyId.slice(0, 8)}...`}</td>
+                  <td>{inquiry.user ? inquiry.user.name : `${inquiry.userId.slice(0, 8)}...`}</td>
                   <td style={{ maxWidth: '300px' }}>{inquiry.message}</td>
                   <td>
                     <span
@@ -1,10 +1,15 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { api } from '../services/api';
+import { api, applyChange } from '../services/api';
+
+const PAGE_SIZE = 20;
 
 export default function Properties() {
   const [properties, setProperties] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [pageParams, setPageParams] = useState({});
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [filters, setFilters] = useState({
     city: '',
     propertyType: '',
@@ -20,19 +25,47 @@ export default function Properties() {
     loadProperties();
   }, []);
 
+  const pageParamsRef = useRef(pageParams);
+  pageParamsRef.current = pageParams;
+
+  // Inserts are left to the next load: they would land outside the sort
+  // order of the pages already fetched. While the stream is unavailable the
+  // first page is polled instead.
+  useEffect(() => {
+    const params = pageParams.city ? { city: pageParams.city } : {};
+    const refresh = async () => {
+      try {
+        const page = await api.properties.getAll(pageParamsRef.current);
+        setProperties(page.data);
+        setNextCursor(page.nextCursor);
+      } catch (error) {
+        console.error('Error refreshing properties:', error);
+      }
+    };
+    return api.properties.subscribe(params, (change) => {
+      setProperties((current) => applyChange(current, change));
+    }, { refresh });
+  }, [pageParams.city]);
+
+  const buildParams = () => {
+    const params = { limit: PAGE_SIZE };
+    if (filters.city) params.city = filters.city;
+    if (filters.propertyType) params.propertyType = filters.propertyType;
+    if (filters.minPrice) params.minPrice = filters.minPrice;
+    if (filters.maxPrice) params.maxPrice = filters.maxPrice;
+    if (filters.sortBy) params.sortBy = filters.sortBy;
+    if (filters.order) params.order = filters.order;
+    return params;
+  };
+
   const loadProperties = async () => {
     try {
       setLoading(true);
-      const params = {};
-      if (filters.city) params.city = filters.city;
-      if (filters.propertyType) params.propertyType = filters.propertyType;
-      if (filters.minPrice) params.minPrice = filters.minPrice;
-      if (filters.maxPrice) params.maxPrice = filters.maxPrice;
-      if (filters.sortBy) params.sortBy = filters.sortBy;
-      if (filters.order) params.order = filters.order;
-
-      const data = await api.properties.getAll(params);
-      setProperties(data);
+      const params = buildParams();
+      const page = await api.properties.getAll(params);
+      setPageParams(params);
+      setProperties(page.data);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Error loading properties:', error);
     } finally {
@@ -40,6 +73,19 @@ export default function Properties() {
     }
   };
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const page = await api.properties.getAll({ ...pageParams, cursor: nextCursor });
+      setProperties((current) => [...current, ...page.data]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error loading properties:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleFilterChange = (e) => {
     setFilters({ ...filters, [e.target.name]: e.target.value });
   };
@@ -183,6 +229,14 @@ export default function Properties() {
           ))}
         </div>
       )}
+
+      {nextCursor && (
+        <div style={{ display: 'flex', justifyContent: 'center', marginTop: '24px' }}>
+          <button className="btn btn-secondary" onClick={loadMore} disabled={loadingMore}>
+            {loadingMore ? 'Loading...' : 'Load More'}
+          </button>
+        </div>
+      )}
     </div>
   );
 }
@@ -1,5 +1,93 @@
 const API_BASE_URL = '/api';
 
+const RETRY_MIN_MS = 2000;
+const RETRY_MAX_MS = 60000;
+const POLL_MS = 15000;
+
+// EventSource reconnects on its own after a dropped connection and sends the
+// last event id, so the server resumes the change stream where this client
+// left off. It gives up for good when the server answers with an error
+// status (503 when the server has no free subscriber slots, 410 when the
+// resume point has expired), so then the stream is reopened from scratch with
+// backoff, and `refresh` (which reloads the page's list) is polled meanwhile
+// so nothing is missed.
+const subscribe = (path, params, onChange, { refresh } = {}) => {
+  const queryString = new URLSearchParams(params).toString();
+  const url = `${API_BASE_URL}/${path}/changes${queryString ? `?${queryString}` : ''}`;
+  let source = null;
+  let retryTimer = null;
+  let pollTimer = null;
+  let delay = RETRY_MIN_MS;
+
+  const stopPolling = () => {
+    clearInterval(pollTimer);
+    pollTimer = null;
+  };
+
+  const startPolling = () => {
+    if (!refresh || pollTimer) return;
+    refresh();
+    pollTimer = setInterval(refresh, POLL_MS);
+  };
+
+  const connect = () => {
+    source = new EventSource(url);
+    source.onopen = () => {
+      delay = RETRY_MIN_MS;
+      stopPolling();
+    };
+    source.onmessage = (event) => onChange(JSON.parse(event.data));
+    source.onerror = () => {
+      // CONNECTING means the browser is already retrying by itself
+      if (source.readyState !== EventSource.CLOSED) return;
+      startPolling();
+      retryTimer = setTimeout(connect, delay);
+      delay = Math.min(delay * 2, RETRY_MAX_MS);
+    };
+  };
+
+  connect();
+  return () => {
+    clearTimeout(retryTimer);
+    stopPolling();
+    source.close();
+  };
+};
+
+// Resolves up to 1000 ids in one request; the result keeps the order of ids
+// and lists the ones that were not found under `missing`.
+const batchGet = async (path, ids, params = {}) => {
+  const queryString = new URLSearchParams(params).toString();
+  const response = await fetch(`${API_BASE_URL}/${path}/batch-get${queryString ? `?${queryString}` : ''}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ids }),
+  });
+  return response.json();
+};
+
+export const applyChange = (items, change, { prependInserts = false } = {}) => {
+  switch (change.op) {
+    case 'insert':
+      return prependInserts && !items.some((item) => item._id === change._id)
+        ? [change.document, ...items]
+        : items;
+    case 'replace':
+      return items.map((item) => (item._id === change._id ? { ...item, ...change.document } : item));
+    case 'update':
+      return items.map((item) => {
+        if (item._id !== change._id) return item;
+        const updated = { ...item, ...change.updatedFields };
+        change.removedFields.forEach((field) => delete updated[field]);
+        return updated;
+      });
+    case 'delete':
+      return items.filter((item) => item._id !== change._id);
+    default:
+      return items;
+  }
+};
+
 export const api = {
   properties: {
     getAll: async (params = {}) => {
@@ -8,10 +96,17 @@ export const api = {
       const response = await fetch(url);
       return response.json();
     },
+    subscribe: (params, onChange, options) => subscribe('properties', params, onChange, options),
+    search: async (params = {}) => {
+      const queryString = new URLSearchParams(params).toString();
+      const response = await fetch(`${API_BASE_URL}/properties/search${queryString ? `?${queryString}` : ''}`);
+      return response.json();
+    },
     getById: async (id) => {
       const response = await fetch(`${API_BASE_URL}/properties/${id}`);
       return response.json();
     },
+    getMany: (ids, params) => batchGet('properties', ids, params),
     create: async (data) => {
       const response = await fetch(`${API_BASE_URL}/properties`, {
         method: 'POST',
@@ -47,6 +142,7 @@ export const api = {
       const response = await fetch(`${API_BASE_URL}/agents/${id}`);
       return response.json();
     },
+    getMany: (ids, params) => batchGet('agents', ids, params),
     create: async (data) => {
       const response = await fetch(`${API_BASE_URL}/agents`, {
         method: 'POST',
@@ -78,6 +174,7 @@ export const api = {
       const response = await fetch(url);
       return response.json();
     },
+    subscribe: (params, onChange, options) => subscribe('inquiries', params, onChange, options),
     create: async (data) => {
       const response = await fetch(`${API_BASE_URL}/inquiries`, {
         method: 'POST',
@@ -101,6 +198,7 @@ export const api = {
       const response = await fetch(`${API_BASE_URL}/users`);
       return response.json();
     },
+    getMany: (ids, params) => batchGet('users', ids, params),
     create: async (data) => {
       const response = await fetch(`${API_BASE_URL}/users`, {
         method: 'POST',
@@ -112,6 +210,10 @@ export const api = {
   },
 
   aggregation: {
+    overview: async () => {
+      const response = await fetch(`${API_BASE_URL}/aggregation/overview`);
+      return response.json();
+    },
     averagePriceByCity: async () => {
       const response = await fetch(`${API_BASE_URL}/aggregation/average-price-by-city`);
       return response.json();
@@ -132,6 +234,15 @@ export const api = {
       const response = await fetch(`${API_BASE_URL}/aggregation/price-range-distribution`);
       return response.json();
     },
+    trends: async (source, params = {}) => {
+      const queryString = new URLSearchParams(params).toString();
+      const response = await fetch(`${API_BASE_URL}/aggregation/trends/${source}${queryString ? `?${queryString}` : ''}`);
+      return response.json();
+    },
+    distribution: async (by = 'city') => {
+      const response = await fetch(`${API_BASE_URL}/aggregation/distribution?by=${by}`);
+      return response.json();
+    },
   },
 
   initDb: async () => {
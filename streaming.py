@@ -0,0 +1,72 @@
+import os
+from itertools import chain
+from flask import Response
+from serialization import dumps, loads
+
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+def iter_ndjson_batches(stream, batch_size):
+    # Yields (records, errors) per batch; records are (line number, document)
+    # pairs and errors are (line number, message) for lines that didn't parse.
+    records = []
+    errors = []
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            doc = loads(line)
+        except ValueError as e:
+            errors.append((line_number, f"Invalid JSON: {e}"))
+            continue
+        if not isinstance(doc, dict):
+            errors.append((line_number, "Each line must be a JSON object"))
+            continue
+        records.append((line_number, doc))
+        if len(records) >= batch_size:
+            yield records, errors
+            records = []
+            errors = []
+    if records or errors:
+        yield records, errors
+
+def stream_response(cursor, fmt):
+    if fmt not in STREAM_FORMATS:
+        raise ValueError("stream must be one of: " + ", ".join(STREAM_FORMATS))
+
+    cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+
+    # Run the query and fetch its first batch before any headers go out, so a
+    # failing query is answered with an error status instead of a truncated 200.
+    try:
+        first = next(cursor, None)
+    except Exception:
+        cursor.close()
+        raise
+    docs = chain([first], cursor) if first is not None else iter(())
+
+    def generate_ndjson():
+        try:
+            for doc in docs:
+                yield dumps(doc) + b'\n'
+        finally:
+            cursor.close()
+
+    def generate_json_array():
+        try:
+            yield b'['
+            separator = b''
+            for doc in docs:
+                yield separator + dumps(doc)
+                separator = b','
+            yield b']'
+        finally:
+            cursor.close()
+
+    generate = generate_ndjson if fmt == 'ndjson' else generate_json_array
+    return Response(generate(), status=200, mimetype=STREAM_FORMATS[fmt])
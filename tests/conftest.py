@@ -0,0 +1,15 @@
+import os
+import sys
+import mongomock
+import pytest
+
+# The app is a set of top-level modules run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def db():
+    # A fresh in-memory database per test (pip install mongomock)
+    from database import db_instance
+    db_instance.bind(mongomock.MongoClient())
+    yield db_instance
+    db_instance.close()
@@ -0,0 +1,31 @@
+from bson import ObjectId
+import agent_counters
+
+def _versions(db):
+    return {doc['_id']: doc['version'] for doc in db.collection_versions.find()}
+
+def test_listing_writes_return_the_agents_they_touched(db):
+    agent_id = db.agents.insert_one({"name": "Ada", **agent_counters.zero_counters()}).inserted_id
+    listing = {"_id": ObjectId(), "agentId": agent_id, "status": "Available", "price": 250000}
+
+    assert agent_counters.record_insert('properties', listing) == ('agents',)
+    assert db.agents.find_one({"_id": agent_id})['activeListings'] == 1
+    # Versions are left to the caller, which touches them with its own
+    assert _versions(db) == {}
+
+def test_writes_that_change_no_counter_touch_nothing(db):
+    sold = {"_id": ObjectId(), "agentId": ObjectId(), "status": "Sold", "price": 250000}
+
+    assert agent_counters.record_insert('properties', sold) == ()
+    assert agent_counters.record_update('properties', sold, {**sold, "price": 1}) == ()
+
+def test_property_create_bumps_both_versions(db):
+    from app import app
+    agent_id = db.agents.insert_one({"name": "Ada", **agent_counters.zero_counters()}).inserted_id
+
+    response = app.test_client().post('/api/properties/', json={
+        "title": "Loft", "price": 300000, "city": "Lyon", "agentId": str(agent_id)
+    })
+
+    assert response.status_code == 201
+    assert _versions(db) == {'properties': 1, 'agents': 1}
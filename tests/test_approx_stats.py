@@ -0,0 +1,34 @@
+import approx_stats
+import property_stats
+
+LISTINGS = [
+    {"city": "Lyon", "propertyType": "House", "price": 300000},
+    {"city": "Lyon", "propertyType": "House", "price": 500000},
+    # Stored as sent by POST /api/properties
+    {"city": "Lyon", "propertyType": "Flat", "price": "450000"},
+    {"city": "Nice", "propertyType": "Flat", "price": 200000},
+    {"city": "Nice", "propertyType": "Flat"}
+]
+
+def test_non_numeric_prices_are_left_out_like_the_exact_stats(db):
+    db.properties.insert_many([dict(listing) for listing in LISTINGS])
+    property_stats.rebuild()
+
+    approx = {row['city']: row for row in approx_stats.average_price_by_city()['data']}
+    exact = {row['city']: row for row in property_stats.average_price_by_city()}
+
+    assert set(approx) == set(exact) == {'Lyon', 'Nice'}
+    for city, row in exact.items():
+        assert approx[city]['averagePrice'] == row['averagePrice']
+        assert approx[city]['propertyCount'] == row['propertyCount']
+    assert approx['Lyon']['averagePrice'] == 400000
+    assert approx['Lyon']['propertyCount'] == 3
+
+def test_groups_without_numeric_prices_have_no_average(db):
+    db.properties.insert_many([{"city": "Caen", "propertyType": "Land", "price": "n/a"}])
+
+    rows, meta = approx_stats.estimate_groups('city')
+
+    assert meta['exact']
+    assert rows[0]['averagePrice'] is None
+    assert rows[0]['averagePriceCI'] is None
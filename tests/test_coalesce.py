@@ -0,0 +1,152 @@
+import threading
+import pytest
+from coalesce import SingleFlight
+
+def start(flights, key, compute, tags=(), results=None):
+    def run():
+        try:
+            results.append(flights.run(key, compute, tags))
+        except Exception as e:
+            results.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def blocking(value, started, release):
+    def compute():
+        started.set()
+        release.wait(5)
+        return value
+    return compute
+
+def wait_joined(flights, count):
+    # Followers count themselves before waiting on the leader
+    for _ in range(500):
+        if flights.coalesced >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("followers did not join")
+
+def test_concurrent_reads_share_one_execution():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    results = []
+    leader = start(flights, 'k', blocking('first', started, release), ('properties',), results)
+    started.wait(5)
+    followers = [start(flights, 'k', lambda: 'second', ('properties',), results) for _ in range(3)]
+    wait_joined(flights, 3)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert results == ['first'] * 4
+    assert (flights.executed, flights.coalesced) == (1, 3)
+
+def test_read_after_invalidate_gets_a_new_leader():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    old_results, new_results = [], []
+    old = start(flights, 'k', blocking('before write', started, release), ('properties',), old_results)
+    started.wait(5)
+    follower = start(flights, 'k', lambda: 'unused', ('properties',), old_results)
+    wait_joined(flights, 1)
+
+    flights.invalidate('properties')
+    assert flights.run('k', lambda: 'after write', ('properties',)) == 'after write'
+
+    release.set()
+    old.join(5)
+    follower.join(5)
+    assert old_results == ['before write', 'before write']
+    assert flights.executed == 2
+
+def test_replaced_leader_does_not_remove_the_newer_flight():
+    flights = SingleFlight()
+    old_started, old_release = threading.Event(), threading.Event()
+    new_started, new_release = threading.Event(), threading.Event()
+    results = []
+    old = start(flights, 'k', blocking('old', old_started, old_release), ('properties',), results)
+    old_started.wait(5)
+    flights.invalidate('properties')
+    new = start(flights, 'k', blocking('new', new_started, new_release), ('properties',), results)
+    new_started.wait(5)
+
+    # The old leader finishing must leave the newer flight joinable
+    old_release.set()
+    old.join(5)
+    follower = start(flights, 'k', lambda: 'unused', ('properties',), results)
+    wait_joined(flights, 1)
+    new_release.set()
+    new.join(5)
+    follower.join(5)
+    assert results == ['old', 'new', 'new']
+    assert flights.executed == 2
+
+def test_errors_reach_followers_and_are_not_shared_afterwards():
+    flights = SingleFlight(window=60)
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    leader = start(flights, 'k', failing, (), results)
+    started.wait(5)
+    follower = start(flights, 'k', lambda: 'unused', (), results)
+    wait_joined(flights, 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert [str(result) for result in results] == ['boom', 'boom']
+    assert flights.run('k', lambda: 'recovered') == 'recovered'
+
+def test_window_reuses_results_until_invalidated():
+    flights = SingleFlight(window=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert flights.run('k', compute, ('properties',)) == 1
+    assert flights.run('k', compute, ('properties',)) == 1
+    assert flights.cached == 1
+    flights.invalidate('properties')
+    assert flights.run('k', compute, ('properties',)) == 2
+
+def test_window_skips_results_invalidated_while_computing():
+    flights = SingleFlight(window=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        if len(calls) == 1:
+            flights.invalidate('properties')
+        return len(calls)
+
+    assert flights.run('k', compute, ('properties',)) == 1
+    assert flights.run('k', compute, ('properties',)) == 2
+
+def test_window_ends_when_another_process_writes():
+    versions = {'properties': 1}
+    flights = SingleFlight(window=60, versions=lambda tags: tuple(versions[tag] for tag in tags))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert flights.run('k', compute, ('properties',)) == 1
+    assert flights.run('k', compute, ('properties',)) == 1
+    versions['properties'] = 2
+    assert flights.run('k', compute, ('properties',)) == 2
+
+@pytest.mark.parametrize('window', [0, 60])
+def test_disabled_always_computes(window):
+    flights = SingleFlight(enabled=False, window=window)
+    calls = []
+    for _ in range(3):
+        flights.run('k', lambda: calls.append(1))
+    assert len(calls) == 3
+    assert flights.stats()['executed'] == 0
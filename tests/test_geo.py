@@ -0,0 +1,57 @@
+import math
+import geo
+
+# A 60 degree wide viewport: one polygon piece
+WIDE_BOX = ((-60.0, 25.0), (0.0, 40.0))
+
+def _edge_latitude(edge, longitude):
+    # Latitude of the great-circle edge segment that spans `longitude`, which
+    # is how MongoDB draws the edges of a $geometry polygon
+    for (lon1, lat1), (lon2, lat2) in zip(edge, edge[1:]):
+        if min(lon1, lon2) <= longitude <= max(lon1, lon2):
+            l1, p1, l2, p2, lon = map(math.radians, (lon1, lat1, lon2, lat2, longitude))
+            return math.degrees(math.atan(
+                (math.tan(p1) * math.sin(l2 - lon) + math.tan(p2) * math.sin(lon - l1)) / math.sin(l2 - l1)
+            ))
+    raise AssertionError(f"no edge spans longitude {longitude}")
+
+def _inside(geometry, longitude, latitude):
+    pieces = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+    for (ring,) in pieces:
+        # The ring runs west to east along the south edge and back along the
+        # north edge
+        south_edge = [vertex for vertex in ring[:-1] if vertex[1] == ring[0][1]]
+        north_edge = [vertex for vertex in ring[:-1] if vertex[1] != ring[0][1]]
+        if not south_edge[0][0] <= longitude <= south_edge[-1][0]:
+            continue
+        if _edge_latitude(south_edge, longitude) < latitude < _edge_latitude(north_edge, longitude):
+            return True
+    return False
+
+def test_wide_box_edges_follow_their_parallels():
+    geometry = geo.within_box(WIDE_BOX)['$geoWithin']['$geometry']
+
+    # Half a kilometre either side of each edge, mid-box where a single
+    # great circle would bulge by over 3 degrees
+    margin = 0.005
+    assert _inside(geometry, -30, 25 + margin)
+    assert not _inside(geometry, -30, 25 - margin)
+    assert _inside(geometry, -30, 40 - margin)
+    assert not _inside(geometry, -30, 40 + margin)
+
+def test_edge_vertices_are_spaced_along_the_parallel():
+    ring = geo.within_box(WIDE_BOX)['$geoWithin']['$geometry']['coordinates'][0]
+
+    assert ring[0] == ring[-1]
+    for (lon1, lat1), (lon2, lat2) in zip(ring, ring[1:]):
+        if lat1 == lat2:
+            assert abs(lon2 - lon1) <= geo.EDGE_VERTEX_SPACING
+    assert {vertex[1] for vertex in ring} == {25.0, 40.0}
+
+def test_box_across_the_antimeridian_is_split_into_pieces():
+    geometry = geo.within_box(((170.0, -10.0), (-170.0, 10.0)))['$geoWithin']['$geometry']
+
+    assert geometry['type'] == 'MultiPolygon'
+    assert _inside(geometry, 175, 0)
+    assert _inside(geometry, -175, 0)
+    assert not _inside(geometry, 0, 0)
@@ -0,0 +1,188 @@
+import os
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from database import db_instance
+from references import reference_filter
+
+INTERVALS = ['day', 'week', 'month']
+
+# Points per series after gap filling; a wider range is rejected rather than
+# filled bucket by bucket
+MAX_POINTS = int(os.getenv('TREND_MAX_POINTS', '1000'))
+
+# Rolled-up dimensions per source collection; 'all' is the unsplit total
+TREND_DIMENSIONS = {
+    'properties': ['all', 'city', 'propertyType', 'agentId'],
+    'inquiries': ['all', 'agentId']
+}
+
+# Creation counts (and listing price sums) per createdAt bucket, kept in
+# trend_rollups with the same commutative $inc deltas as property_stats.
+# Each bucket is stored at every interval so a chart reads one document per
+# point: two years of monthly points is 24 documents per series.
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date")
+
+def bucket_start(moment, interval):
+    day = datetime(moment.year, moment.month, moment.day)
+    if interval == 'day':
+        return day
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return datetime(moment.year, moment.month, 1)
+
+def next_bucket(bucket, interval):
+    if interval == 'day':
+        return bucket + timedelta(days=1)
+    if interval == 'week':
+        return bucket + timedelta(days=7)
+    if bucket.month == 12:
+        return datetime(bucket.year + 1, 1, 1)
+    return datetime(bucket.year, bucket.month + 1, 1)
+
+def bucket_count(first, last, interval):
+    if last < first:
+        return 0
+    if interval == 'day':
+        return (last - first).days + 1
+    if interval == 'week':
+        return (last - first).days // 7 + 1
+    return (last.year - first.year) * 12 + last.month - first.month + 1
+
+def _changes(source, doc, sign):
+    created = doc.get('createdAt')
+    if not isinstance(created, datetime):
+        return []
+    inc = {'count': sign}
+    price = doc.get('price')
+    if source == 'properties' and isinstance(price, (int, float)) and not isinstance(price, bool):
+        inc['pricedCount'] = sign
+        inc['totalPrice'] = sign * price
+    changes = []
+    for dimension in TREND_DIMENSIONS[source]:
+        key = None if dimension == 'all' else doc.get(dimension)
+        for interval in INTERVALS:
+            changes.append(((source, interval, dimension, key, bucket_start(created, interval)), inc))
+    return changes
+
+def _merge(changes, merged=None):
+    merged = {} if merged is None else merged
+    for group, inc in changes:
+        totals = merged.setdefault(group, {})
+        for field, delta in inc.items():
+            totals[field] = totals.get(field, 0) + delta
+    return merged
+
+def _filter(group):
+    source, interval, dimension, key, bucket = group
+    return {'source': source, 'interval': interval, 'dimension': dimension, 'key': key, 'bucket': bucket}
+
+def _apply(changes):
+    ops = []
+    emptied = []
+    for group, inc in _merge(changes).items():
+        inc = {field: delta for field, delta in inc.items() if delta}
+        if not inc:
+            continue
+        ops.append(UpdateOne(_filter(group), {'$inc': inc}, upsert=True))
+        if inc.get('count', 0) < 0:
+            emptied.append(group)
+
+    if ops:
+        db_instance.trend_rollups.bulk_write(ops, ordered=False)
+    for group in emptied:
+        db_instance.trend_rollups.delete_one({**_filter(group), 'count': {'$lte': 0}})
+
+def record_insert(source, doc):
+    _apply(_changes(source, doc, 1))
+
+def record_delete(source, doc):
+    _apply(_changes(source, doc, -1))
+
+def record_update(source, old_doc, new_doc):
+    _apply(_changes(source, old_doc, -1) + _changes(source, new_doc, 1))
+
+def record_many(source, pairs):
+    changes = []
+    for old_doc, new_doc in pairs:
+        if old_doc is not None:
+            changes += _changes(source, old_doc, -1)
+        if new_doc is not None:
+            changes += _changes(source, new_doc, 1)
+    _apply(changes)
+
+def rebuild():
+    docs = []
+    for source, dimensions in TREND_DIMENSIONS.items():
+        fields = {'_id': 0, 'createdAt': 1, 'price': 1, **{field: 1 for field in dimensions if field != 'all'}}
+        merged = {}
+        for doc in db_instance.db[source].find({}, fields).batch_size(5000):
+            _merge(_changes(source, doc, 1), merged)
+        docs += [{**_filter(group), **totals} for group, totals in merged.items()]
+
+    # Built aside and renamed over the live collection, so readers never see
+    # it half-filled
+    staging = db_instance.db['trend_rollups_rebuild']
+    staging.drop()
+    if docs:
+        staging.insert_many(docs)
+    db_instance.create_trend_rollup_index(staging)
+    staging.rename(db_instance.trend_rollups.name, dropTarget=True)
+    return len(docs)
+
+def _point(bucket, doc, priced):
+    point = {"bucket": bucket, "count": doc['count'] if doc else 0}
+    if priced:
+        point['averagePrice'] = (
+            round(doc['totalPrice'] / doc['pricedCount'], 2) if doc and doc.get('pricedCount') else None
+        )
+    return point
+
+def series(source, interval, dimension='all', key=None, start=None, end=None, limit=None):
+    query = {'source': source, 'interval': interval, 'dimension': dimension, 'count': {'$gt': 0}}
+    if key is not None:
+        query['key'] = reference_filter(key)
+    if start or end:
+        query['bucket'] = {}
+        if start:
+            query['bucket']['$gte'] = bucket_start(start, interval)
+        if end:
+            query['bucket']['$lte'] = end
+
+    by_key = {}
+    for doc in db_instance.trend_rollups.find(query, {'_id': 0, 'key': 1, 'bucket': 1, 'count': 1,
+                                                        'pricedCount': 1, 'totalPrice': 1}):
+        by_key.setdefault(doc['key'], {})[doc['bucket']] = doc
+
+    # Ranked and cut by the stored totals first (empty buckets add nothing),
+    # so only the series that are returned get their gaps filled
+    ranked = sorted(by_key.items(), key=lambda item: sum(doc['count'] for doc in item[1].values()), reverse=True)
+    if limit:
+        ranked = ranked[:limit]
+
+    ranges = []
+    for series_key, buckets in ranked:
+        first = bucket_start(start, interval) if start else min(buckets)
+        last = bucket_start(end, interval) if end else max(buckets)
+        points = bucket_count(first, last, interval)
+        if points > MAX_POINTS:
+            raise ValueError(f"The range covers {points} {interval} buckets; at most {MAX_POINTS} are returned, "
+                             "so narrow from/to or use a longer interval")
+        ranges.append((series_key, buckets, first, last))
+
+    result = []
+    for series_key, buckets, bucket, last in ranges:
+        # Empty buckets have no document; they are filled in as zeros so
+        # every series is continuous over the requested range.
+        points = []
+        while bucket <= last:
+            points.append(_point(bucket, buckets.get(bucket), source == 'properties'))
+            bucket = next_bucket(bucket, interval)
+        result.append({"key": series_key, "series": points})
+    return result